@@ -15,6 +15,21 @@ from . import api
 from . import database
 from . import models
 from . import utils
+from . import a2s
+from . import log_buffer
+from . import history
+from . import cache
+from . import repository
+from . import broadcast
+from . import outbox
+from . import player_import
+from . import leaderboard
+from . import log_ingest
+from . import sessions
+from . import metrics
+from . import profiling
+from . import migrations
+from . import retention
 
 # 导出常用功能
 __all__ = [
@@ -24,5 +39,20 @@ __all__ = [
     "api",
     "database",
     "models",
-    "utils"
+    "utils",
+    "a2s",
+    "log_buffer",
+    "history",
+    "cache",
+    "repository",
+    "broadcast",
+    "outbox",
+    "player_import",
+    "leaderboard",
+    "log_ingest",
+    "sessions",
+    "metrics",
+    "profiling",
+    "migrations",
+    "retention"
 ]
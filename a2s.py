@@ -0,0 +1,423 @@
+import asyncio
+import bz2
+import struct
+import zlib
+from settings import get_config
+
+# Steam A2S 服务器查询协议（asyncio UDP实现）
+# 协议说明: https://developer.valvesoftware.com/wiki/Server_queries
+
+# 包头
+SINGLE_PACKET = -1
+SPLIT_PACKET = -2
+
+# 请求与响应类型
+A2S_INFO = 0x54
+A2S_INFO_RESPONSE = 0x49
+A2S_PLAYER = 0x55
+A2S_PLAYER_RESPONSE = 0x44
+A2S_RULES = 0x56
+A2S_RULES_RESPONSE = 0x45
+S2C_CHALLENGE = 0x41
+
+INFO_PAYLOAD = b"Source Engine Query\x00"
+NO_CHALLENGE = b"\xFF\xFF\xFF\xFF"
+
+# 单个UDP包的最大长度
+MAX_PACKET_SIZE = 1400
+# 挑战码最多重发次数
+MAX_CHALLENGE_ROUNDS = 3
+
+_HEADER = struct.Struct("<l")
+_SPLIT_HEADER = struct.Struct("<lBBh")
+_COMPRESSION_HEADER = struct.Struct("<lL")
+
+class A2SError(Exception):
+    """A2S查询失败（响应格式错误、连接被拒绝等）"""
+
+class _Reader:
+    """基于memoryview的响应解析器，按偏移读取，不复制缓冲区"""
+    
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.offset = offset
+    
+    def _unpack(self, fmt):
+        try:
+            value = struct.unpack_from(fmt, self.view, self.offset)[0]
+        except struct.error as e:
+            raise A2SError(f"响应数据不完整: {str(e)}")
+        self.offset += struct.calcsize(fmt)
+        return value
+    
+    def byte(self):
+        return self._unpack("<B")
+    
+    def short(self):
+        return self._unpack("<h")
+    
+    def long(self):
+        return self._unpack("<l")
+    
+    def float(self):
+        return self._unpack("<f")
+    
+    def long_long(self):
+        return self._unpack("<Q")
+    
+    def string(self):
+        end = self.buffer.find(b"\x00", self.offset)
+        if end < 0:
+            raise A2SError("响应数据不完整: 字符串缺少结束符")
+        value = str(self.view[self.offset:end], "utf-8", "replace")
+        self.offset = end + 1
+        return value
+    
+    def remaining(self):
+        return len(self.buffer) - self.offset
+
+class _A2SProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self.packets = asyncio.Queue()
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data, addr):
+        self.packets.put_nowait(data)
+    
+    def error_received(self, exc):
+        # 目标端口不可达等ICMP错误会在这里返回，直接交给等待方
+        self.packets.put_nowait(exc)
+
+class A2SConnection:
+    """单个服务器的A2S查询连接，同一连接上的请求需顺序执行"""
+    
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._transport = None
+        self._protocol = None
+    
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self._transport, self._protocol = await loop.create_datagram_endpoint(
+            _A2SProtocol, remote_addr=(self.host, self.port)
+        )
+        return self
+    
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+    
+    async def __aenter__(self):
+        return await self.open()
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+    
+    async def _next_packet(self):
+        packet = await self._protocol.packets.get()
+        if isinstance(packet, Exception):
+            raise A2SError(f"服务器不可达: {str(packet)}")
+        return packet
+    
+    async def _receive(self):
+        """接收一个完整响应，返回 (缓冲区, 负载起始偏移)"""
+        try:
+            return await self._reassemble()
+        except struct.error as e:
+            # 包的长度不足以包含包头
+            raise A2SError(f"响应数据不完整: {str(e)}")
+    
+    async def _reassemble(self):
+        packet = await self._next_packet()
+        header = _HEADER.unpack_from(packet)[0]
+        if header == SINGLE_PACKET:
+            return packet, _HEADER.size
+        if header != SPLIT_PACKET:
+            raise A2SError(f"未知的响应包头: {header}")
+        
+        request_id, total = _SPLIT_HEADER.unpack_from(packet, _HEADER.size)[:2]
+        parts = {}
+        compressed = None
+        while True:
+            request_id_part, _total, number, _size = _SPLIT_HEADER.unpack_from(packet, _HEADER.size)
+            offset = _HEADER.size + _SPLIT_HEADER.size
+            if request_id_part == request_id and number < total:
+                if number == 0 and request_id & 0x80000000:
+                    compressed = _COMPRESSION_HEADER.unpack_from(packet, offset)
+                    offset += _COMPRESSION_HEADER.size
+                # 只保存分片视图，最终拼接时才复制一次
+                parts[number] = memoryview(packet)[offset:]
+            if len(parts) == total:
+                break
+            packet = await self._next_packet()
+            while _HEADER.unpack_from(packet)[0] != SPLIT_PACKET:
+                # 分包过程中收到的其他响应属于过期请求，直接丢弃
+                packet = await self._next_packet()
+        
+        payload = b"".join(parts[i] for i in range(total))
+        if compressed is not None:
+            size, checksum = compressed
+            try:
+                payload = bz2.decompress(payload)
+            except (OSError, ValueError) as e:
+                raise A2SError(f"分包响应解压失败: {str(e)}")
+            if len(payload) != size or zlib.crc32(payload) != checksum:
+                raise A2SError("分包响应解压校验失败")
+        if _HEADER.unpack_from(payload)[0] != SINGLE_PACKET:
+            raise A2SError("分包响应包头错误")
+        return payload, _HEADER.size
+    
+    async def request(self, request_type, payload, expected):
+        """发送请求并处理挑战码，返回定位到响应内容的解析器"""
+        challenge = NO_CHALLENGE if request_type != A2S_INFO else b""
+        for _ in range(MAX_CHALLENGE_ROUNDS):
+            self._transport.sendto(_HEADER.pack(SINGLE_PACKET) + bytes((request_type,)) + payload + challenge)
+            while True:
+                buffer, offset = await self._receive()
+                if len(buffer) <= offset:
+                    raise A2SError("响应数据不完整: 缺少响应类型")
+                response_type = buffer[offset]
+                if response_type == S2C_CHALLENGE or response_type == expected:
+                    break
+                # 忽略之前超时请求的迟到响应
+            if response_type == expected:
+                return _Reader(buffer, offset + 1)
+            challenge = bytes(memoryview(buffer)[offset + 1:offset + 5])
+        raise A2SError("服务器持续返回挑战码")
+    
+    async def info(self):
+        reader = await self.request(A2S_INFO, INFO_PAYLOAD, A2S_INFO_RESPONSE)
+        info = {
+            "protocol": reader.byte(),
+            "name": reader.string(),
+            "map": reader.string(),
+            "folder": reader.string(),
+            "game": reader.string(),
+            "app_id": reader.short() & 0xFFFF,
+            "players": reader.byte(),
+            "max_players": reader.byte(),
+            "bots": reader.byte(),
+            "server_type": chr(reader.byte()),
+            "environment": chr(reader.byte()),
+            "visibility": reader.byte(),
+            "vac": reader.byte(),
+            "version": reader.string(),
+            "port": None,
+            "steam_id": None,
+            "keywords": None,
+            "game_id": None
+        }
+        
+        # 扩展数据
+        if reader.remaining() > 0:
+            edf = reader.byte()
+            if edf & 0x80:
+                info["port"] = reader.short() & 0xFFFF
+            if edf & 0x10:
+                info["steam_id"] = reader.long_long()
+            if edf & 0x40:
+                reader.short()
+                reader.string()
+            if edf & 0x20:
+                info["keywords"] = reader.string()
+            if edf & 0x01:
+                info["game_id"] = reader.long_long()
+        return info
+    
+    async def players(self):
+        reader = await self.request(A2S_PLAYER, b"", A2S_PLAYER_RESPONSE)
+        count = reader.byte()
+        players = []
+        for _ in range(count):
+            if reader.remaining() <= 0:
+                break
+            players.append({
+                "index": reader.byte(),
+                "name": reader.string(),
+                "score": reader.long(),
+                "duration": reader.float()
+            })
+        return players
+    
+    async def rules(self):
+        reader = await self.request(A2S_RULES, b"", A2S_RULES_RESPONSE)
+        count = reader.short()
+        rules = {}
+        for _ in range(count):
+            if reader.remaining() <= 0:
+                break
+            name = reader.string()
+            rules[name] = reader.string()
+        return rules
+
+async def _query(host, port, timeout, method):
+    async def run():
+        async with A2SConnection(host, port) as connection:
+            return await getattr(connection, method)()
+    
+    return await asyncio.wait_for(run(), timeout)
+
+# 查询服务器基础信息
+async def query_info(host, port, timeout=None):
+    return await _query(host, port, timeout or get_config().SERVER_TIMEOUT, "info")
+
+# 查询在线玩家列表
+async def query_players(host, port, timeout=None):
+    return await _query(host, port, timeout or get_config().SERVER_TIMEOUT, "players")
+
+# 查询服务器规则
+async def query_rules(host, port, timeout=None):
+    return await _query(host, port, timeout or get_config().SERVER_TIMEOUT, "rules")
+
+# 在同一连接上查询基础信息和玩家列表，整体受超时限制
+async def query_server(host, port, timeout=None, with_players=True):
+    async def run():
+        async with A2SConnection(host, port) as connection:
+            info = await connection.info()
+            players = []
+            if with_players and info["players"] > 0:
+                try:
+                    players = await connection.players()
+                except A2SError:
+                    # 玩家列表查询失败不影响在线状态
+                    pass
+            return info, players
+    
+    return await asyncio.wait_for(run(), timeout or get_config().SERVER_TIMEOUT)
+
+# 本地A2S模拟服务器（用于调试和测试，无需运行真实的Unturned服务器）
+class A2SStandInServer(asyncio.DatagramProtocol):
+    def __init__(self, info=None, players=None, rules=None, challenge=b"\x12\x34\x56\x78",
+                 split_size=None, compress=False):
+        self.info = {
+            "name": "Unturned Stand-in",
+            "map": "PEI",
+            "folder": "unturned",
+            "game": "Unturned",
+            "app_id": 0,
+            "max_players": 24,
+            "bots": 0,
+            "version": "3.0.0.0",
+            "port": 27015
+        }
+        self.info.update(info or {})
+        self.player_list = list(players or [])
+        self.rules = dict(rules or {})
+        self.challenge = challenge
+        self.split_size = split_size
+        self.compress = compress
+        self.transport = None
+        self.requests = 0
+        self._split_id = 0
+    
+    async def start(self, host="127.0.0.1", port=0):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        return self.transport.get_extra_info("sockname")[1]
+    
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data, addr):
+        self.requests += 1
+        if len(data) < 5 or _HEADER.unpack_from(data)[0] != SINGLE_PACKET:
+            return
+        
+        request_type = data[4]
+        if request_type == A2S_INFO:
+            challenge = data[5 + len(INFO_PAYLOAD):]
+            body = self._info_body()
+        elif request_type == A2S_PLAYER:
+            challenge = data[5:9]
+            body = self._players_body()
+        elif request_type == A2S_RULES:
+            challenge = data[5:9]
+            body = self._rules_body()
+        else:
+            return
+        
+        if self.challenge and challenge != self.challenge:
+            self._send(bytes((S2C_CHALLENGE,)) + self.challenge, addr)
+        else:
+            self._send(body, addr)
+    
+    @staticmethod
+    def _string(value):
+        return value.encode("utf-8") + b"\x00"
+    
+    def _info_body(self):
+        info = self.info
+        return b"".join((
+            bytes((A2S_INFO_RESPONSE, 17)),
+            self._string(info["name"]),
+            self._string(info["map"]),
+            self._string(info["folder"]),
+            self._string(info["game"]),
+            struct.pack("<HBBBBBBB", info["app_id"], len(self.player_list), info["max_players"],
+                        info["bots"], ord("d"), ord("l"), 0, 1),
+            self._string(info["version"]),
+            struct.pack("<BH", 0x80, info["port"])
+        ))
+    
+    def _players_body(self):
+        parts = [bytes((A2S_PLAYER_RESPONSE, len(self.player_list)))]
+        for index, name in enumerate(self.player_list):
+            parts.append(bytes((index,)) + self._string(name) + struct.pack("<lf", 0, 0.0))
+        return b"".join(parts)
+    
+    def _rules_body(self):
+        parts = [bytes((A2S_RULES_RESPONSE,)), struct.pack("<h", len(self.rules))]
+        for name, value in self.rules.items():
+            parts.append(self._string(name) + self._string(str(value)))
+        return b"".join(parts)
+    
+    def _send(self, body, addr):
+        payload = _HEADER.pack(SINGLE_PACKET) + body
+        if not self.split_size or len(payload) <= self.split_size:
+            self.transport.sendto(payload, addr)
+            return
+        
+        # 按split_size拆分为多个包，用于验证分包重组
+        self._split_id = (self._split_id + 1) & 0x7FFFFFFF
+        request_id = self._split_id
+        prefix = b""
+        if self.compress:
+            request_id |= 0x80000000
+            prefix = _COMPRESSION_HEADER.pack(len(payload), zlib.crc32(payload))
+            payload = bz2.compress(payload)
+        chunks = [payload[i:i + self.split_size] for i in range(0, len(payload), self.split_size)]
+        for number, chunk in enumerate(chunks):
+            header = _HEADER.pack(SPLIT_PACKET) + _SPLIT_HEADER.pack(
+                request_id - (1 << 32) if request_id & 0x80000000 else request_id,
+                len(chunks), number, self.split_size
+            )
+            self.transport.sendto(header + (prefix if number == 0 else b"") + chunk, addr)
+
+# 命令行调试：python a2s.py <host> <query_port>
+if __name__ == "__main__":
+    import sys
+    import json
+    
+    async def _main():
+        host = sys.argv[1] if len(sys.argv) > 1 else get_config().SERVER_IP
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else get_config().SERVER_QUERY_PORT
+        async with A2SConnection(host, port) as connection:
+            result = {
+                "info": await asyncio.wait_for(connection.info(), get_config().SERVER_TIMEOUT),
+                "players": await asyncio.wait_for(connection.players(), get_config().SERVER_TIMEOUT),
+                "rules": await asyncio.wait_for(connection.rules(), get_config().SERVER_TIMEOUT)
+            }
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    
+    asyncio.run(_main())
@@ -1,14 +1,29 @@
-from fastapi import FastAPI, Depends, HTTPException, Security
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Security
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
+import datetime
+import json
+from sqlalchemy import select
 from settings import get_config
-from utils import logger, is_superuser, send_onebot_message
-from database import get_db
+from utils import logger, is_superuser, startup_timer
+from database import AsyncSessionLocal, dispose_async_engine
 from models import QQBotPlayers, PlayerStats, DailySignIn, GroupManagement, Announcements
+from cache import player_cache, response_cache
+from repository import list_players, parse_player_fields, player_to_dict, players_query, upsert_player, PLAYERS_STREAM_BATCH
+from broadcast import broadcast_engine, RESULT_SENT, RESULT_FAILED
+from leaderboard import leaderboard, resolve_metric, METRICS
+from sessions import session_tracker, query_sessions
+from player_import import import_players, IMPORT_FORMAT_CSV, IMPORT_FORMAT_NDJSON, IMPORT_FORMATS
+from metrics import render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from profiling import command_profiler
+from retention import retention_job, iter_archive, list_archives, RETENTION_TABLES
 import uvicorn
 import asyncio
+import contextlib
 import threading
 
 # 获取配置
@@ -64,6 +79,7 @@ class ServerStatusResponse(BaseModel):
 class BroadcastMessage(BaseModel):
     content: str
     target_groups: Optional[List[str]] = None
+    wait: bool = True  # False时立即返回任务ID，通过 /api/broadcast/{job_id} 查询进度
 
 class AnnouncementCreate(BaseModel):
     title: str
@@ -79,10 +95,36 @@ def read_root():
         "status": "running"
     }
 
-@app.get("/api/status", tags=["状态"], dependencies=[Depends(verify_api_key)])
-def get_status():
-    """获取机器人状态"""
+# 判断If-None-Match是否与当前ETag匹配（弱比较）
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return etag in [value[2:] if value.startswith("W/") else value for value in candidates]
+
+# 返回缓存的JSON响应（未命中时调用build生成），支持ETag和304
+def _cached_json_response(request, key, build):
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation
+        body = json.dumps(jsonable_encoder(build()), ensure_ascii=False).encode("utf-8")
+        entry = response_cache.set(key, body, generation)
+    
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"private, max-age={config.API_CACHE_MAX_AGE}" if config.API_CACHE_MAX_AGE > 0
+        else "private, no-cache"
+    }
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+# 生成机器人状态（只在缓存未命中时调用）
+def _build_status():
     from core import get_bot_status
+    from monitor import get_server_status
     status = get_bot_status()
     
     # 添加API服务状态
@@ -93,138 +135,286 @@ def get_status():
     }
     
     # 添加服务器监控状态
-    from monitor import get_server_status
     status["server_status"] = get_server_status()
     
     return status
 
+@app.get("/api/status", tags=["状态"], dependencies=[Depends(verify_api_key)])
+def get_status(request: Request):
+    """获取机器人状态（支持If-None-Match条件请求）"""
+    return _cached_json_response(request, "status", _build_status)
+
+# 流式导出玩家（NDJSON，每行一个玩家），使用服务器端游标分批读取，内存占用与玩家总数无关
+async def _stream_players(fields, after_id=None):
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            players_query(fields, after_id).execution_options(yield_per=PLAYERS_STREAM_BATCH)
+        )
+        async for rows in result.mappings().partitions():
+            yield "".join(
+                json.dumps(player_to_dict(row, fields), ensure_ascii=False) + "\n" for row in rows
+            )
+
 @app.get("/api/players", tags=["玩家"], dependencies=[Depends(verify_api_key)])
-def get_players(qq_id: Optional[str] = None, steam_id: Optional[str] = None):
-    """获取玩家列表或特定玩家信息"""
-    db = next(get_db())
+async def get_players(
+    qq_id: Optional[str] = None,
+    steam_id: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 100,
+    fields: Optional[str] = None,
+    format: str = "json"
+):
+    """获取玩家列表或特定玩家信息（使用next_cursor翻页，fields选择字段，format=ndjson流式导出全部玩家）"""
     try:
-        query = db.query(QQBotPlayers)
-        
-        if qq_id:
-            query = query.filter(QQBotPlayers.qq_id == qq_id)
-        if steam_id:
-            query = query.filter(QQBotPlayers.steam_id == steam_id)
-        
-        players = query.all()
-        
-        result = []
-        for player in players:
-            result.append({
-                "id": player.id,
-                "qq_id": player.qq_id,
-                "steam_id": player.steam_id,
-                "nickname": player.nickname,
-                "points": player.points,
-                "bind_time": str(player.bind_time),
-                "last_login": str(player.last_login),
-                "last_checkin_date": player.last_checkin_date,
-                "created_at": player.created_at
-            })
-        
-        return {"count": len(result), "players": result}
+        selected = parse_player_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 按单个玩家查询时优先使用缓存
+    if qq_id or steam_id:
+        player = await player_cache.get(qq_id=qq_id) if qq_id else await player_cache.get(steam_id=steam_id)
+        if player and steam_id and player["steam_id"] != steam_id:
+            player = None
+        players = [player] if player else []
+        return {"count": len(players), "players": [player_to_dict(player, selected) for player in players]}
+    
+    if format == "ndjson":
+        return StreamingResponse(_stream_players(selected, cursor), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format 必须为 json 或 ndjson")
+    
+    try:
+        async with AsyncSessionLocal() as db:
+            players, next_cursor = await db.run_sync(
+                list_players, fields=selected, after_id=cursor, limit=limit
+            )
+        return {"count": len(players), "players": players, "next_cursor": next_cursor}
     except Exception as e:
         logger.error(f"获取玩家列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail="获取玩家列表失败")
-    finally:
-        db.close()
 
 @app.post("/api/players", tags=["玩家"], dependencies=[Depends(verify_api_key)])
-def create_player(player: PlayerInfo):
+async def create_player(player: PlayerInfo):
     """创建或更新玩家信息"""
-    db = next(get_db())
-    try:
-        # 检查玩家是否已存在
-        existing_player = db.query(QQBotPlayers).filter(
-            QQBotPlayers.qq_id == player.qq_id
-        ).first()
-        
-        if existing_player:
-            # 更新玩家信息
-            existing_player.steam_id = player.steam_id
-            if player.nickname:
-                existing_player.nickname = player.nickname
-            existing_player.points = player.points
-            existing_player.last_login = player.last_login
-            db.commit()
-            return {"status": "success", "message": "玩家信息已更新", "player_id": existing_player.id}
-        else:
-            # 创建新玩家
-            new_player = QQBotPlayers(
-                qq_id=player.qq_id,
-                steam_id=player.steam_id,
-                nickname=player.nickname or f"玩家{player.qq_id[:4]}",
-                points=player.points
+    async with AsyncSessionLocal() as db:
+        try:
+            player_id, created, old_steam_id = await db.run_sync(
+                upsert_player,
+                player.qq_id,
+                player.steam_id,
+                nickname=player.nickname,
+                points=player.points,
+                last_login=player.last_login
             )
-            db.add(new_player)
-            db.flush()
-            
-            # 创建相关记录
-            from models import PlayerStats, DailySignIn
-            player_stats = PlayerStats(player_id=new_player.id)
-            daily_signin = DailySignIn(player_id=new_player.id)
-            db.add_all([player_stats, daily_signin])
-            db.commit()
-            
-            return {"status": "success", "message": "玩家创建成功", "player_id": new_player.id}
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"创建玩家失败: {str(e)}")
+            raise HTTPException(status_code=500, detail="创建玩家失败")
+    
+    # 写入后失效缓存
+    player_cache.invalidate(qq_id=player.qq_id, steam_id=old_steam_id)
+    player_cache.invalidate(steam_id=player.steam_id)
+    leaderboard.update(player.qq_id, steam_id=player.steam_id, nickname=player.nickname, points=player.points)
+    
+    if created:
+        return {"status": "success", "message": "玩家创建成功", "player_id": player_id}
+    return {"status": "success", "message": "玩家信息已更新", "player_id": player_id}
+
+@app.post("/api/players/import", tags=["玩家"], dependencies=[Depends(verify_api_key)])
+async def import_players_api(request: Request, format: Optional[str] = None):
+    """批量导入玩家（请求体为CSV或NDJSON；未指定format时按Content-Type判断），返回每行的错误报告"""
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = IMPORT_FORMAT_CSV if "csv" in content_type else IMPORT_FORMAT_NDJSON
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format 必须为 csv 或 ndjson")
+    
+    try:
+        content = (await request.body()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="导入内容必须为UTF-8编码")
+    
+    async with AsyncSessionLocal() as db:
+        try:
+            report = await db.run_sync(import_players, content, format)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"导入玩家失败: {str(e)}")
+            raise HTTPException(status_code=500, detail="导入玩家失败")
+    
+    # 导入涉及的玩家可能很多，直接清空玩家缓存，排行榜下次查询时重新加载
+    if report.created or report.updated:
+        player_cache.clear()
+        leaderboard.invalidate()
+    
+    logger.info(f"导入玩家完成：新建 {report.created} 名，更新 {report.updated} 名，失败 {report.failed} 行")
+    return report.to_dict()
+
+@app.get("/api/leaderboard", tags=["玩家"], dependencies=[Depends(verify_api_key)])
+async def get_leaderboard(
+    metric: str = "points",
+    limit: int = 10,
+    offset: int = 0,
+    qq_id: Optional[str] = None
+):
+    """获取排行榜（metric可选 points、kills、zombies_killed、play_time、consecutive_days、total_days；指定qq_id时同时返回该玩家的排名）"""
+    resolved = resolve_metric(metric)
+    if resolved is None:
+        raise HTTPException(status_code=400, detail=f"metric 必须为 {'、'.join(METRICS)} 之一")
+    limit = max(1, min(limit, config.LEADERBOARD_MAX_LIMIT))
+    offset = max(0, offset)
+    
+    try:
+        await leaderboard.ensure_loaded()
     except Exception as e:
-        db.rollback()
-        logger.error(f"创建玩家失败: {str(e)}")
-        raise HTTPException(status_code=500, detail="创建玩家失败")
-    finally:
-        db.close()
+        logger.error(f"加载排行榜失败: {str(e)}")
+        raise HTTPException(status_code=500, detail="加载排行榜失败")
+    
+    result = {
+        "metric": resolved,
+        "total": leaderboard.get_stats()["players"],
+        "entries": leaderboard.top(resolved, limit, offset)
+    }
+    if qq_id:
+        result["player"] = leaderboard.rank(resolved, qq_id)
+    return result
+
+@app.get("/api/sessions", tags=["玩家"], dependencies=[Depends(verify_api_key)])
+async def get_sessions(
+    steam_id: Optional[str] = None,
+    qq_id: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 50
+):
+    """查询玩家的在线会话历史（按steam_id或qq_id，使用next_cursor翻页）"""
+    if qq_id:
+        player = await player_cache.get(qq_id=qq_id)
+        if not player:
+            raise HTTPException(status_code=404, detail="玩家未绑定")
+        steam_id = player["steam_id"]
+    if not steam_id:
+        raise HTTPException(status_code=400, detail="需要指定 steam_id 或 qq_id")
+    limit = max(1, min(limit, 500))
+    
+    async with AsyncSessionLocal() as db:
+        sessions, next_cursor = await db.run_sync(query_sessions, steam_id, before_id=cursor, limit=limit)
+    return {"steam_id": steam_id, "count": len(sessions), "sessions": sessions, "next_cursor": next_cursor}
+
+@app.get("/api/sessions/online", tags=["服务器"], dependencies=[Depends(verify_api_key)])
+def get_online_sessions(server_key: Optional[str] = None):
+    """获取当前在线玩家的会话"""
+    sessions = session_tracker.get_online(server_key)
+    return {"count": len(sessions), "sessions": sessions}
 
 @app.get("/api/server", tags=["服务器"], dependencies=[Depends(verify_api_key)])
-def get_server_status_api():
-    """获取服务器状态"""
-    from monitor import get_server_status
-    status = get_server_status()
-    return status
+def get_server_status_api(request: Request, server_key: Optional[str] = None, all: bool = False):
+    """获取服务器状态（指定server_key查询单个服务器，all=true查询全部服务器；支持If-None-Match条件请求）"""
+    from monitor import get_server_status, get_all_server_status
+    if all:
+        def build():
+            statuses = get_all_server_status()
+            return {"count": len(statuses), "servers": statuses}
+        return _cached_json_response(request, "server:all", build)
+    
+    status = get_server_status(server_key)
+    if status is None:
+        raise HTTPException(status_code=404, detail="服务器不存在")
+    return _cached_json_response(request, f"server:{status['server_key']}", lambda: status)
+
+@app.get("/api/server/history", tags=["服务器"], dependencies=[Depends(verify_api_key)])
+async def get_server_history(
+    server_key: Optional[str] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    resolution: str = "1h",
+    cursor: Optional[int] = None,
+    limit: int = 500
+):
+    """获取服务器历史状态（resolution: raw/1m/1h/1d，使用next_cursor翻页）"""
+    from monitor import server_monitor
+    from history import RESOLUTIONS, to_utc_naive, query_history, query_history_summary
+    
+    if resolution != "raw" and resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail="resolution 必须为 raw、1m、1h 或 1d")
+    
+    server_key = server_key or server_monitor.default_server.key
+    end = to_utc_naive(end) if end else datetime.datetime.utcnow()
+    start = to_utc_naive(start) if start else end - datetime.timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start 必须早于 end")
+    
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await db.run_sync(
+                query_history, server_key, start, end, resolution, cursor=cursor, limit=limit
+            )
+            result.update({
+                "server_key": server_key,
+                "resolution": resolution,
+                "start": str(start),
+                "end": str(end)
+            })
+            
+            # 汇总指标只在第一页返回
+            if cursor is None:
+                result["summary"] = await db.run_sync(
+                    query_history_summary, server_key, start, end, resolution
+                )
+            return result
+    except Exception as e:
+        logger.error(f"获取服务器历史失败: {str(e)}")
+        raise HTTPException(status_code=500, detail="获取服务器历史失败")
 
 @app.post("/api/broadcast", tags=["广播"], dependencies=[Depends(verify_api_key)])
 async def send_broadcast(broadcast: BroadcastMessage):
-    """发送广播消息"""
+    """发送广播消息（wait=false时后台发送并立即返回任务ID）"""
     # 确定目标群组
     target_groups = broadcast.target_groups or config.MONITOR_GROUPS
     
     if not target_groups:
         raise HTTPException(status_code=400, detail="没有指定目标群组")
     
-    success_count = 0
-    fail_count = 0
+    message = f"📢 系统广播\n{broadcast.content}\n\n-- API发送"
     
-    for group_id in target_groups:
-        if await send_onebot_message(
-            "group",
-            group_id=group_id,
-            message=f"📢 系统广播\n{broadcast.content}\n\n-- API发送"
-        ):
-            success_count += 1
-        else:
-            fail_count += 1
+    if not broadcast.wait:
+        job = broadcast_engine.submit(target_groups, message)
+        return {
+            "status": "accepted",
+            "message": "广播任务已提交",
+            "job_id": job.id
+        }
     
+    job = await broadcast_engine.broadcast(target_groups, message)
     return {
         "status": "success",
         "message": "广播发送完成",
-        "success_count": success_count,
-        "fail_count": fail_count
+        "job_id": job.id,
+        "success_count": job.count(RESULT_SENT),
+        "fail_count": job.count(RESULT_FAILED),
+        "results": job.to_dict()["results"]
     }
 
+@app.get("/api/broadcast/{job_id}", tags=["广播"], dependencies=[Depends(verify_api_key)])
+def get_broadcast_job(job_id: str):
+    """查询广播任务进度和每个群的发送结果"""
+    job = broadcast_engine.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="广播任务不存在")
+    return job.to_dict()
+
 @app.get("/api/announcements", tags=["公告"], dependencies=[Depends(verify_api_key)])
-def get_announcements(active_only: bool = True):
+async def get_announcements(active_only: bool = True):
     """获取公告列表"""
-    db = next(get_db())
     try:
-        query = db.query(Announcements)
+        query = select(Announcements)
         
         if active_only:
-            query = query.filter(Announcements.is_active == True)
+            query = query.where(Announcements.is_active == True)
         
-        announcements = query.order_by(Announcements.created_at.desc()).all()
+        async with AsyncSessionLocal() as db:
+            announcements = (await db.execute(query.order_by(Announcements.created_at.desc()))).scalars().all()
         
         result = []
         for announcement in announcements:
@@ -241,29 +431,120 @@ def get_announcements(active_only: bool = True):
     except Exception as e:
         logger.error(f"获取公告列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail="获取公告列表失败")
-    finally:
-        db.close()
 
 @app.post("/api/announcements", tags=["公告"], dependencies=[Depends(verify_api_key)])
-def create_announcement(announcement: AnnouncementCreate):
+async def create_announcement(announcement: AnnouncementCreate):
     """创建公告"""
-    db = next(get_db())
+    async with AsyncSessionLocal() as db:
+        try:
+            new_announcement = Announcements(
+                title=announcement.title,
+                content=announcement.content,
+                created_by=announcement.created_by
+            )
+            db.add(new_announcement)
+            await db.flush()
+            announcement_id = new_announcement.id
+            await db.commit()
+            
+            return {"status": "success", "message": "公告创建成功", "announcement_id": announcement_id}
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"创建公告失败: {str(e)}")
+            raise HTTPException(status_code=500, detail="创建公告失败")
+
+@app.get("/metrics", tags=["状态"], dependencies=[Depends(verify_api_key)])
+def get_metrics():
+    """Prometheus格式的运行指标"""
+    if not config.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="运行指标未启用")
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/commands/slow", tags=["状态"], dependencies=[Depends(verify_api_key)])
+def get_slow_commands(command: Optional[str] = None, limit: int = 50):
+    """最近的慢命令及各阶段耗时"""
+    limit = max(1, min(limit, config.COMMAND_SLOW_JOURNAL_SIZE))
+    return {
+        "threshold_ms": config.COMMAND_SLOW_THRESHOLD_MS,
+        "commands": command_profiler.get_slow_commands(limit, command)
+    }
+
+@app.get("/api/commands/profiles", tags=["状态"], dependencies=[Depends(verify_api_key)])
+def get_command_profiles():
+    """采样剖析结果列表"""
+    return {"sample_rate": command_profiler.sample_rate, "profiles": command_profiler.get_samples()}
+
+@app.get("/api/commands/profiles/{profile_id}", tags=["状态"], dependencies=[Depends(verify_api_key)])
+def get_command_profile(profile_id: int):
+    """单次采样的cProfile结果（按累计耗时排序）"""
+    sample = command_profiler.get_sample(profile_id)
+    if sample is None:
+        raise HTTPException(status_code=404, detail="剖析结果不存在或已被淘汰")
+    return sample
+
+@app.get("/api/retention", tags=["状态"], dependencies=[Depends(verify_api_key)])
+def get_retention():
+    """数据保留任务状态和归档文件列表"""
+    status = retention_job.get_stats()
+    status["archives"] = {
+        table_name: [
+            {"file": item["file"], "created_at": item["created_at"], "size": item["size"]}
+            for item in list_archives(table_name)
+        ]
+        for table_name in RETENTION_TABLES
+    }
+    return status
+
+@app.get("/api/archive/{table_name}", tags=["状态"], dependencies=[Depends(verify_api_key)])
+def get_archive(
+    table_name: str,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    server_key: Optional[str] = None,
+    user_id: Optional[str] = None,
+    group_id: Optional[str] = None,
+    limit: Optional[int] = None
+):
+    """流式读取已归档的记录（NDJSON，每行一条记录），可按时间范围和字段过滤"""
+    from history import to_utc_naive
+    
+    filters = {
+        name: value
+        for name, value in (("server_key", server_key), ("user_id", user_id), ("group_id", group_id))
+        if value is not None
+    }
+    if table_name not in RETENTION_TABLES:
+        raise HTTPException(status_code=404, detail=f"table 必须为 {'、'.join(RETENTION_TABLES)} 之一")
     try:
-        new_announcement = Announcements(
-            title=announcement.title,
-            content=announcement.content,
-            created_by=announcement.created_by
+        rows = iter_archive(
+            table_name,
+            start=to_utc_naive(start) if start else None,
+            end=to_utc_naive(end) if end else None,
+            limit=max(1, limit) if limit else None,
+            **filters
         )
-        db.add(new_announcement)
-        db.commit()
-        
-        return {"status": "success", "message": "公告创建成功", "announcement_id": new_announcement.id}
-    except Exception as e:
-        db.rollback()
-        logger.error(f"创建公告失败: {str(e)}")
-        raise HTTPException(status_code=500, detail="创建公告失败")
-    finally:
-        db.close()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 同步生成器由StreamingResponse在线程池中迭代，解压不阻塞事件循环
+    return StreamingResponse(
+        (json.dumps(row, ensure_ascii=False) + "\n" for row in rows),
+        media_type="application/x-ndjson"
+    )
+
+# API服务运行模式
+API_MODE_SERVER = "server"  # 在NoneBot的事件循环中运行独立端口的UVicorn服务（默认）
+API_MODE_MOUNT = "mount"  # 挂载到NoneBot的FastAPI驱动上，与机器人共用端口
+API_MODE_THREAD = "thread"  # 旧模式：在单独线程和事件循环中运行
+
+# 嵌入运行的UVicorn服务（信号由NoneBot处理，不安装自己的信号处理器）
+class EmbeddedServer(uvicorn.Server):
+    def install_signal_handlers(self):
+        pass
+    
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
 
 # API服务器管理
 class APIServer:
@@ -278,36 +559,93 @@ class APIServer:
     def __init__(self):
         if not self._initialized:
             self.is_running = False
+            self.mode = config.API_MODE
+            self.server = None
+            self.server_task = None
             self.server_thread = None
             self._initialized = True
     
-    def start(self):
-        if not self.is_running and config.API_ENABLED:
-            self.is_running = True
-            
-            # 在单独的线程中启动UVicorn服务器
+    def mount(self, driver):
+        """挂载到NoneBot的FastAPI驱动（需要在NoneBot的服务器启动前调用）"""
+        server_app = getattr(driver, "server_app", None)
+        if server_app is None:
+            logger.error("当前NoneBot驱动不支持挂载FastAPI应用（需要使用 ~fastapi 驱动），改为独立端口运行")
+            self.mode = API_MODE_SERVER
+            return
+        
+        # 挂载在根路径，接口路径保持不变；NoneBot自身的路由先注册，优先匹配
+        server_app.mount("/", app)
+        logger.info("API服务已挂载到NoneBot驱动，与机器人共用端口")
+    
+    async def start(self):
+        if self.is_running or not config.API_ENABLED:
+            return
+        
+        self.is_running = True
+        if self.mode == API_MODE_MOUNT:
+            return
+        
+        self.server = EmbeddedServer(uvicorn.Config(
+            app,
+            host=config.API_HOST,
+            port=config.API_PORT,
+            log_level="info",
+            lifespan="off"
+        ))
+        if self.mode == API_MODE_THREAD:
+            # 在单独的线程和事件循环中启动UVicorn服务器
             self.server_thread = threading.Thread(
                 target=self._run_server,
                 daemon=True
             )
             self.server_thread.start()
-            
-            logger.info(f"API服务已启动，访问地址：http://{config.API_HOST}:{config.API_PORT}")
+        else:
+            # 在当前（NoneBot的）事件循环中运行，数据库和OneBot连接池只有一套
+            self.server_task = asyncio.create_task(self.server.serve())
+        
+        logger.info(f"API服务已启动，访问地址：http://{config.API_HOST}:{config.API_PORT}")
     
-    def stop(self):
-        if self.is_running:
-            self.is_running = False
-            # UVicorn服务器会自动停止，因为我们使用了daemon线程
-            logger.info("API服务已停止")
+    async def stop(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        
+        if self.server_task is not None:
+            # 停止接受新连接，等待进行中的请求完成，超时后强制关闭
+            self.server.should_exit = True
+            try:
+                await asyncio.wait_for(asyncio.shield(self.server_task), config.API_SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("等待API请求完成超时，强制关闭API服务")
+                self.server.force_exit = True
+                await self.server_task
+            self.server_task = None
+            self.server = None
+        
+        if self.server_thread is not None:
+            # 通知线程中的服务退出，等待进行中的请求完成（线程退出前关闭它的异步数据库引擎）
+            self.server.should_exit = True
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.server_thread.join, config.API_SHUTDOWN_TIMEOUT)
+            if self.server_thread.is_alive():
+                logger.warning("等待API请求完成超时，强制关闭API服务")
+                self.server.force_exit = True
+            self.server_thread = None
+            self.server = None
+        
+        # 挂载模式由NoneBot的服务器负责关闭
+        logger.info("API服务已停止")
     
     def _run_server(self):
+        async def serve():
+            try:
+                await self.server.serve()
+            finally:
+                # 该线程的事件循环即将结束，关闭在其中创建的异步数据库引擎
+                await dispose_async_engine()
+        
         try:
-            uvicorn.run(
-                app, 
-                host=config.API_HOST,
-                port=config.API_PORT,
-                log_level="info"
-            )
+            asyncio.run(serve())
         except Exception as e:
             logger.error(f"API服务器运行出错: {str(e)}")
             self.is_running = False
@@ -317,15 +655,20 @@ api_server = APIServer()
 
 # 注册驱动事件
 def register_api_events(driver):
+    # 挂载模式需要在NoneBot的服务器启动前完成挂载
+    if config.API_ENABLED and config.API_MODE == API_MODE_MOUNT:
+        api_server.mount(driver)
+    
     @driver.on_startup
     async def on_startup():
         # 启动API服务
-        api_server.start()
-        
+        with startup_timer.phase("api"):
+            await api_server.start()
+    
     @driver.on_shutdown
     async def on_shutdown():
-        # 停止API服务
-        api_server.stop()
+        # 停止API服务（先于数据库和OneBot连接池关闭）
+        await api_server.stop()
 
 # 如果直接运行此文件，则启动API服务
 if __name__ == "__main__":
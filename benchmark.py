@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+# 热点路径微基准：命令处理（/bind、/sign、/me）、命令日志、服务器状态检查、
+# 玩家列表接口（1万/10万玩家）、签到奖励计算和OneBot消息发送
+# 完全离线运行：使用临时SQLite文件、本地A2S模拟服务器和OneBot模拟服务，不影响已有数据
+# 每项报告每秒操作数和单次耗时的p50/p99，可保存为JSON基线，之后与基线比较，
+# 吞吐量下降或p50耗时上升超过容差时以非零状态退出（可用于CI）
+#
+# python benchmark.py                                  运行全部基准
+# python benchmark.py --save baseline.json             运行并保存基线
+# python benchmark.py --compare baseline.json          与基线比较，退化超过容差时失败
+# python benchmark.py --only sign,me --tolerance 0.3   只运行部分基准
+# /bind、/sign、/me 单次执行的SQL条数上限由测试检查（tests/test_repository.py）
+
+# 默认容差：吞吐量下降或p50耗时上升超过25%视为退化
+DEFAULT_TOLERANCE = 0.25
+
+# 玩家列表基准的玩家数量
+PLAYER_LIST_SIZES = (10_000, 100_000)
+
+# 基准测试使用的QQ号和SteamID范围（不与默认超级用户冲突）
+BENCH_QQ_BASE = 8_000_000_000
+BENCH_STEAM_BASE = 76561199000000000
+
+# 模拟服务器上的在线玩家
+BENCH_SERVER_PLAYERS = [f"Survivor{i}" for i in range(16)]
+
+# 项目模块读取配置时会使用这些环境变量，必须在导入项目模块之前设置
+def _prepare_environment(workdir):
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        "ASYNC_DATABASE_URL": "",
+        "LOG_TO_FILE": "False",
+        "LOG_LEVEL": "WARNING",
+        "API_KEY": "",
+        "MONITOR_ENABLED": "False",
+        "NOTIFY_STATUS_CHANGE": "False",
+        "SESSION_TRACKING_ENABLED": "False",
+        "LOG_INGEST_ENABLED": "False",
+        "COMMAND_SLOW_LOG_FILE": "",
+        "COMMAND_PROFILE_SAMPLE_RATE": "0"
+    })
+
+# 按耗时样本计算结果（样本单位为纳秒）
+def _summarize(name, samples, elapsed_ns):
+    samples = sorted(samples)
+    
+    def percentile(q):
+        return samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))] / 1000
+    
+    return {
+        "name": name,
+        "iterations": len(samples),
+        "ops_per_sec": round(len(samples) / (elapsed_ns / 1e9), 1) if elapsed_ns else None,
+        "p50_us": round(percentile(0.50), 2),
+        "p99_us": round(percentile(0.99), 2),
+        "mean_us": round(sum(samples) / len(samples) / 1000, 2)
+    }
+
+# 执行一项基准：先预热，再逐次计时；func(i)为协程函数，i为本次迭代的序号（含预热）
+async def measure(name, func, iterations, warmup=None):
+    warmup = min(iterations, 100) if warmup is None else warmup
+    for i in range(warmup):
+        await func(i)
+    
+    samples = []
+    started = time.perf_counter_ns()
+    for i in range(warmup, warmup + iterations):
+        op_started = time.perf_counter_ns()
+        await func(i)
+        samples.append(time.perf_counter_ns() - op_started)
+    return _summarize(name, samples, time.perf_counter_ns() - started)
+
+# 与基线比较，返回退化说明列表
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    baseline_results = baseline.get("results", {})
+    for name, result in results.items():
+        base = baseline_results.get(name)
+        if not base:
+            continue
+        if base.get("ops_per_sec") and result["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: 吞吐量 {result['ops_per_sec']} ops/s，基线 {base['ops_per_sec']} ops/s"
+            )
+        if base.get("p50_us") and result["p50_us"] > base["p50_us"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p50 {result['p50_us']}µs，基线 {base['p50_us']}µs"
+            )
+    return regressions
+
+# 模拟OneBot机器人（只记录发送的消息数量）
+class StubBot:
+    self_id = "10000"
+    
+    def __init__(self):
+        self.sent = 0
+    
+    async def send(self, event, message, **kwargs):
+        self.sent += 1
+        return {"message_id": self.sent}
+
+# 模拟群消息事件
+class StubEvent:
+    def __init__(self, user_id, group_id=123456789):
+        self.user_id = user_id
+        self.group_id = group_id
+
+def _bench_qq(i):
+    return str(BENCH_QQ_BASE + i)
+
+def _bench_steam(i):
+    return str(BENCH_STEAM_BASE + i)
+
+# 已写入的测试玩家数量（编号 0 ~ n-1）
+_seeded_players = 0
+
+# 批量写入测试玩家，使编号 0 ~ count-1 的测试玩家都存在
+async def _seed_players(count):
+    global _seeded_players
+    from database import AsyncSessionLocal
+    from player_import import import_players
+    
+    if count <= _seeded_players:
+        return
+    content = "\n".join(
+        json.dumps({"qq_id": _bench_qq(i), "steam_id": _bench_steam(i), "nickname": f"Bench{i}"})
+        for i in range(_seeded_players, count)
+    )
+    async with AsyncSessionLocal() as db:
+        report = await db.run_sync(import_players, content)
+    if report.failed:
+        raise RuntimeError(f"写入测试玩家失败: {report.to_dict()['errors'][:3]}")
+    _seeded_players = count
+
+# 各项基准（每项返回结果列表）
+async def bench_sign_in_reward(iterations):
+    from utils import calculate_sign_in_reward
+    
+    async def run(i):
+        calculate_sign_in_reward(i % 60 + 1)
+    
+    return [await measure("calculate_sign_in_reward", run, iterations * 10)]
+
+async def bench_log_command(iterations):
+    from log_buffer import command_log_buffer
+    from utils import log_command
+    
+    # 与运行时一致：日志进入缓冲区，由后台任务批量写入
+    await command_log_buffer.start()
+    try:
+        async def run(i):
+            log_command(_bench_qq(i), 123456789, "bench", "", True, "ok")
+        
+        return [await measure("log_command", run, iterations * 10)]
+    finally:
+        await command_log_buffer.stop()
+
+async def bench_bind(iterations):
+    from commands import bind_handler
+    bot = StubBot()
+    
+    # 每次绑定一个新玩家（写入玩家、统计和签到记录）
+    offset = 5_000_000
+    
+    async def run(i):
+        await bind_handler(StubEvent(_bench_qq(offset + i)), bot, _bench_steam(offset + i))
+    
+    return [await measure("bind", run, iterations)]
+
+async def bench_sign(iterations):
+    from commands import sign_handler
+    bot = StubBot()
+    warmup = min(iterations, 100)
+    await _seed_players(warmup + iterations + 1)
+    
+    # 每次由一名尚未签到的玩家签到（缓存未命中 + 条件更新）
+    async def run(i):
+        await sign_handler(StubEvent(_bench_qq(i)), bot)
+    
+    return [await measure("sign", run, iterations, warmup=warmup)]
+
+async def bench_me(iterations):
+    from commands import me_handler
+    from cache import player_cache
+    bot = StubBot()
+    await _seed_players(1000)
+    
+    async def cached(i):
+        await me_handler(StubEvent(_bench_qq(i % 100)), bot)
+    
+    async def uncached(i):
+        player_cache.clear()
+        await me_handler(StubEvent(_bench_qq(i % 1000)), bot)
+    
+    return [
+        await measure("me_cached", cached, iterations * 10),
+        await measure("me_uncached", uncached, iterations)
+    ]
+
+async def bench_check_server_status(iterations):
+    from a2s import A2SStandInServer
+    from monitor import MonitoredServer, server_monitor
+    
+    stand_in = A2SStandInServer(players=BENCH_SERVER_PLAYERS)
+    port = await stand_in.start()
+    server = MonitoredServer("bench", "Benchmark", "127.0.0.1", port, port)
+    try:
+        async def run(i):
+            await server_monitor._check_server_status(server)
+        
+        return [await measure("check_server_status", run, iterations)]
+    finally:
+        stand_in.close()
+
+async def bench_get_players(iterations):
+    from api import get_players
+    
+    results = []
+    for size in PLAYER_LIST_SIZES:
+        await _seed_players(size)
+        label = f"{size // 1000}k"
+        
+        async def page(i):
+            # 按游标翻页（每次100名）
+            await get_players(cursor=(i * 997) % size, limit=100)
+        
+        async def export(i):
+            # NDJSON流式导出全部玩家
+            response = await get_players(format="ndjson")
+            async for _ in response.body_iterator:
+                pass
+        
+        results.append(await measure(f"get_players_page_{label}", page, iterations))
+        results.append(await measure(f"get_players_export_{label}", export, max(3, iterations // 100), warmup=1))
+    return results
+
+async def bench_send_group_message(iterations):
+    from onebot_stub import OneBotStubServer
+    from settings import get_config
+    from utils import onebot_client, send_group_message
+    
+    stub = OneBotStubServer()
+    port = await stub.start()
+    config = get_config()
+    original_url = config.ONE_BOT_URL
+    config.ONE_BOT_URL = f"http://127.0.0.1:{port}"
+    try:
+        async def run(i):
+            await send_group_message(123456789, f"benchmark {i}")
+        
+        return [await measure("send_group_message", run, iterations)]
+    finally:
+        config.ONE_BOT_URL = original_url
+        await onebot_client.close()
+        await stub.close()
+
+# 基准名称 -> 执行函数（按顺序执行）
+BENCHMARKS = {
+    "sign_in_reward": bench_sign_in_reward,
+    "log_command": bench_log_command,
+    "bind": bench_bind,
+    "sign": bench_sign,
+    "me": bench_me,
+    "check_server_status": bench_check_server_status,
+    "send_group_message": bench_send_group_message,
+    "get_players": bench_get_players
+}
+
+async def run_benchmarks(names, iterations):
+    from database import init_db, dispose_async_engine
+    init_db()
+    
+    results = {}
+    try:
+        for name in names:
+            for result in await BENCHMARKS[name](iterations):
+                results[result["name"]] = result
+                print(
+                    f"{result['name']:<28} {result['ops_per_sec']:>12} ops/s"
+                    f"  p50 {result['p50_us']:>10}µs  p99 {result['p99_us']:>10}µs",
+                    file=sys.stderr
+                )
+    finally:
+        await dispose_async_engine()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Unturned服务器助手热点路径基准测试")
+    parser.add_argument("--only", help=f"只运行指定的基准（逗号分隔）：{', '.join(BENCHMARKS)}")
+    parser.add_argument("--iterations", type=int, default=500, help="每项基准的基础迭代次数")
+    parser.add_argument("--save", metavar="PATH", help="把结果保存为JSON基线")
+    parser.add_argument("--compare", metavar="PATH", help="与JSON基线比较")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="允许的退化比例（默认0.25）")
+    args = parser.parse_args(argv)
+    
+    names = [name.strip() for name in args.only.split(",")] if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基准: {', '.join(unknown)}")
+    
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        _prepare_environment(workdir)
+        import nonebot
+        nonebot.init()
+        results = asyncio.run(run_benchmarks(names, max(1, args.iterations)))
+    
+    report = {
+        "created_at": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "results": results
+    }
+    
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    
+    if baseline is not None:
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print(f"性能退化（容差 {args.tolerance:.0%}）：", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print(f"与基线相比没有超过 {args.tolerance:.0%} 的退化", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import asyncio
+import collections
+import datetime
+import random
+import uuid
+from settings import get_config
+from utils import logger, OneBotError
+from outbox import outbox, PRIORITY_BROADCAST
+
+# 获取配置
+config = get_config()
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+
+# 单个群的发送结果
+RESULT_PENDING = "pending"
+RESULT_SENT = "sent"
+RESULT_FAILED = "failed"
+
+# 一次广播任务
+class BroadcastJob:
+    def __init__(self, group_ids, message):
+        self.id = uuid.uuid4().hex
+        self.message = message
+        self.status = JOB_PENDING
+        self.created_at = datetime.datetime.utcnow()
+        self.finished_at = None
+        self.results = collections.OrderedDict(
+            (str(group_id), {"status": RESULT_PENDING, "attempts": 0, "error": None})
+            for group_id in group_ids
+        )
+    
+    def count(self, status):
+        return sum(1 for result in self.results.values() if result["status"] == status)
+    
+    def to_dict(self, with_results=True):
+        job = {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.results),
+            "sent": self.count(RESULT_SENT),
+            "failed": self.count(RESULT_FAILED),
+            "pending": self.count(RESULT_PENDING),
+            "created_at": str(self.created_at),
+            "finished_at": str(self.finished_at) if self.finished_at else None
+        }
+        if with_results:
+            job["results"] = dict(self.results)
+        return job
+
+# 广播引擎：并发发送到多个群（经出站消息队列限速），临时故障带抖动退避重试
+class BroadcastEngine:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(BroadcastEngine, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.max_retries = config.BROADCAST_MAX_RETRIES
+            self.retry_base = config.BROADCAST_RETRY_BASE
+            self.jobs = collections.OrderedDict()
+            self._tasks = set()
+            self._initialized = True
+    
+    async def broadcast(self, group_ids, message, sender=None):
+        """发送广播并等待全部群发送完成，返回任务"""
+        job = self._create_job(group_ids, message)
+        await self._run_job(job, sender)
+        return job
+    
+    def submit(self, group_ids, message, sender=None):
+        """提交广播后立即返回任务，可通过get_job查询进度"""
+        job = self._create_job(group_ids, message)
+        task = asyncio.create_task(self._run_job(job, sender))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+    
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+    
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+    
+    def _create_job(self, group_ids, message):
+        # 去重并保持顺序
+        job = BroadcastJob(dict.fromkeys(str(group_id) for group_id in group_ids), message)
+        self.jobs[job.id] = job
+        
+        # 只保留最近的任务记录（不淘汰未完成的任务）
+        while len(self.jobs) > config.BROADCAST_JOB_HISTORY:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.status != JOB_DONE:
+                break
+            self.jobs.popitem(last=False)
+        return job
+    
+    async def _run_job(self, job, sender):
+        job.status = JOB_RUNNING
+        try:
+            await asyncio.gather(*(
+                self._send_to_group(job, group_id, sender) for group_id in job.results
+            ))
+        finally:
+            job.status = JOB_DONE
+            job.finished_at = datetime.datetime.utcnow()
+            logger.info(
+                f"广播任务 {job.id} 完成：成功 {job.count(RESULT_SENT)} 个群，"
+                f"失败 {job.count(RESULT_FAILED)} 个群"
+            )
+    
+    async def _send_to_group(self, job, group_id, sender):
+        result = job.results[group_id]
+        while True:
+            result["attempts"] += 1
+            
+            try:
+                # 每次尝试（包括重试）都重新排队，受出站队列的优先级和限速约束
+                await outbox.send(group_id, job.message, priority=PRIORITY_BROADCAST, sender=sender)
+                result["status"] = RESULT_SENT
+                result["error"] = None
+                return
+            except OneBotError as e:
+                result["error"] = str(e)
+                if not e.transient or result["attempts"] > self.max_retries:
+                    result["status"] = RESULT_FAILED
+                    logger.error(f"广播发送到群 {group_id} 失败: {str(e)}")
+                    return
+            except Exception as e:
+                result["status"] = RESULT_FAILED
+                result["error"] = str(e) or type(e).__name__
+                logger.error(f"广播发送到群 {group_id} 出错: {result['error']}")
+                return
+            
+            # 指数退避加随机抖动，避免所有失败的群在同一时刻重试
+            delay = self.retry_base * (2 ** (result["attempts"] - 1))
+            await asyncio.sleep(random.uniform(delay / 2, delay * 1.5))
+
+# 创建全局广播引擎实例
+broadcast_engine = BroadcastEngine()
+
+# 通过机器人连接发送群消息（用于命令中，与OneBot HTTP接口的错误类型保持一致）
+def make_bot_sender(bot):
+    from nonebot.exception import ActionFailed, NetworkError
+    
+    async def sender(group_id, message):
+        try:
+            return await bot.send_group_msg(group_id=int(group_id), message=message)
+        except ActionFailed as e:
+            raise OneBotError(str(e))
+        except NetworkError as e:
+            raise OneBotError(str(e), transient=True)
+    
+    return sender
@@ -0,0 +1,241 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from settings import get_config
+
+# 获取配置
+config = get_config()
+
+# 缓存未命中标记（区分“未缓存”和“缓存了空结果”）
+MISSING = object()
+
+# 带过期时间的LRU缓存（API同步路由运行在线程池中，因此需要加锁）
+class TTLCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key, MISSING)
+            if item is MISSING:
+                self.misses += 1
+                return MISSING
+            
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return MISSING
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, (None, MISSING))[1]
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+# 将玩家及其统计、签到记录转换为与数据库会话无关的快照
+def make_player_snapshot(player):
+    stats = player.player_stats
+    signin = player.daily_signin
+    return {
+        "id": player.id,
+        "qq_id": player.qq_id,
+        "steam_id": player.steam_id,
+        "nickname": player.nickname,
+        "points": player.points,
+        "bind_time": player.bind_time,
+        "last_login": player.last_login,
+        "last_checkin_date": player.last_checkin_date,
+        "created_at": player.created_at,
+        "stats": {
+            "play_time": stats.play_time,
+            "kills": stats.kills,
+            "deaths": stats.deaths,
+            "zombies_killed": stats.zombies_killed
+        } if stats else None,
+        "signin": {
+            "last_signin": signin.last_signin,
+            "consecutive_days": signin.consecutive_days,
+            "total_days": signin.total_days
+        } if signin else None
+    }
+
+# 玩家资料缓存（按qq_id和steam_id索引）
+class PlayerCache:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(PlayerCache, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.by_qq_id = TTLCache(config.PLAYER_CACHE_SIZE, config.PLAYER_CACHE_TTL)
+            self.by_steam_id = TTLCache(config.PLAYER_CACHE_SIZE, config.PLAYER_CACHE_TTL)
+            self._generation = 0
+            self._initialized = True
+    
+    async def get(self, qq_id=None, steam_id=None):
+        """查询玩家快照，未绑定返回None；未命中时从数据库加载"""
+        if qq_id is not None:
+            cache, key = self.by_qq_id, str(qq_id)
+        else:
+            cache, key = self.by_steam_id, str(steam_id)
+        
+        snapshot = cache.get(key)
+        if snapshot is not MISSING:
+            return snapshot
+        
+        # 加载期间如有写入失效，则不缓存可能已过期的结果
+        generation = self._generation
+        snapshot = await self._load(qq_id=qq_id, steam_id=steam_id)
+        if generation == self._generation:
+            self.put(snapshot, qq_id=qq_id, steam_id=steam_id)
+        return snapshot
+    
+    def put(self, snapshot, qq_id=None, steam_id=None):
+        # 空结果也缓存，避免未绑定用户反复查询数据库（绑定时会失效）
+        if snapshot is not None:
+            self.by_qq_id.set(snapshot["qq_id"], snapshot)
+            self.by_steam_id.set(snapshot["steam_id"], snapshot)
+        elif qq_id is not None:
+            self.by_qq_id.set(str(qq_id), None)
+        elif steam_id is not None:
+            self.by_steam_id.set(str(steam_id), None)
+    
+    def invalidate(self, qq_id=None, steam_id=None):
+        """写入后失效缓存，同时清理另一索引中的对应条目"""
+        self._generation += 1
+        for cache, other_cache, key, other_key in (
+            (self.by_qq_id, self.by_steam_id, qq_id, "steam_id"),
+            (self.by_steam_id, self.by_qq_id, steam_id, "qq_id")
+        ):
+            if key is None:
+                continue
+            snapshot = cache.delete(str(key))
+            if snapshot is not MISSING and snapshot is not None:
+                other_cache.delete(snapshot[other_key])
+    
+    def clear(self):
+        self._generation += 1
+        self.by_qq_id.clear()
+        self.by_steam_id.clear()
+    
+    async def _load(self, qq_id=None, steam_id=None):
+        from database import AsyncSessionLocal
+        from repository import get_player_profile
+        
+        async with AsyncSessionLocal() as db:
+            player = await db.run_sync(get_player_profile, qq_id=qq_id, steam_id=steam_id)
+            return make_player_snapshot(player) if player else None
+    
+    def get_stats(self):
+        return {
+            "qq_id": self.by_qq_id.get_stats(),
+            "steam_id": self.by_steam_id.get_stats()
+        }
+
+# 创建全局玩家缓存实例
+player_cache = PlayerCache()
+
+# 缓存的API响应（序列化后的响应体及其强ETag）
+class CachedResponse:
+    def __init__(self, body, generation, ttl):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.generation = generation
+        self.expires_at = time.monotonic() + ttl
+
+# API响应缓存：监控发布新状态时整体失效，另有TTL兜底（状态中的计数器会持续变化）
+class ResponseCache:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ResponseCache, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.ttl = config.API_CACHE_TTL
+            self._entries = {}
+            self._generation = 0
+            self._lock = threading.Lock()
+            self.hits = 0
+            self.misses = 0
+            self._initialized = True
+    
+    @property
+    def generation(self):
+        return self._generation
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != self._generation or entry.expires_at < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+    
+    def set(self, key, body, generation):
+        """缓存响应体；生成期间发生过失效时只返回结果，不写入缓存"""
+        entry = CachedResponse(body, generation, self.ttl)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = entry
+        return entry
+    
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+    
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+# 创建全局API响应缓存实例
+response_cache = ResponseCache()
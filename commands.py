@@ -1,19 +1,168 @@
+import functools
 from nonebot import on_command
 from nonebot.adapters.onebot.v11 import Message, GroupMessageEvent, PrivateMessageEvent
 from nonebot.params import CommandArg
 from nonebot.permission import SUPERUSER
 from nonebot.rule import to_me
 from settings import get_config
-from utils import logger, calculate_sign_in_reward, format_time
-from database import get_db
-from models import QQBotPlayers, PlayerStats, DailySignIn, GroupManagement
+from utils import logger, format_time, get_sign_in_day, is_valid_steam_id
+from database import AsyncSessionLocal
+from repository import bind_player, default_nickname, sign_in, SIGN_IN_ALREADY, SIGN_IN_UNBOUND
 from core import process_command
-import datetime
-import re
+from cache import player_cache
+from leaderboard import leaderboard, resolve_metric, METRICS, METRIC_ALIASES
+from broadcast import broadcast_engine, make_bot_sender, RESULT_SENT, RESULT_FAILED
 
 # 获取配置
 config = get_config()
 
+# 排行数值显示（游戏时长保留两位小数）
+def _format_rank_value(value):
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+# 命令处理函数（定义在模块级，便于基准测试等直接调用）
+async def bind_handler(event, bot, steam_id):
+    if not steam_id:
+        await bot.send(event, "❌ 请输入SteamID，格式：/bind <SteamID>")
+        return "绑定失败：未提供SteamID"
+    
+    # 简单验证SteamID格式
+    if not is_valid_steam_id(steam_id):
+        await bot.send(event, "❌ SteamID格式不正确，请输入以7656119开头的17位数字SteamID")
+        return "绑定失败：SteamID格式不正确"
+    
+    user_id = event.user_id
+    
+    # 检查数据库
+    async with AsyncSessionLocal() as db:
+        try:
+            player_id, created, old_steam_id = await db.run_sync(bind_player, user_id, steam_id)
+        except Exception as e:
+            await db.rollback()
+            raise e
+    
+    # 写入后失效缓存（新旧SteamID以及之前缓存的“未绑定”结果都需要失效）
+    player_cache.invalidate(qq_id=user_id, steam_id=old_steam_id)
+    player_cache.invalidate(steam_id=steam_id)
+    if created:
+        leaderboard.update(user_id, steam_id=steam_id, nickname=default_nickname(user_id))
+    else:
+        leaderboard.update(user_id, steam_id=steam_id)
+    
+    if created:
+        await bot.send(event, f"✅ 账号绑定成功！\nQQ: {user_id}\nSteamID: {steam_id}")
+        return f"绑定成功：QQ={user_id}, SteamID={steam_id}"
+    else:
+        await bot.send(event, f"✅ 账号绑定已更新！\nQQ: {user_id}\nSteamID: {steam_id}")
+        return f"更新绑定成功：QQ={user_id}, SteamID={steam_id}"
+
+async def sign_handler(event, bot):
+    user_id = event.user_id
+    _, day_start, _ = get_sign_in_day()
+    
+    # 先用缓存快速拒绝未绑定和今日已签到的请求
+    cached_player = await player_cache.get(qq_id=user_id)
+    if not cached_player:
+        await bot.send(event, "❌ 您还未绑定账号，请先使用 /bind 命令绑定")
+        return "签到失败：用户未绑定"
+    
+    cached_signin = cached_player["signin"]
+    if cached_signin and cached_signin["last_signin"] and \
+       cached_signin["last_signin"] >= day_start:
+        await bot.send(event, "❌ 您今天已经签到过了，明天再来吧~")
+        return "签到失败：今日已签到"
+    
+    # 条件更新签到记录（并发重复签到只有一次能成功）
+    async with AsyncSessionLocal() as db:
+        result, signin = await db.run_sync(sign_in, user_id)
+    
+    if result == SIGN_IN_UNBOUND:
+        player_cache.invalidate(qq_id=user_id)
+        await bot.send(event, "❌ 您还未绑定账号，请先使用 /bind 命令绑定")
+        return "签到失败：用户未绑定"
+    
+    # 写入后更新缓存
+    player_cache.invalidate(qq_id=user_id)
+    
+    if result == SIGN_IN_ALREADY:
+        await bot.send(event, "❌ 您今天已经签到过了，明天再来吧~")
+        return "签到失败：今日已签到"
+    
+    reward = signin["reward"]
+    consecutive_days = signin["consecutive_days"]
+    leaderboard.update(
+        user_id,
+        nickname=signin["nickname"],
+        points=signin["points"],
+        consecutive_days=consecutive_days,
+        total_days=signin["total_days"]
+    )
+    
+    # 发送签到成功消息
+    message = [
+        f"✅ {signin['nickname']} 签到成功！",
+        f"今日获得: {reward} 积分",
+        f"当前积分: {signin['points']}",
+        f"连续签到: {consecutive_days} 天",
+        f"累计签到: {signin['total_days']} 天"
+    ]
+    
+    # 如果是连续7天或30天，添加额外提示
+    if consecutive_days % 30 == 0:
+        message.append("🎉 恭喜达成连续签到30天成就！获得额外奖励！")
+    elif consecutive_days % 7 == 0:
+        message.append("🎉 恭喜达成连续签到7天成就！获得额外奖励！")
+    
+    await bot.send(event, "\n".join(message))
+    return f"签到成功：获得{reward}积分，连续{consecutive_days}天"
+
+async def me_handler(event, bot):
+    user_id = event.user_id
+    
+    # 从缓存读取玩家资料（未命中时查询数据库）
+    player = await player_cache.get(qq_id=user_id)
+    
+    if not player:
+        await bot.send(event, "❌ 您还未绑定账号，请先使用 /bind 命令绑定")
+        return "查看信息失败：用户未绑定"
+    
+    player_stats = player["stats"]
+    signin_record = player["signin"]
+    
+    # 构建个人信息
+    info = [
+        f"👤 {player['nickname']} 的个人信息",
+        f"QQ: {player['qq_id']}",
+        f"SteamID: {player['steam_id']}",
+        f"积分: {player['points']}",
+        f"绑定时间: {format_time(player['bind_time'])}",
+        f"最近登录: {format_time(player['last_login'])}"
+    ]
+    
+    # 添加统计信息
+    if player_stats:
+        info.extend([
+            "",
+            "🎮 游戏统计：",
+            f"游戏时长: {player_stats['play_time']:.2f} 小时",
+            f"击杀玩家: {player_stats['kills']} 人",
+            f"死亡次数: {player_stats['deaths']} 次",
+            f"击杀僵尸: {player_stats['zombies_killed']} 只"
+        ])
+    
+    # 添加签到信息
+    if signin_record:
+        info.extend([
+            "",
+            "📅 签到信息：",
+            f"连续签到: {signin_record['consecutive_days']} 天",
+            f"累计签到: {signin_record['total_days']} 天",
+            f"最后签到: {format_time(signin_record['last_signin']) if signin_record['last_signin'] else '从未签到'}"
+        ])
+    
+    await bot.send(event, "\n".join(info))
+    return "查看个人信息成功"
+
 # 定义命令
 def register_commands():
     # 帮助命令
@@ -31,7 +180,8 @@ def register_commands():
                     f"{'✅' if config.ENABLE_BIND_COMMAND else '❌'} /bind <SteamID> - 绑定QQ与Steam账号",
                     f"{'✅' if config.ENABLE_SIGN_COMMAND else '❌'} /sign - 每日签到领取积分",
                     f"{'✅' if config.ENABLE_ME_COMMAND else '❌'} /me - 查看个人信息",
-                    f"{'✅' if config.ENABLE_SERVER_COMMAND else '❌'} /server - 查看服务器状态",
+                    f"{'✅' if config.ENABLE_SERVER_COMMAND else '❌'} /server [服务器标识|all] - 查看服务器状态",
+                    f"{'✅' if config.ENABLE_RANK_COMMAND else '❌'} /rank [积分|击杀|僵尸|时长|连签|签到] - 查看排行榜",
                     "",
                     "🔧 管理员命令：",
                     f"{'✅' if config.ENABLE_BROADCAST_COMMAND else '❌'} /broadcast <消息> - 广播消息到所有监控群",
@@ -50,61 +200,10 @@ def register_commands():
         
         @bind_cmd.handle()
         async def handle_bind(event, bot, args: Message = CommandArg()):
-            async def bind_handler(event, bot):
-                # 获取参数
-                steam_id = args.extract_plain_text().strip()
-                
-                if not steam_id:
-                    await bot.send(event, "❌ 请输入SteamID，格式：/bind <SteamID>")
-                    return "绑定失败：未提供SteamID"
-                
-                # 简单验证SteamID格式
-                if not re.match(r'^\d{17}$', steam_id):
-                    await bot.send(event, "❌ SteamID格式不正确，请输入17位数字的SteamID")
-                    return "绑定失败：SteamID格式不正确"
-                
-                user_id = event.user_id
-                
-                # 检查数据库
-                db = next(get_db())
-                try:
-                    # 检查是否已绑定
-                    existing_user = db.query(QQBotPlayers).filter(
-                        QQBotPlayers.qq_id == str(user_id)
-                    ).first()
-                    
-                    if existing_user:
-                        # 更新绑定
-                        existing_user.steam_id = steam_id
-                        existing_user.last_login = datetime.datetime.utcnow()
-                        db.commit()
-                        await bot.send(event, f"✅ 账号绑定已更新！\nQQ: {user_id}\nSteamID: {steam_id}")
-                        return f"更新绑定成功：QQ={user_id}, SteamID={steam_id}"
-                    else:
-                        # 创建新绑定
-                        new_player = QQBotPlayers(
-                            qq_id=str(user_id),
-                            steam_id=steam_id,
-                            nickname=f"玩家{user_id[:4]}"
-                        )
-                        db.add(new_player)
-                        db.flush()  # 获取新创建的ID
-                        
-                        # 创建相关记录
-                        player_stats = PlayerStats(player_id=new_player.id)
-                        daily_signin = DailySignIn(player_id=new_player.id)
-                        db.add_all([player_stats, daily_signin])
-                        db.commit()
-                        
-                        await bot.send(event, f"✅ 账号绑定成功！\nQQ: {user_id}\nSteamID: {steam_id}")
-                        return f"绑定成功：QQ={user_id}, SteamID={steam_id}"
-                except Exception as e:
-                    db.rollback()
-                    raise e
-                finally:
-                    db.close()
-            
-            await process_command(event, bot, "bind", bind_handler)
+            await process_command(
+                event, bot, "bind",
+                functools.partial(bind_handler, steam_id=args.extract_plain_text().strip())
+            )
     
     # 签到命令
     if config.ENABLE_SIGN_COMMAND:
@@ -112,83 +211,6 @@ def register_commands():
         
         @sign_cmd.handle()
         async def handle_sign(event, bot):
-            async def sign_handler(event, bot):
-                user_id = event.user_id
-                
-                # 检查数据库
-                db = next(get_db())
-                try:
-                    # 查询用户
-                    player = db.query(QQBotPlayers).filter(
-                        QQBotPlayers.qq_id == str(user_id)
-                    ).first()
-                    
-                    if not player:
-                        await bot.send(event, "❌ 您还未绑定账号，请先使用 /bind 命令绑定")
-                        return "签到失败：用户未绑定"
-                    
-                    # 查询签到记录
-                    signin_record = db.query(DailySignIn).filter(
-                        DailySignIn.player_id == player.id
-                    ).first()
-                    
-                    if not signin_record:
-                        signin_record = DailySignIn(player_id=player.id)
-                        db.add(signin_record)
-                    
-                    # 检查是否今天已签到
-                    today = datetime.date.today()
-                    if signin_record.last_signin and \
-                       signin_record.last_signin.date() == today:
-                        await bot.send(event, "❌ 您今天已经签到过了，明天再来吧~")
-                        return "签到失败：今日已签到"
-                    
-                    # 更新签到记录
-                    yesterday = today - datetime.timedelta(days=1)
-                    if signin_record.last_signin and \
-                       signin_record.last_signin.date() == yesterday:
-                        # 连续签到
-                        signin_record.consecutive_days += 1
-                    else:
-                        # 重置连续签到天数
-                        signin_record.consecutive_days = 1
-                    
-                    # 更新签到时间和总天数
-                    signin_record.last_signin = datetime.datetime.utcnow()
-                    signin_record.total_days += 1
-                    
-                    # 计算奖励
-                    reward = calculate_sign_in_reward(signin_record.consecutive_days)
-                    player.points += reward
-                    
-                    # 更新最后签到日期
-                    player.last_checkin_date = today.strftime("%Y-%m-%d")
-                    
-                    db.commit()
-                    
-                    # 发送签到成功消息
-                    message = [
-                        f"✅ {player.nickname} 签到成功！",
-                        f"今日获得: {reward} 积分",
-                        f"当前积分: {player.points}",
-                        f"连续签到: {signin_record.consecutive_days} 天",
-                        f"累计签到: {signin_record.total_days} 天"
-                    ]
-                    
-                    # 如果是连续7天或30天，添加额外提示
-                    if signin_record.consecutive_days % 30 == 0:
-                        message.append("🎉 恭喜达成连续签到30天成就！获得额外奖励！")
-                    elif signin_record.consecutive_days % 7 == 0:
-                        message.append("🎉 恭喜达成连续签到7天成就！获得额外奖励！")
-                    
-                    await bot.send(event, "\n".join(message))
-                    return f"签到成功：获得{reward}积分，连续{signin_record.consecutive_days}天"
-                except Exception as e:
-                    db.rollback()
-                    raise e
-                finally:
-                    db.close()
-            
             await process_command(event, bot, "sign", sign_handler)
     
     # 个人信息命令
@@ -197,87 +219,82 @@ def register_commands():
         
         @me_cmd.handle()
         async def handle_me(event, bot):
-            async def me_handler(event, bot):
-                user_id = event.user_id
+            await process_command(event, bot, "me", me_handler)
+    
+    # 排行榜命令
+    if config.ENABLE_RANK_COMMAND:
+        rank_cmd = on_command("rank", aliases={"排行榜", "排行"}, priority=5, block=True)
+        
+        @rank_cmd.handle()
+        async def handle_rank(event, bot, args: Message = CommandArg()):
+            async def rank_handler(event, bot):
+                name = args.extract_plain_text().strip()
+                metric = resolve_metric(name)
+                if metric is None:
+                    await bot.send(event, f"❌ 未知的排行榜: {name}\n可选: {'、'.join(METRIC_ALIASES)}")
+                    return f"查看排行榜失败：未知排行榜{name}"
                 
-                # 检查数据库
-                db = next(get_db())
-                try:
-                    # 查询用户
-                    player = db.query(QQBotPlayers).filter(
-                        QQBotPlayers.qq_id == str(user_id)
-                    ).first()
-                    
-                    if not player:
-                        await bot.send(event, "❌ 您还未绑定账号，请先使用 /bind 命令绑定")
-                        return "查看信息失败：用户未绑定"
-                    
-                    # 查询相关记录
-                    player_stats = db.query(PlayerStats).filter(
-                        PlayerStats.player_id == player.id
-                    ).first()
-                    
-                    signin_record = db.query(DailySignIn).filter(
-                        DailySignIn.player_id == player.id
-                    ).first()
-                    
-                    # 构建个人信息
-                    info = [
-                        f"👤 {player.nickname} 的个人信息",
-                        f"QQ: {player.qq_id}",
-                        f"SteamID: {player.steam_id}",
-                        f"积分: {player.points}",
-                        f"绑定时间: {format_time(player.bind_time)}",
-                        f"最近登录: {format_time(player.last_login)}"
-                    ]
-                    
-                    # 添加统计信息
-                    if player_stats:
-                        info.extend([
-                            "",
-                            "🎮 游戏统计：",
-                            f"游戏时长: {player_stats.play_time:.2f} 小时",
-                            f"击杀玩家: {player_stats.kills} 人",
-                            f"死亡次数: {player_stats.deaths} 次",
-                            f"击杀僵尸: {player_stats.zombies_killed} 只"
-                        ])
-                    
-                    # 添加签到信息
-                    if signin_record:
-                        info.extend([
-                            "",
-                            "📅 签到信息：",
-                            f"连续签到: {signin_record.consecutive_days} 天",
-                            f"累计签到: {signin_record.total_days} 天",
-                            f"最后签到: {format_time(signin_record.last_signin) if signin_record.last_signin else '从未签到'}"
-                        ])
-                    
-                    await bot.send(event, "\n".join(info))
-                    return "查看个人信息成功"
-                except Exception as e:
-                    db.rollback()
-                    raise e
-                finally:
-                    db.close()
+                await leaderboard.ensure_loaded()
+                _, title, unit = METRICS[metric]
+                
+                message = [f"🏆 {title}排行榜"]
+                for entry in leaderboard.top(metric, config.LEADERBOARD_TOP_N):
+                    message.append(f"{entry['rank']}. {entry['nickname']} - {_format_rank_value(entry['value'])} {unit}")
+                if len(message) == 1:
+                    message.append("暂无数据")
+                
+                mine = leaderboard.rank(metric, event.user_id)
+                message.append("")
+                if mine:
+                    message.append(f"我的排名: 第 {mine['rank']} 名（{_format_rank_value(mine['value'])} {unit}）")
+                else:
+                    message.append("您还未绑定账号，绑定后即可上榜")
+                
+                await bot.send(event, "\n".join(message))
+                return f"查看排行榜：{metric}"
             
-            await process_command(event, bot, "me", me_handler)
+            await process_command(event, bot, "rank", rank_handler)
     
     # 服务器状态命令
     if config.ENABLE_SERVER_COMMAND:
         server_cmd = on_command("server", aliases={"服务器状态"}, priority=5, block=True)
         
         @server_cmd.handle()
-        async def handle_server(event, bot):
+        async def handle_server(event, bot, args: Message = CommandArg()):
             async def server_handler(event, bot):
-                from monitor import get_server_status
+                from monitor import server_monitor, get_server_status, get_all_server_status
+                
+                server_key = args.extract_plain_text().strip()
+                
+                # 多服务器且未指定时显示全部服务器概览
+                if server_key in ("all", "全部") or (not server_key and len(server_monitor.servers) > 1):
+                    statuses = get_all_server_status()
+                    online_count = sum(1 for status in statuses if status["is_online"])
+                    message = [f"🖥️ 服务器状态总览（在线 {online_count}/{len(statuses)}）"]
+                    for status in statuses:
+                        if status["is_online"]:
+                            message.append(
+                                f"🟢 [{status['server_key']}] {status['name']} - "
+                                f"{status['players']}/{status['max_players']} - {status['map']}"
+                            )
+                        else:
+                            message.append(f"🔴 [{status['server_key']}] {status['name']} - 离线")
+                    message.append("")
+                    message.append("使用 /server <服务器标识> 查看详情")
+                    
+                    await bot.send(event, "\n".join(message))
+                    return f"查询服务器状态：在线{online_count}/{len(statuses)}"
                 
-                status = get_server_status()
+                status = get_server_status(server_key or None)
+                if status is None:
+                    await bot.send(event, f"❌ 未找到服务器: {server_key}\n可用服务器: {', '.join(server_monitor.servers)}")
+                    return f"查询服务器状态失败：未知服务器{server_key}"
                 
                 if status["is_online"]:
                     # 在线状态
                     message = [
-                        "🟢 服务器状态：在线",
-                        f"服务器地址: {config.SERVER_IP}:{config.SERVER_PORT}",
+                        f"🟢 {status['name']} 状态：在线",
+                        f"服务器地址: {status['address']}",
                         f"当前玩家: {status['players']}/{status['max_players']}",
                         f"当前地图: {status['map']}"
                     ]
@@ -287,8 +304,8 @@ def register_commands():
                 else:
                     # 离线状态
                     message = [
-                        "🔴 服务器状态：离线",
-                        f"服务器地址: {config.SERVER_IP}:{config.SERVER_PORT}",
+                        f"🔴 {status['name']} 状态：离线",
+                        f"服务器地址: {status['address']}",
                         "服务器当前不可用，请稍后再试"
                     ]
                 
@@ -311,28 +328,28 @@ def register_commands():
                     await bot.send(event, "❌ 请输入广播内容，格式：/broadcast <消息>")
                     return "广播失败：未提供内容"
                 
-                # 发送广播到所有监控群
-                success_count = 0
-                fail_count = 0
-                
-                from utils import send_onebot_message
-                
-                for group_id in config.MONITOR_GROUPS:
-                    # 构建广播消息
-                    broadcast_msg = f"📢 系统广播\n{content}\n\n-- 管理员 {event.user_id} 发送"
-                    
-                    # 发送消息
-                    if await bot.send_group_msg(group_id=int(group_id), message=broadcast_msg):
-                        success_count += 1
-                    else:
-                        fail_count += 1
+                # 并发发送广播到所有监控群（受全局和单群速率限制）
+                broadcast_msg = f"📢 系统广播\n{content}\n\n-- 管理员 {event.user_id} 发送"
+                job = await broadcast_engine.broadcast(
+                    config.MONITOR_GROUPS,
+                    broadcast_msg,
+                    sender=make_bot_sender(bot)
+                )
+                success_count = job.count(RESULT_SENT)
+                fail_count = job.count(RESULT_FAILED)
                 
                 # 反馈结果
                 result_msg = f"✅ 广播完成\n成功: {success_count} 个群\n失败: {fail_count} 个群"
+                failed_groups = [
+                    group_id for group_id, result in job.results.items()
+                    if result["status"] == RESULT_FAILED
+                ]
+                if failed_groups:
+                    result_msg += f"\n失败的群: {', '.join(failed_groups)}"
                 await bot.send(event, result_msg)
                 return result_msg
             
             await process_command(event, bot, "broadcast", broadcast_handler, is_admin_only=True)
 
 # 注册所有命令
-register_commands()
\ No newline at end of file
+register_commands()
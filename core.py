@@ -1,9 +1,18 @@
+import time
 from nonebot import get_driver, on_command, on_message, on_notice
 from nonebot.adapters.onebot.v11 import Message, GroupMessageEvent, PrivateMessageEvent, Bot
 from nonebot.params import CommandArg
 from nonebot.permission import SUPERUSER
 from settings import get_config
-from utils import logger, is_superuser, send_onebot_message, log_command
+from utils import logger, is_superuser, log_command, onebot_client, startup_timer
+from log_buffer import command_log_buffer
+from cache import player_cache, response_cache
+from broadcast import broadcast_engine
+from outbox import outbox, PRIORITY_NOTICE
+from leaderboard import leaderboard
+from sessions import session_tracker
+from metrics import COMMANDS, COMMAND_DURATION, loop_lag_monitor
+from profiling import command_profiler, PHASE_PERMISSION
 
 # 获取配置
 config = get_config()
@@ -30,7 +39,7 @@ class BotCore:
     
     def start(self):
         self.is_running = True
-        self.start_time = get_config().get_current_timestamp()
+        self.start_time = get_current_timestamp()
         logger.info("机器人核心服务已启动")
     
     def stop(self):
@@ -39,11 +48,13 @@ class BotCore:
     
     def register_bot(self, bot: Bot):
         self.connected_bots[bot.self_id] = bot
+        response_cache.invalidate()
         logger.info(f"机器人 {bot.self_id} 已注册")
     
     def unregister_bot(self, bot: Bot):
         if bot.self_id in self.connected_bots:
             del self.connected_bots[bot.self_id]
+            response_cache.invalidate()
             logger.info(f"机器人 {bot.self_id} 已注销")
 
 # 创建全局核心实例
@@ -57,10 +68,10 @@ async def handle_bot_connect(bot: Bot):
     # 发送启动通知（如果启用）
     if config.NOTIFY_ON_STARTUP:
         for group_id in config.MONITOR_GROUPS:
-            await send_onebot_message(
-                "group",
-                group_id=group_id,
-                message=f"✅ Unturned服务器助手已启动！\n当前版本: {config.VERSION}\n服务器监控: {'已启用' if config.MONITOR_ENABLED else '已禁用'}"
+            outbox.post(
+                group_id,
+                f"✅ Unturned服务器助手已启动！\n当前版本: {config.VERSION}\n服务器监控: {'已启用' if config.MONITOR_ENABLED else '已禁用'}",
+                priority=PRIORITY_NOTICE
             )
 
 # 注册机器人断开连接事件
@@ -79,17 +90,44 @@ async def on_startup():
     bot_core.start()
     logger.info(f"Unturned服务器助手 v{config.VERSION} 启动成功！")
     
-    # 初始化数据库
-    try:
-        from database import init_db
-        init_db()
-        logger.info("数据库初始化成功")
-    except Exception as e:
-        logger.error(f"数据库初始化失败: {str(e)}")
+    # 数据库在start_bot中最先初始化（其他模块的启动流程依赖数据表）
+    with startup_timer.phase("core"):
+        # 启动命令日志批量写入
+        await command_log_buffer.start()
+        
+        # 启动出站消息队列
+        await outbox.start()
+        
+        # 启动事件循环延迟监测
+        await loop_lag_monitor.start()
 
 @_driver.on_shutdown
 async def on_shutdown():
     bot_core.stop()
+    await loop_lag_monitor.stop()
+    
+    # 先停止API服务并等待进行中的请求完成，之后再关闭它们依赖的连接池
+    if config.API_ENABLED:
+        from api import api_server
+        await api_server.stop()
+    
+    # 结束进行中的在线会话并计入游戏时长：sessions模块先于本模块注册关闭事件，
+    # NoneBot按注册的逆序执行关闭事件，它自己的关闭事件会在连接池关闭之后才执行，因此在这里提前停止
+    await session_tracker.stop()
+    
+    # 写入缓冲区中剩余的命令日志
+    await command_log_buffer.stop()
+    
+    # 取消未完成的后台广播任务，并尽量发完队列中剩余的消息
+    await broadcast_engine.stop()
+    await outbox.stop()
+    
+    # 关闭OneBot连接池
+    await onebot_client.close()
+    
+    # 关闭异步数据库连接池
+    from database import dispose_async_engine
+    await dispose_async_engine()
     logger.info("Unturned服务器助手已关闭")
 
 # 通用命令处理器
@@ -97,24 +135,37 @@ async def process_command(event, bot, command_name, handler_func, is_admin_only=
     """处理命令并记录日志"""
     user_id = event.user_id
     group_id = getattr(event, "group_id", None)
-    
-    # 检查是否为管理员命令
-    if is_admin_only and not await SUPERUSER(bot, event):
-        await bot.send(event, "❌ 权限不足，只有超级用户可以使用此命令")
-        log_command(user_id, group_id, command_name, "", False, "权限不足")
-        return
+    profile, token, profiler = command_profiler.begin(command_name, user_id, group_id)
+    success = False
     
     try:
-        # 调用命令处理函数
-        result = await handler_func(event, bot)
-        log_command(user_id, group_id, command_name, "", True, str(result))
-        return result
-    except Exception as e:
-        error_msg = f"命令执行出错: {str(e)}"
-        logger.error(error_msg)
-        await bot.send(event, f"❌ {error_msg}")
-        log_command(user_id, group_id, command_name, "", False, error_msg)
-        return None
+        # 检查是否为管理员命令
+        started = time.perf_counter_ns()
+        allowed = not is_admin_only or await SUPERUSER(bot, event)
+        profile.add(PHASE_PERMISSION, time.perf_counter_ns() - started)
+        if not allowed:
+            await bot.send(event, "❌ 权限不足，只有超级用户可以使用此命令")
+            log_command(user_id, group_id, command_name, "", False, "权限不足")
+            COMMANDS.inc(command_name, "denied")
+            return
+        
+        try:
+            # 调用命令处理函数
+            result = await handler_func(event, bot)
+            log_command(user_id, group_id, command_name, "", True, str(result))
+            COMMANDS.inc(command_name, "success")
+            success = True
+            return result
+        except Exception as e:
+            error_msg = f"命令执行出错: {str(e)}"
+            logger.error(error_msg)
+            await bot.send(event, f"❌ {error_msg}")
+            log_command(user_id, group_id, command_name, "", False, error_msg)
+            COMMANDS.inc(command_name, "error")
+            return None
+    finally:
+        total_ns = command_profiler.finish(profile, token, profiler, success)
+        COMMAND_DURATION.observe(total_ns / 1e9, command_name)
 
 # 获取机器人状态
 def get_bot_status():
@@ -125,7 +176,15 @@ def get_bot_status():
         "connected_bots_count": len(bot_core.connected_bots),
         "connected_bots": list(bot_core.connected_bots.keys()),
         "monitor_enabled": config.MONITOR_ENABLED,
-        "api_enabled": config.API_ENABLED
+        "api_enabled": config.API_ENABLED,
+        "command_log_buffer": command_log_buffer.get_stats(),
+        "player_cache": player_cache.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "outbox": outbox.get_stats(),
+        "leaderboard": leaderboard.get_stats(),
+        "sessions": session_tracker.get_stats(),
+        "command_profiler": command_profiler.get_stats(),
+        "startup": startup_timer.get_stats()
     }
     return status
 
@@ -1,7 +1,16 @@
-from sqlalchemy import create_engine
+import asyncio
+import hashlib
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, delete, event, insert, select
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from settings import get_config
+from metrics import DB_QUERY_DURATION, DB_QUERY_ERRORS, Gauge
+from profiling import current_profile
 
 # 获取配置
 config = get_config()
@@ -28,52 +37,238 @@ def get_db():
     finally:
         db.close()
 
-# 初始化数据库（创建表和初始数据）
-def init_db():
-    # 导入所有模型以确保它们被注册
-    from models import (
-        QQBotPlayers, PlayerStats, Uconomy, ServerStatus,
-        DailySignIn, GroupManagement, CommandLogs, Announcements
-    )
+# 同步驱动对应的异步驱动
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg"
+}
+
+# 由同步数据库地址推导异步数据库地址（mysql+pymysql -> mysql+aiomysql）
+def get_async_database_url():
+    if config.ASYNC_DATABASE_URL:
+        return config.ASYNC_DATABASE_URL
+    url = make_url(config.DATABASE_URL)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+# 异步引擎的连接与创建它的事件循环绑定，每个事件循环各自创建一个引擎
+# 默认API服务与机器人共用NoneBot的事件循环，只有一个引擎；API线程模式下API线程的事件循环另有一个，
+# 在线程退出前关闭。没有关闭就结束的事件循环（如脚本中多次asyncio.run）留下的引擎在创建新引擎时清理
+_async_engines = {}
+
+def get_async_engine():
+    loop = asyncio.get_running_loop()
+    async_engine = _async_engines.get(loop)
+    if async_engine is None:
+        for closed_loop in [item for item in _async_engines if item.is_closed()]:
+            # 连接所在的事件循环已经结束，无法再正常关闭，只丢弃连接池
+            _async_engines.pop(closed_loop).sync_engine.dispose(close=False)
+        async_engine = create_async_engine(
+            get_async_database_url(),
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=10,
+            pool_pre_ping=True
+        )
+        _async_engines[loop] = async_engine
+    return async_engine
+
+# 创建异步会话（提交后不过期对象，避免访问属性时触发隐式IO）
+def AsyncSessionLocal():
+    return AsyncSession(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
+
+# 异步数据库连接依赖
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# 关闭当前事件循环的异步引擎
+async def dispose_async_engine():
+    async_engine = _async_engines.pop(asyncio.get_running_loop(), None)
+    if async_engine is not None:
+        await async_engine.dispose()
+
+# SQL执行计数器，用于检查处理器的数据库往返次数
+# 未指定bind时统计所有引擎（包括各事件循环的异步引擎）；异步引擎的事件在其内部的同步引擎上触发
+class QueryCounter:
+    def __init__(self, bind=None):
+        if isinstance(bind, AsyncEngine):
+            bind = bind.sync_engine
+        self.bind = Engine if bind is None else bind
+        self.statements = []
     
-    # 创建所有表
-    Base.metadata.create_all(bind=engine)
+    @property
+    def count(self):
+        return len(self.statements)
     
-    # 添加初始数据
-    db = next(get_db())
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
     
-    # 检查是否已有超级用户
-    for superuser_id in config.SUPERUSERS:
-        existing_user = db.query(QQBotPlayers).filter(
-            QQBotPlayers.qq_id == superuser_id
-        ).first()
-        
-        if not existing_user:
-            # 创建超级用户记录
-            superuser = QQBotPlayers(
-                qq_id=superuser_id,
-                steam_id=f"superuser_{superuser_id}",
-                nickname="超级用户",
-                points=99999
-            )
-            db.add(superuser)
+    def __enter__(self):
+        event.listen(self.bind, "before_cursor_execute", self._on_execute)
+        return self
     
-    # 添加监控群配置
-    for group_id in config.MONITOR_GROUPS:
-        existing_group = db.query(GroupManagement).filter(
-            GroupManagement.group_id == group_id
-        ).first()
-        
-        if not existing_group:
-            # 创建群配置记录
-            group_config = GroupManagement(
-                group_id=group_id,
-                enabled=True,
-                admin_only=False,
-                welcome_message="欢迎加入Unturned服务器交流群！"
+    def __exit__(self, exc_type, exc, tb):
+        event.remove(self.bind, "before_cursor_execute", self._on_execute)
+
+# 断言代码块内执行的SQL数量不超过上限
+@contextmanager
+def assert_max_queries(limit, bind=None):
+    with QueryCounter(bind) as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n".join(counter.statements)
+        raise AssertionError(f"执行了 {counter.count} 条SQL，超过上限 {limit}:\n{statements}")
+
+# SQL执行耗时指标和命令剖析（监听所有引擎，异步引擎的事件在其内部的同步引擎上触发）
+_SQL_OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+def _sql_operation(statement):
+    operation = statement.lstrip()[:6].upper()
+    return operation if operation in _SQL_OPERATIONS else "OTHER"
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter_ns()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is not None:
+        elapsed_ns = time.perf_counter_ns() - started
+        DB_QUERY_DURATION.observe(elapsed_ns / 1e9, conn.dialect.driver, _sql_operation(statement))
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add_query(elapsed_ns)
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    if context.connection is not None:
+        context.connection.info.pop("query_started", None)
+    DB_QUERY_ERRORS.inc(context.engine.dialect.driver, _sql_operation(context.statement or ""))
+
+# 连接池状态（导出指标时读取）
+def _pool_stats():
+    engines = [("sync", engine)] + [("async", async_engine.sync_engine) for async_engine in list(_async_engines.values())]
+    stats = {}
+    for name, bind in engines:
+        pool = bind.pool
+        # 只有QueuePool等带容量限制的连接池提供这些统计
+        if not hasattr(pool, "checkedout"):
+            continue
+        for state, value in (
+            ("size", pool.size()),
+            ("checked_out", pool.checkedout()),
+            ("checked_in", pool.checkedin()),
+            ("overflow", max(0, pool.overflow()))
+        ):
+            key = (name, state)
+            stats[key] = stats.get(key, 0) + value
+    return stats
+
+Gauge("db_pool_connections", "数据库连接池状态（state：size/checked_out/checked_in/overflow）", ("engine", "state"), function=_pool_stats)
+
+# 数据库结构版本：由所有表、列、索引的定义和迁移列表计算，模型或迁移变化后自动变化
+def schema_version():
+    from migrations import MIGRATIONS
+    parts = []
+    for table in sorted(Base.metadata.tables.values(), key=lambda table: table.name):
+        parts.append(f"table {table.name}")
+        for column in table.columns:
+            parts.append(
+                f"column {column.name} {column.type!r} nullable={column.nullable} "
+                f"primary_key={column.primary_key} unique={column.unique}"
             )
-            db.add(group_config)
+        for index in sorted(table.indexes, key=lambda index: index.name or ""):
+            parts.append(f"index {index.name} {[column.name for column in index.columns]} unique={index.unique}")
+    parts.extend(f"migration {item.version}" for item in MIGRATIONS)
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+# 读取数据库中记录的结构版本（表不存在时返回None）
+def _read_schema_version(conn):
+    from models import SchemaVersion
+    try:
+        return conn.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1)).scalar()
+    except DBAPIError:
+        conn.rollback()
+        return None
+
+# 创建缺少的表，执行尚未执行的迁移（升级旧表结构），之后记录结构版本
+# 迁移在各自的连接中执行（在线建索引需要自动提交模式），因此先提交建表
+def _upgrade_schema(conn, version):
+    from models import SchemaVersion
+    from migrations import run_migrations
+    Base.metadata.create_all(bind=conn)
+    conn.commit()
+    
+    run_migrations(conn.engine)
+    
+    conn.execute(delete(SchemaVersion))
+    conn.execute(insert(SchemaVersion).values(id=1, version=version))
+
+# 唯一键冲突时跳过该行的INSERT语句（index_elements指定只忽略哪个唯一键的冲突，MySQL的IGNORE会忽略所有冲突）；
+# 不支持的数据库返回None，由调用方先查询再插入
+def insert_ignore(table, dialect_name, index_elements=None):
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        return postgresql_insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect_name == "mysql":
+        return insert(table).prefix_with("IGNORE")
+    return None
+
+# 批量插入初始数据，已存在（唯一键冲突）的行跳过，每张表一条语句
+def _insert_missing(conn, table, rows, key):
+    if not rows:
+        return
+    statement = insert_ignore(table, conn.dialect.name)
+    if statement is not None:
+        conn.execute(statement, rows)
+    else:
+        column = table.c[key]
+        existing = set(conn.execute(select(column).where(column.in_([row[key] for row in rows]))).scalars())
+        rows = [row for row in rows if row[key] not in existing]
+        if rows:
+            conn.execute(insert(table), rows)
+
+# 初始化数据库（创建表和初始数据）
+# 结构版本与数据库中记录的一致时跳过建表检查，只执行一次版本查询和初始数据的批量插入
+def init_db():
+    # 导入models模块以确保所有模型都已注册
+    from models import QQBotPlayers, GroupManagement
     
-    # 提交事务
-    db.commit()
-    db.close()
\ No newline at end of file
+    version = schema_version()
+    with engine.connect() as conn:
+        if _read_schema_version(conn) != version:
+            _upgrade_schema(conn, version)
+        
+        # 超级用户记录
+        _insert_missing(conn, QQBotPlayers.__table__, [
+            {
+                "qq_id": superuser_id,
+                "steam_id": f"superuser_{superuser_id}",
+                "nickname": "超级用户",
+                "points": 99999
+            }
+            for superuser_id in config.SUPERUSERS
+        ], "qq_id")
+        
+        # 监控群配置
+        _insert_missing(conn, GroupManagement.__table__, [
+            {
+                "group_id": group_id,
+                "enabled": True,
+                "admin_only": False,
+                "welcome_message": "欢迎加入Unturned服务器交流群！"
+            }
+            for group_id in config.MONITOR_GROUPS
+        ], "group_id")
+        
+        # 提交事务
+        conn.commit()
+
+# 在线程池中初始化数据库，不阻塞事件循环（启动时调用）
+async def init_db_async():
+    await asyncio.get_running_loop().run_in_executor(None, init_db)
@@ -0,0 +1,433 @@
+import asyncio
+import datetime
+from nonebot import get_driver
+from sqlalchemy import delete, func, insert, select
+from settings import get_config
+from utils import logger, startup_timer
+from database import SessionLocal
+from models import ServerStatus, ServerStatusRollup
+
+# 获取配置
+config = get_config()
+
+# 聚合粒度（秒）
+RESOLUTIONS = {
+    "1m": 60,
+    "1h": 3600,
+    "1d": 86400
+}
+
+# 每个粒度由哪个更细的粒度汇总而来（1m直接由原始数据汇总）
+ROLLUP_SOURCES = {
+    "1h": "1m",
+    "1d": "1h"
+}
+
+# 单次处理的时间跨度，避免一次加载过多数据
+ROLLUP_CHUNKS = {
+    "1m": datetime.timedelta(days=1),
+    "1h": datetime.timedelta(days=7),
+    "1d": datetime.timedelta(days=90)
+}
+
+# 汇总时预留的延迟，避免与正在写入的原始记录竞争
+ROLLUP_LAG = datetime.timedelta(seconds=60)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# 将时间向下取整到粒度边界（UTC）
+def floor_time(dt, seconds):
+    elapsed = int((dt - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=elapsed - elapsed % seconds)
+
+# 两条原始记录之间允许的最大间隔，超过视为监控中断（该时段不计入统计）
+# 监控间隔直接从配置读取（与monitor的解析规则一致，无效配置忽略），不导入monitor模块
+def max_status_gap():
+    intervals = [config.MONITOR_INTERVAL]
+    for item in config.MONITOR_SERVERS:
+        interval = item.get("interval")
+        try:
+            interval = float(config.MONITOR_INTERVAL if interval is None else interval)
+        except (TypeError, ValueError):
+            continue
+        if interval > 0:
+            intervals.append(interval)
+    return datetime.timedelta(seconds=2 * (config.STATUS_HEARTBEAT_INTERVAL + max(intervals)))
+
+# 判断本次状态是否需要写入数据库（变化写入模式）
+def should_persist_status(status, last_status, last_saved_at, now):
+    if config.STATUS_PERSIST_MODE != "change" or last_status is None:
+        return True
+    
+    # 在线状态或地图变化
+    if status["is_online"] != last_status["is_online"] or status["map"] != last_status["map"]:
+        return True
+    
+    # 玩家数明显变化
+    if abs(status["players"] - last_status["players"]) >= config.STATUS_PLAYER_CHANGE_THRESHOLD:
+        return True
+    
+    # 定期写入心跳记录
+    return (now - last_saved_at).total_seconds() >= config.STATUS_HEARTBEAT_INTERVAL
+
+# 聚合累加器
+class _Bucket:
+    __slots__ = ("covered", "online", "player_seconds", "min_players", "peak_players", "capacity")
+    
+    def __init__(self):
+        self.covered = 0.0
+        self.online = 0.0
+        self.player_seconds = 0.0
+        self.min_players = None
+        self.peak_players = 0
+        self.capacity = 0
+    
+    def add(self, covered, online, player_seconds, min_players, peak_players, capacity):
+        self.covered += covered
+        self.online += online
+        self.player_seconds += player_seconds
+        self.min_players = min_players if self.min_players is None else min(self.min_players, min_players)
+        self.peak_players = max(self.peak_players, peak_players)
+        self.capacity = max(self.capacity, capacity or 0)
+    
+    def to_row(self, server_key, resolution, bucket_start):
+        return {
+            "server_key": server_key,
+            "resolution": resolution,
+            "bucket_start": bucket_start,
+            "covered_seconds": self.covered,
+            "online_seconds": self.online,
+            "player_seconds": self.player_seconds,
+            "min_players": self.min_players or 0,
+            "peak_players": self.peak_players,
+            "avg_players": self.player_seconds / self.covered if self.covered else 0.0,
+            "uptime_ratio": self.online / self.covered if self.covered else 0.0,
+            "capacity": self.capacity
+        }
+
+# 将原始状态记录按时间段切分到分钟桶中（每条记录代表到下一条记录之前的状态）
+def _rollup_raw(records, start, end, size):
+    buckets = {}
+    gap = max_status_gap()
+    for index, record in enumerate(records):
+        next_time = records[index + 1].timestamp if index + 1 < len(records) else end
+        segment_start = max(record.timestamp, start)
+        segment_end = min(next_time, record.timestamp + gap, end)
+        players = record.players if record.is_online else 0
+        
+        cursor = segment_start
+        while cursor < segment_end:
+            bucket_start = floor_time(cursor, size)
+            bucket_end = min(segment_end, bucket_start + datetime.timedelta(seconds=size))
+            seconds = (bucket_end - cursor).total_seconds()
+            bucket = buckets.setdefault(bucket_start, _Bucket())
+            bucket.add(
+                seconds,
+                seconds if record.is_online else 0.0,
+                players * seconds,
+                players,
+                players,
+                record.max_players
+            )
+            cursor = bucket_end
+    return buckets
+
+# 将细粒度聚合合并为粗粒度聚合
+def _rollup_aggregates(rows, size):
+    buckets = {}
+    for row in rows:
+        bucket = buckets.setdefault(floor_time(row.bucket_start, size), _Bucket())
+        bucket.add(
+            row.covered_seconds,
+            row.online_seconds,
+            row.player_seconds,
+            row.min_players,
+            row.peak_players,
+            row.capacity
+        )
+    return buckets
+
+# 某粒度下一个待汇总的时间点
+def _next_bucket(db, server_key, resolution):
+    latest = db.execute(
+        select(func.max(ServerStatusRollup.bucket_start)).where(
+            ServerStatusRollup.server_key == server_key,
+            ServerStatusRollup.resolution == resolution
+        )
+    ).scalar()
+    if latest is None:
+        return None
+    return latest + datetime.timedelta(seconds=RESOLUTIONS[resolution])
+
+# 原始记录中可以删除的部分的截止时间：此前的记录都已汇总到分钟聚合数据中，
+# 并保留截止时间前一段最大间隔内的记录，作为下次汇总的起始状态；尚未汇总过时返回None
+def raw_rollup_cutoff(db, server_key):
+    minute_end = _next_bucket(db, server_key, "1m")
+    if minute_end is None:
+        return None
+    return minute_end - max_status_gap()
+
+# 汇总单个服务器单个粒度的数据，返回汇总截止时间
+def _rollup_server(db, server_key, resolution, source_end):
+    size = RESOLUTIONS[resolution]
+    source = ROLLUP_SOURCES.get(resolution)
+    end = floor_time(source_end, size)
+    
+    start = _next_bucket(db, server_key, resolution)
+    if start is None:
+        # 首次汇总：从最早的数据开始
+        if source is None:
+            first = db.execute(
+                select(func.min(ServerStatus.timestamp)).where(ServerStatus.server_key == server_key)
+            ).scalar()
+        else:
+            first = db.execute(
+                select(func.min(ServerStatusRollup.bucket_start)).where(
+                    ServerStatusRollup.server_key == server_key,
+                    ServerStatusRollup.resolution == source
+                )
+            ).scalar()
+        if first is None:
+            return None
+        start = floor_time(first, size)
+    
+    while start < end:
+        chunk_end = min(end, start + ROLLUP_CHUNKS[resolution])
+        
+        if source is None:
+            # 取区间开始前的最后一条记录，用于确定区间起点的状态
+            previous = db.execute(
+                select(ServerStatus).where(
+                    ServerStatus.server_key == server_key,
+                    ServerStatus.timestamp < start
+                ).order_by(ServerStatus.timestamp.desc()).limit(1)
+            ).scalars().all()
+            records = db.execute(
+                select(ServerStatus).where(
+                    ServerStatus.server_key == server_key,
+                    ServerStatus.timestamp >= start,
+                    ServerStatus.timestamp < chunk_end
+                ).order_by(ServerStatus.timestamp)
+            ).scalars().all()
+            buckets = _rollup_raw(previous + records, start, chunk_end, size)
+        else:
+            rows = db.execute(
+                select(ServerStatusRollup).where(
+                    ServerStatusRollup.server_key == server_key,
+                    ServerStatusRollup.resolution == source,
+                    ServerStatusRollup.bucket_start >= start,
+                    ServerStatusRollup.bucket_start < chunk_end
+                )
+            ).scalars().all()
+            buckets = _rollup_aggregates(rows, size)
+        
+        # 先删除再插入，保证重复执行时结果一致
+        db.execute(
+            delete(ServerStatusRollup).where(
+                ServerStatusRollup.server_key == server_key,
+                ServerStatusRollup.resolution == resolution,
+                ServerStatusRollup.bucket_start >= start,
+                ServerStatusRollup.bucket_start < chunk_end
+            )
+        )
+        if buckets:
+            db.execute(
+                insert(ServerStatusRollup),
+                [bucket.to_row(server_key, resolution, bucket_start) for bucket_start, bucket in sorted(buckets.items())]
+            )
+        db.commit()
+        start = chunk_end
+    
+    return end
+
+# 执行一次完整的汇总与压缩（同步，在线程池中运行）
+def run_rollup(now=None):
+    now = now or datetime.datetime.utcnow()
+    db = SessionLocal()
+    try:
+        server_keys = db.execute(select(ServerStatus.server_key).distinct()).scalars().all()
+        for server_key in server_keys:
+            minute_end = _rollup_server(db, server_key, "1m", now - ROLLUP_LAG)
+            if minute_end is None:
+                continue
+            hour_end = _rollup_server(db, server_key, "1h", minute_end) or minute_end
+            _rollup_server(db, server_key, "1d", hour_end)
+            
+            # 过期的原始记录由retention模块归档后分批删除（见raw_rollup_cutoff）
+            
+            # 删除已汇总为更粗粒度的过期聚合数据
+            for resolution, retention_days, consumed_end in (
+                ("1m", config.STATUS_MINUTE_RETENTION_DAYS, hour_end),
+                ("1h", config.STATUS_HOUR_RETENTION_DAYS, floor_time(hour_end, RESOLUTIONS["1d"]))
+            ):
+                cutoff = min(now - datetime.timedelta(days=retention_days), consumed_end)
+                db.execute(
+                    delete(ServerStatusRollup).where(
+                        ServerStatusRollup.server_key == server_key,
+                        ServerStatusRollup.resolution == resolution,
+                        ServerStatusRollup.bucket_start < cutoff
+                    )
+                )
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# 历史查询每页最大条数
+HISTORY_MAX_LIMIT = 5000
+
+# 转换为不带时区的UTC时间（数据库中统一存储UTC）
+def to_utc_naive(dt):
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _epoch(dt):
+    return int((dt - EPOCH).total_seconds())
+
+# 查询时间范围内的汇总指标（使用聚合数据，原始粒度使用分钟聚合）
+def query_history_summary(db, server_key, start, end, resolution):
+    resolution = "1m" if resolution == "raw" else resolution
+    row = db.execute(
+        select(
+            func.sum(ServerStatusRollup.covered_seconds),
+            func.sum(ServerStatusRollup.online_seconds),
+            func.sum(ServerStatusRollup.player_seconds),
+            func.max(ServerStatusRollup.peak_players),
+            func.max(ServerStatusRollup.capacity)
+        ).where(
+            ServerStatusRollup.server_key == server_key,
+            ServerStatusRollup.resolution == resolution,
+            ServerStatusRollup.bucket_start >= start,
+            ServerStatusRollup.bucket_start < end
+        )
+    ).one()
+    covered, online, player_seconds, peak, capacity = row
+    covered = covered or 0.0
+    avg_players = (player_seconds or 0.0) / covered if covered else 0.0
+    return {
+        "covered_seconds": covered,
+        "uptime_percent": round((online or 0.0) / covered * 100, 2) if covered else 0.0,
+        "peak_players": peak or 0,
+        "avg_players": round(avg_players, 3),
+        "avg_occupancy_percent": round(avg_players / capacity * 100, 2) if capacity else 0.0
+    }
+
+# 按时间范围分页查询历史数据（以时间戳为游标，返回列式数据）
+def query_history(db, server_key, start, end, resolution, cursor=None, limit=500):
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    # 游标为上一页最后一条记录的时间（微秒时间戳），保证同一秒内的记录不会漏掉
+    after = EPOCH + datetime.timedelta(microseconds=cursor) if cursor is not None else None
+    
+    if resolution == "raw":
+        query = select(
+            ServerStatus.timestamp,
+            ServerStatus.is_online,
+            ServerStatus.players,
+            ServerStatus.max_players
+        ).where(
+            ServerStatus.server_key == server_key,
+            ServerStatus.timestamp > after if after else ServerStatus.timestamp >= start,
+            ServerStatus.timestamp < end
+        ).order_by(ServerStatus.timestamp).limit(limit + 1)
+        columns = ["ts", "is_online", "players", "max_players"]
+        convert = lambda row: [_epoch(row[0]), int(bool(row[1])), row[2], row[3]]
+    else:
+        query = select(
+            ServerStatusRollup.bucket_start,
+            ServerStatusRollup.uptime_ratio,
+            ServerStatusRollup.avg_players,
+            ServerStatusRollup.min_players,
+            ServerStatusRollup.peak_players,
+            ServerStatusRollup.capacity
+        ).where(
+            ServerStatusRollup.server_key == server_key,
+            ServerStatusRollup.resolution == resolution,
+            ServerStatusRollup.bucket_start > after if after else ServerStatusRollup.bucket_start >= start,
+            ServerStatusRollup.bucket_start < end
+        ).order_by(ServerStatusRollup.bucket_start).limit(limit + 1)
+        columns = ["ts", "uptime_ratio", "avg_players", "min_players", "peak_players", "capacity"]
+        convert = lambda row: [_epoch(row[0]), round(row[1], 4), round(row[2], 3), row[3], row[4], row[5]]
+    
+    rows = db.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        next_cursor = (rows[-1][0] - EPOCH) // datetime.timedelta(microseconds=1)
+    
+    # 列式输出：每列一个数组，减少重复的字段名
+    data = {column: [] for column in columns}
+    for row in rows:
+        for column, value in zip(columns, convert(row)):
+            data[column].append(value)
+    
+    return {
+        "columns": columns,
+        "data": data,
+        "count": len(rows),
+        "next_cursor": next_cursor
+    }
+
+# 后台汇总任务
+class StatusRollupJob:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(StatusRollupJob, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.is_running = False
+            self.rollup_task = None
+            self.last_run = None
+            self._initialized = True
+    
+    async def start(self):
+        if not self.is_running and config.STATUS_ROLLUP_ENABLED:
+            self.is_running = True
+            self.rollup_task = asyncio.create_task(self._rollup_loop())
+            logger.info("服务器状态汇总任务已启动")
+    
+    async def stop(self):
+        if self.is_running:
+            self.is_running = False
+            if self.rollup_task:
+                self.rollup_task.cancel()
+                try:
+                    await self.rollup_task
+                except asyncio.CancelledError:
+                    pass
+                self.rollup_task = None
+            logger.info("服务器状态汇总任务已停止")
+    
+    async def _rollup_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.is_running:
+            try:
+                await loop.run_in_executor(None, run_rollup)
+                self.last_run = datetime.datetime.utcnow()
+            except Exception as e:
+                logger.error(f"服务器状态汇总出错: {str(e)}")
+            
+            await asyncio.sleep(config.STATUS_ROLLUP_INTERVAL)
+
+# 创建全局汇总任务实例
+status_rollup_job = StatusRollupJob()
+
+# 注册驱动事件
+driver = get_driver()
+
+@driver.on_startup
+async def on_startup():
+    with startup_timer.phase("history"):
+        await status_rollup_job.start()
+
+@driver.on_shutdown
+async def on_shutdown():
+    await status_rollup_job.stop()
@@ -0,0 +1,198 @@
+import threading
+from sortedcontainers import SortedList
+from sqlalchemy import select
+from utils import logger
+from models import QQBotPlayers, PlayerStats, DailySignIn
+
+# 排行榜指标：名称 -> (数据库列, 显示名称, 单位)
+METRICS = {
+    "points": (QQBotPlayers.points, "积分", "分"),
+    "kills": (PlayerStats.kills, "击杀玩家", "人"),
+    "zombies_killed": (PlayerStats.zombies_killed, "击杀僵尸", "只"),
+    "play_time": (PlayerStats.play_time, "游戏时长", "小时"),
+    "consecutive_days": (DailySignIn.consecutive_days, "连续签到", "天"),
+    "total_days": (DailySignIn.total_days, "累计签到", "天")
+}
+
+# 命令中可使用的指标别名
+METRIC_ALIASES = {
+    "积分": "points",
+    "击杀": "kills",
+    "僵尸": "zombies_killed",
+    "时长": "play_time",
+    "连签": "consecutive_days",
+    "签到": "total_days"
+}
+
+# 加载全部玩家的排行数据（一次查询）
+_load_query = (
+    select(
+        QQBotPlayers.qq_id,
+        QQBotPlayers.steam_id,
+        QQBotPlayers.nickname,
+        *(column for column, _, _ in METRICS.values())
+    )
+    .outerjoin(PlayerStats, PlayerStats.player_id == QQBotPlayers.id)
+    .outerjoin(DailySignIn, DailySignIn.player_id == QQBotPlayers.id)
+)
+
+# 解析指标名称（支持别名），未知指标返回None
+def resolve_metric(name):
+    if not name:
+        return "points"
+    return name if name in METRICS else METRIC_ALIASES.get(name)
+
+# 内存排行榜：每个指标一个有序列表（按分数降序，同分按QQ号），
+# 启动后首次查询时从数据库加载一次，之后由签到、统计写入和API写入增量更新
+# 前N名和个人排名查询均为O(log n)；API线程模式下会跨线程访问，因此需要加锁
+class Leaderboard:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Leaderboard, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self._lock = threading.Lock()
+            self._players = {}  # qq_id -> {"steam_id", "nickname", 各指标分数}
+            self._boards = {metric: SortedList() for metric in METRICS}
+            self._loaded = False
+            self._pending = None  # 加载期间收到的更新，加载完成后重放
+            self._generation = 0
+            self.loads = 0
+            self._initialized = True
+    
+    @property
+    def loaded(self):
+        return self._loaded
+    
+    async def ensure_loaded(self):
+        """首次使用时从数据库加载排行数据"""
+        if self._loaded:
+            return
+        
+        from database import AsyncSessionLocal
+        with self._lock:
+            generation = self._generation
+            if self._pending is None:
+                self._pending = []
+        
+        try:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(_load_query)).all()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        
+        # 在锁外批量构建有序列表，比逐个插入快得多
+        players = {}
+        for row in rows:
+            player = {"steam_id": row.steam_id, "nickname": row.nickname}
+            for metric, (column, _, _) in METRICS.items():
+                player[metric] = getattr(row, column.key) or 0
+            players[row.qq_id] = player
+        boards = {
+            metric: SortedList((-player[metric], qq_id) for qq_id, player in players.items())
+            for metric in METRICS
+        }
+        
+        with self._lock:
+            # 已被其他加载完成，或加载期间数据被整体失效
+            if self._loaded or generation != self._generation:
+                return
+            self._players = players
+            self._boards = boards
+            
+            # 重放加载期间的增量更新
+            for args in self._pending or ():
+                self._set(*args)
+            self._pending = None
+            self._loaded = True
+            self.loads += 1
+        logger.info(f"排行榜已加载，共 {len(players)} 名玩家")
+    
+    def update(self, qq_id, steam_id=None, nickname=None, **metrics):
+        """写入玩家数据后增量更新排行（未提供的字段保持不变）"""
+        unknown = set(metrics) - set(METRICS)
+        if unknown:
+            raise ValueError(f"未知的排行指标: {', '.join(sorted(unknown))}")
+        
+        with self._lock:
+            args = (str(qq_id), steam_id, nickname, metrics)
+            if self._loaded:
+                self._set(*args)
+            elif self._pending is not None:
+                self._pending.append(args)
+            # 尚未开始加载时无需记录，加载时会读取数据库中的最新值
+    
+    def invalidate(self):
+        """大批量写入后丢弃内存数据，下次查询时重新加载"""
+        with self._lock:
+            self._generation += 1
+            self._loaded = False
+            self._pending = None
+    
+    def _set(self, qq_id, steam_id, nickname, metrics):
+        player = self._players.get(qq_id)
+        if player is None:
+            player = {"steam_id": None, "nickname": None}
+            player.update((metric, 0) for metric in METRICS)
+            self._players[qq_id] = player
+            for metric, board in self._boards.items():
+                board.add((0, qq_id))
+        
+        if steam_id is not None:
+            player["steam_id"] = steam_id
+        if nickname is not None:
+            player["nickname"] = nickname
+        
+        for metric, value in metrics.items():
+            value = value or 0
+            if value == player[metric]:
+                continue
+            board = self._boards[metric]
+            board.remove((-player[metric], qq_id))
+            board.add((-value, qq_id))
+            player[metric] = value
+    
+    def _entry(self, metric, rank, qq_id):
+        player = self._players[qq_id]
+        return {
+            "rank": rank,
+            "qq_id": qq_id,
+            "nickname": player["nickname"] or qq_id,
+            "value": player[metric]
+        }
+    
+    def top(self, metric, limit=10, offset=0):
+        """返回排名第offset+1起的limit名玩家（同分同名次）"""
+        with self._lock:
+            board = self._boards[metric]
+            entries = []
+            for key in board.islice(offset, offset + limit):
+                # 名次为分数严格更高的玩家数 + 1
+                entries.append(self._entry(metric, board.bisect_left((key[0],)) + 1, key[1]))
+            return entries
+    
+    def rank(self, metric, qq_id):
+        """查询玩家的名次，未上榜返回None"""
+        with self._lock:
+            player = self._players.get(str(qq_id))
+            if player is None:
+                return None
+            rank = self._boards[metric].bisect_left((-player[metric],)) + 1
+            return self._entry(metric, rank, str(qq_id))
+    
+    def get_stats(self):
+        return {
+            "loaded": self._loaded,
+            "players": len(self._players),
+            "loads": self.loads
+        }
+
+# 创建全局排行榜实例
+leaderboard = Leaderboard()
@@ -0,0 +1,197 @@
+import asyncio
+import collections
+import datetime
+from sqlalchemy import insert
+from settings import get_config
+from utils import logger
+
+# 获取配置
+config = get_config()
+
+# 单条INSERT语句包含的最大行数（避免超过数据库的参数数量限制）
+MAX_ROWS_PER_STATEMENT = 500
+
+# 溢出策略
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+
+# 命令日志缓冲区：攒够N条或等待T毫秒后用一条多行INSERT批量写入
+class CommandLogBuffer:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(CommandLogBuffer, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.max_size = max(1, config.COMMAND_LOG_BUFFER_SIZE)
+            self.flush_rows = max(1, min(config.COMMAND_LOG_FLUSH_ROWS, self.max_size))
+            self.flush_interval = config.COMMAND_LOG_FLUSH_INTERVAL_MS / 1000
+            self.overflow_policy = config.COMMAND_LOG_OVERFLOW_POLICY
+            self._entries = collections.deque()
+            self._wakeup = None
+            self._flush_lock = asyncio.Lock()
+            self._flush_task = None
+            self._background_flush = None  # 未启动后台刷新时，线程池中正在进行的写入
+            self._stopping = False
+            
+            # 统计信息
+            self.flushed = 0
+            self.dropped = 0
+            self.delayed = 0
+            self.failed_flushes = 0
+            self._initialized = True
+    
+    def append(self, entry):
+        # 缓冲区已满时按溢出策略丢弃
+        if len(self._entries) >= self.max_size:
+            self.dropped += 1
+            if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                return
+            self._entries.popleft()
+        self._entries.append(entry)
+        
+        if self._flush_task is None:
+            # 未启动后台刷新（例如独立脚本中调用）：在事件循环中交给线程池写入，
+            # 不在事件循环中阻塞等待数据库提交；没有事件循环时直接同步写入
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._flush_sync()
+                return
+            if self._background_flush is None:
+                self._schedule_background_flush(loop)
+        elif len(self._entries) >= self.flush_rows:
+            self._wakeup.set()
+    
+    async def start(self):
+        if self._flush_task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info("命令日志缓冲区已启动")
+    
+    async def stop(self):
+        if self._flush_task is not None:
+            # 不直接取消任务，避免中断正在进行的写入
+            self._stopping = True
+            self._wakeup.set()
+            await self._flush_task
+            self._flush_task = None
+            
+            # 写入剩余的日志
+            await self.flush()
+            logger.info(
+                f"命令日志缓冲区已停止，共写入 {self.flushed} 条，"
+                f"丢弃 {self.dropped} 条，延迟 {self.delayed} 条，剩余 {len(self._entries)} 条"
+            )
+    
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    async def flush(self):
+        if not self._entries:
+            return
+        
+        async with self._flush_lock:
+            rows = self._take_all()
+            if not rows:
+                return
+            
+            try:
+                # 在线程池中执行数据库写入，不阻塞事件循环
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, _write_rows, rows)
+                self.flushed += len(rows)
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"批量写入命令日志失败: {str(e)}")
+                self._requeue(rows)
+    
+    def _flush_sync(self):
+        """同步写入缓冲区中的日志，返回是否成功"""
+        rows = self._take_all()
+        if not rows:
+            return True
+        try:
+            _write_rows(rows)
+            self.flushed += len(rows)
+            return True
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"记录命令日志失败: {str(e)}")
+            self._requeue(rows)
+            return False
+    
+    def _schedule_background_flush(self, loop):
+        self._background_flush = loop.run_in_executor(None, self._flush_sync)
+        self._background_flush.add_done_callback(self._background_flush_done)
+    
+    def _background_flush_done(self, future):
+        # 回调在事件循环中执行；写入期间又有新日志时继续写入，写入失败则等到下一条日志再重试
+        self._background_flush = None
+        if not future.cancelled() and future.result() and self._entries and self._flush_task is None:
+            self._schedule_background_flush(asyncio.get_running_loop())
+    
+    def _take_all(self):
+        # 可能在线程池中执行，逐条取出，不丢失取出期间追加的日志
+        return [self._entries.popleft() for _ in range(len(self._entries))]
+    
+    def _requeue(self, rows):
+        # 写入失败的日志放回队首，等待下次刷新；超出容量的部分按最旧丢弃
+        self.delayed += len(rows)
+        space = self.max_size - len(self._entries)
+        if space < len(rows):
+            self.dropped += len(rows) - max(space, 0)
+            rows = rows[len(rows) - max(space, 0):]
+        self._entries.extendleft(reversed(rows))
+    
+    def get_stats(self):
+        return {
+            "pending": len(self._entries),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "delayed": self.delayed,
+            "failed_flushes": self.failed_flushes,
+            "overflow_policy": self.overflow_policy
+        }
+
+# 批量写入（在线程池中执行）
+def _write_rows(rows):
+    from database import SessionLocal
+    from models import CommandLogs
+    
+    db = SessionLocal()
+    try:
+        for i in range(0, len(rows), MAX_ROWS_PER_STATEMENT):
+            db.execute(insert(CommandLogs).values(rows[i:i + MAX_ROWS_PER_STATEMENT]))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# 创建全局日志缓冲区实例
+command_log_buffer = CommandLogBuffer()
+
+# 生成一条命令日志记录
+def make_log_entry(user_id, group_id, command, arguments, success, result):
+    return {
+        "timestamp": datetime.datetime.utcnow(),
+        "user_id": str(user_id),
+        "group_id": str(group_id) if group_id else None,
+        "command": command,
+        "arguments": arguments,
+        "success": success,
+        "result": result[:255] if result else None  # 截断过长的结果
+    }
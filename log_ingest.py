@@ -0,0 +1,407 @@
+import asyncio
+import datetime
+import hashlib
+import mmap
+import os
+import re
+from nonebot import get_driver
+from sqlalchemy import bindparam, func, insert, select, update
+from settings import get_config
+from utils import logger, startup_timer
+from database import SessionLocal
+from models import QQBotPlayers, PlayerStats, LogIngestOffset
+
+# 获取配置
+config = get_config()
+
+# 服务器日志采集：持续读取Unturned服务器（或Rocket插件）日志，
+# 解析击杀、死亡和僵尸击杀事件，按玩家汇总后批量写入PlayerStats；
+# 玩家进入服务器的日志提供游戏内名称与SteamID的对应关系，交给在线时长统计使用
+# 每轮读取的统计增量和文件读取位置在同一个事务中提交，重启后从上次的位置继续
+
+# 事件类型
+EVENT_KILL = "kill"  # 玩家击杀玩家（killer击杀+1，victim死亡+1）
+EVENT_ZOMBIE = "zombie"  # 玩家击杀僵尸（killer僵尸击杀+1）
+EVENT_DEATH = "death"  # 玩家死亡（victim死亡+1）
+EVENT_JOIN = "join"  # 玩家进入服务器（steam_id与name/character的对应关系）
+EVENTS = (EVENT_KILL, EVENT_ZOMBIE, EVENT_DEATH, EVENT_JOIN)
+
+# 默认的日志格式（按顺序匹配，每行只计一个事件），可通过LOG_INGEST_PATTERNS替换
+DEFAULT_PATTERNS = [
+    {"event": EVENT_JOIN, "pattern": r"PlayerID:\s*(?P<steam_id>7656119\d{10})\s+Name:\s*(?P<name>.+?)\s+Character:\s*(?P<character>.+?)\s*$"},
+    {"event": EVENT_KILL, "pattern": r"(?P<victim>7656119\d{10}).*?\bwas killed by\b.*?(?P<killer>7656119\d{10})"},
+    {"event": EVENT_KILL, "pattern": r"(?P<killer>7656119\d{10}).*?\bkilled\b.*?(?P<victim>7656119\d{10})"},
+    {"event": EVENT_ZOMBIE, "pattern": r"(?P<killer>7656119\d{10}).*?\bkilled\b.*?\bzombie"},
+    {"event": EVENT_DEATH, "pattern": r"(?P<victim>7656119\d{10}).*?\b(?:died|was killed|suicide)"}
+]
+
+# 只有包含SteamID的行才可能是需要的事件，扫描时先按该前缀查找，跳过其余的行
+STEAM_ID_PREFIX = b"7656119"
+
+# 未处理的内容超过该大小时使用mmap读取（避免把大段积压日志整体读入内存）
+MMAP_THRESHOLD = 1024 * 1024
+
+# 用于识别日志轮转的文件开头字节数
+FINGERPRINT_BYTES = 1024
+
+# 每次查询玩家的SteamID数量
+STEAM_ID_CHUNK = 500
+
+# 编译日志格式
+def compile_patterns(patterns=None):
+    compiled = []
+    for item in patterns or DEFAULT_PATTERNS:
+        if item["event"] not in EVENTS:
+            raise ValueError(f"未知的日志事件类型: {item['event']}")
+        compiled.append((item["event"], re.compile(item["pattern"], re.IGNORECASE)))
+    return compiled
+
+# 解析一行日志，返回 (事件类型, 正则分组)，不是事件时返回None
+def parse_line(line, patterns):
+    for event, pattern in patterns:
+        match = pattern.search(line)
+        if match:
+            return event, match.groupdict()
+    return None
+
+# 在buf[start:end]中查找包含SteamID的行（buf可以是bytes或mmap）
+def scan_lines(buf, start, end):
+    pos = start
+    while pos < end:
+        hit = buf.find(STEAM_ID_PREFIX, pos, end)
+        if hit < 0:
+            return
+        line_start = max(start, buf.rfind(b"\n", start, hit) + 1)
+        line_end = buf.find(b"\n", hit, end)
+        if line_end < 0:
+            line_end = end
+        yield buf[line_start:line_end]
+        pos = line_end + 1
+
+# 按事件累加每个玩家的统计增量：steam_id -> [击杀, 死亡, 僵尸击杀]；
+# 进入服务器事件记录到names：游戏内名称 -> steam_id
+def add_event(deltas, names, event, groups):
+    killer, victim = groups.get("killer"), groups.get("victim")
+    if event == EVENT_JOIN:
+        steam_id = groups.get("steam_id")
+        for key in ("name", "character"):
+            if steam_id and groups.get(key):
+                names[groups[key]] = steam_id
+    elif event == EVENT_KILL:
+        if killer:
+            deltas.setdefault(killer, [0, 0, 0])[0] += 1
+        if victim:
+            deltas.setdefault(victim, [0, 0, 0])[1] += 1
+    elif event == EVENT_ZOMBIE and killer:
+        deltas.setdefault(killer, [0, 0, 0])[2] += 1
+    elif event == EVENT_DEATH and victim:
+        deltas.setdefault(victim, [0, 0, 0])[1] += 1
+
+# 计算文件开头内容的摘要（格式：字节数:sha1），文件还不足FINGERPRINT_BYTES时只计算已有部分
+def file_fingerprint(file, size=None):
+    if size is None:
+        size = os.fstat(file.fileno()).st_size
+    length = min(size, FINGERPRINT_BYTES)
+    file.seek(0)
+    return f"{length}:{hashlib.sha1(file.read(length)).hexdigest()}"
+
+# 判断文件开头是否与记录的摘要一致（同一个文件只会在末尾追加内容）
+def fingerprint_matches(file, fingerprint, size):
+    try:
+        length = int(fingerprint.split(":", 1)[0])
+    except (AttributeError, ValueError):
+        return False
+    if size < length:
+        return False
+    file.seek(0)
+    return f"{length}:{hashlib.sha1(file.read(length)).hexdigest()}" == fingerprint
+
+# 累加玩家统计（统计记录不存在时批量创建）
+_increment_stats = (
+    update(PlayerStats)
+    .where(PlayerStats.id == bindparam("b_id"))
+    .values(
+        kills=func.coalesce(PlayerStats.kills, 0) + bindparam("b_kills"),
+        deaths=func.coalesce(PlayerStats.deaths, 0) + bindparam("b_deaths"),
+        zombies_killed=func.coalesce(PlayerStats.zombies_killed, 0) + bindparam("b_zombies"),
+        last_update=bindparam("b_now")
+    )
+    .execution_options(synchronize_session=False)
+)
+
+# 将统计增量批量写入数据库（不提交），返回更新后的玩家统计和未绑定的SteamID数量
+def apply_stats(db, deltas, now=None):
+    now = now or datetime.datetime.utcnow()
+    conn = db.connection()
+    updated = []
+    unmatched = 0
+    steam_ids = list(deltas)
+    
+    for i in range(0, len(steam_ids), STEAM_ID_CHUNK):
+        chunk = steam_ids[i:i + STEAM_ID_CHUNK]
+        rows = conn.execute(
+            select(QQBotPlayers.id, QQBotPlayers.qq_id, QQBotPlayers.steam_id, PlayerStats.id.label("stats_id"))
+            .outerjoin(PlayerStats, PlayerStats.player_id == QQBotPlayers.id)
+            .where(QQBotPlayers.steam_id.in_(chunk))
+        ).all()
+        unmatched += len(chunk) - len({row.steam_id for row in rows})
+        
+        # 同一玩家可能有多条统计记录（历史数据），只累加到其中一条
+        players = {}
+        for row in rows:
+            if row.id not in players or (row.stats_id is not None and players[row.id].stats_id is None):
+                players[row.id] = row
+        
+        increments = []
+        inserts = []
+        for row in players.values():
+            kills, deaths, zombies = deltas[row.steam_id]
+            if row.stats_id is None:
+                inserts.append({
+                    "player_id": row.id,
+                    "kills": kills,
+                    "deaths": deaths,
+                    "zombies_killed": zombies,
+                    "last_update": now
+                })
+            else:
+                increments.append({
+                    "b_id": row.stats_id,
+                    "b_kills": kills,
+                    "b_deaths": deaths,
+                    "b_zombies": zombies,
+                    "b_now": now
+                })
+        if increments:
+            conn.execute(_increment_stats, increments)
+        if inserts:
+            conn.execute(insert(PlayerStats), inserts)
+        
+        # 取回累加后的数值，用于更新排行榜
+        if players:
+            updated.extend(conn.execute(
+                select(QQBotPlayers.qq_id, PlayerStats.kills, PlayerStats.zombies_killed)
+                .join(PlayerStats, PlayerStats.player_id == QQBotPlayers.id)
+                .where(PlayerStats.id.in_(
+                    [row.stats_id for row in players.values() if row.stats_id is not None]
+                ) | PlayerStats.player_id.in_([item["player_id"] for item in inserts]))
+            ).all())
+    
+    return updated, unmatched
+
+# 日志采集任务
+class LogIngestor:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LogIngestor, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.path = config.LOG_INGEST_PATH
+            self.patterns = compile_patterns(config.LOG_INGEST_PATTERNS)
+            self.is_running = False
+            self.ingest_task = None
+            self._file = None
+            self._offset = 0
+            self._fingerprint = None
+            
+            # 统计信息
+            self.bytes_read = 0
+            self.events = 0
+            self.unmatched = 0
+            self.rotations = 0
+            self.last_run = None
+            self._initialized = True
+    
+    async def start(self):
+        if not self.is_running and config.LOG_INGEST_ENABLED and self.path:
+            self.is_running = True
+            self.ingest_task = asyncio.create_task(self._ingest_loop())
+            logger.info(f"服务器日志采集已启动: {self.path}")
+    
+    async def stop(self):
+        if self.is_running:
+            self.is_running = False
+            if self.ingest_task:
+                self.ingest_task.cancel()
+                try:
+                    await self.ingest_task
+                except asyncio.CancelledError:
+                    pass
+                self.ingest_task = None
+            self._close()
+            logger.info("服务器日志采集已停止")
+    
+    async def _ingest_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.is_running:
+            has_more = False
+            try:
+                updated, names, has_more = await loop.run_in_executor(None, self.poll)
+                self.last_run = datetime.datetime.utcnow()
+                self._publish(updated, names)
+            except Exception as e:
+                logger.error(f"服务器日志采集出错: {str(e)}")
+            
+            # 还有积压的日志时立即继续读取
+            if not has_more:
+                await asyncio.sleep(config.LOG_INGEST_INTERVAL)
+    
+    def _publish(self, updated, names):
+        from cache import player_cache
+        from leaderboard import leaderboard
+        from sessions import session_tracker
+        for name, steam_id in names.items():
+            session_tracker.bind_name(name, steam_id)
+        for qq_id, kills, zombies_killed in updated:
+            player_cache.invalidate(qq_id=qq_id)
+            leaderboard.update(qq_id, kills=kills, zombies_killed=zombies_killed)
+    
+    def poll(self):
+        """读取一轮新增日志并写入数据库（同步，在线程池中运行），返回 (更新后的玩家统计, 名称对应关系, 是否还有积压)"""
+        db = SessionLocal()
+        try:
+            if self._file is None and not self._open(db):
+                return [], {}, False
+            
+            # 日志轮转：路径已指向新文件时，先读完旧文件剩余的内容再切换
+            rotated = self._is_rotated()
+            size = os.fstat(self._file.fileno()).st_size
+            if size < self._offset:
+                # 文件被原地截断，从头开始读取
+                logger.info(f"日志文件被截断，从头开始读取: {self.path}")
+                self._offset = 0
+                self.rotations += 1
+                # 开头内容已改变，需要重新计算摘要，否则重启后无法匹配记录的位置而重复读取
+                self._fingerprint = file_fingerprint(self._file, size)
+            elif self._fingerprint is None or not self._fingerprint.startswith(f"{FINGERPRINT_BYTES}:"):
+                self._fingerprint = file_fingerprint(self._file, size)
+            
+            end = min(size, self._offset + config.LOG_INGEST_MAX_BYTES)
+            deltas = {}
+            names = {}
+            new_offset, events = self._read_events(self._offset, end, deltas, names, final=rotated and end == size)
+            
+            updated, unmatched = apply_stats(db, deltas) if deltas else ([], 0)
+            if new_offset != self._offset or updated:
+                self._save_offset(db, new_offset)
+            db.commit()
+            
+            self.bytes_read += new_offset - self._offset
+            self.events += events
+            self.unmatched += unmatched
+            self._offset = new_offset
+            
+            if rotated and new_offset == size:
+                logger.info(f"检测到日志轮转，切换到新文件: {self.path}")
+                self.rotations += 1
+                self._close()
+                self._open(db, resume=False)
+                return updated, names, True
+            return updated, names, end < size
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    def _open(self, db, resume=True):
+        try:
+            self._file = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        
+        size = os.fstat(self._file.fileno()).st_size
+        self._offset = 0
+        self._fingerprint = file_fingerprint(self._file, size)
+        if resume:
+            # 从上次记录的位置继续（文件开头内容不同说明已经轮转，从头读取）
+            record = db.execute(
+                select(LogIngestOffset).where(LogIngestOffset.path == self.path)
+            ).scalars().first()
+            if record and record.offset <= size and fingerprint_matches(self._file, record.fingerprint, size):
+                self._offset = record.offset
+        return True
+    
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def _is_rotated(self):
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            # 旧文件已被移走、新文件还未创建
+            return True
+        opened = os.fstat(self._file.fileno())
+        return (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino)
+    
+    def _read_events(self, start, end, deltas, names, final=False):
+        """解析[start, end)中的完整行，返回 (处理到的位置, 事件数)；不完整的最后一行留到下次读取"""
+        if end <= start:
+            return start, 0
+        
+        if end - start >= MMAP_THRESHOLD:
+            with mmap.mmap(self._file.fileno(), end, access=mmap.ACCESS_READ) as buf:
+                return self._scan(buf, start, end, deltas, names, final)
+        
+        self._file.seek(start)
+        buf = self._file.read(end - start)
+        scanned, events = self._scan(buf, 0, len(buf), deltas, names, final)
+        return start + scanned, events
+    
+    def _scan(self, buf, start, end, deltas, names, final):
+        if not final:
+            end = buf.rfind(b"\n", start, end) + 1
+            if end <= start:
+                return start, 0
+        events = 0
+        for line in scan_lines(buf, start, end):
+            parsed = parse_line(line.decode("utf-8", errors="replace"), self.patterns)
+            if parsed:
+                add_event(deltas, names, *parsed)
+                events += 1
+        return end, events
+    
+    def _save_offset(self, db, offset):
+        record = db.execute(
+            select(LogIngestOffset).where(LogIngestOffset.path == self.path)
+        ).scalars().first()
+        if record is None:
+            record = LogIngestOffset(path=self.path)
+            db.add(record)
+        record.fingerprint = self._fingerprint
+        record.offset = offset
+        record.updated_at = datetime.datetime.utcnow()
+    
+    def get_stats(self):
+        return {
+            "enabled": self.is_running,
+            "path": self.path,
+            "offset": self._offset,
+            "bytes_read": self.bytes_read,
+            "events": self.events,
+            "unmatched_players": self.unmatched,
+            "rotations": self.rotations,
+            "last_run": str(self.last_run) if self.last_run else None
+        }
+
+# 创建全局日志采集实例
+log_ingestor = LogIngestor()
+
+# 注册驱动事件
+driver = get_driver()
+
+@driver.on_startup
+async def on_startup():
+    with startup_timer.phase("log_ingest"):
+        await log_ingestor.start()
+
+@driver.on_shutdown
+async def on_shutdown():
+    await log_ingestor.stop()
@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import math
+import threading
+from settings import get_config
+
+# 运行指标（Prometheus文本格式，通过API的 /metrics 接口导出）
+# 计数器和直方图按线程分片：每个线程只写自己的分片（普通字典），导出时汇总所有分片，
+# 记录路径不加锁，一次记录只有一次字典查找和几次整数加法（微秒级）；
+# 只在线程第一次写入某个指标时加锁登记分片
+
+# 获取配置
+config = get_config()
+
+# 指标名称前缀
+METRIC_PREFIX = "unturned_bot_"
+
+# 默认的耗时直方图分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus文本格式的Content-Type（charset由响应自动追加）
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# 已注册的指标（按注册顺序导出）
+_registry = []
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+# 指标基类
+class Metric:
+    type = "untyped"
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        _registry.append(self)
+    
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+    
+    def _snapshots(self):
+        # 在CPython中复制字典的键值对是原子操作，无需与写入线程同步
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [list(shard.items()) for shard in shards]
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._render_samples())
+        return lines
+    
+    def _render_samples(self):
+        return []
+
+# 计数器（只增不减）
+class Counter(Metric):
+    type = "counter"
+    
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+    
+    def collect(self):
+        totals = {}
+        for items in self._snapshots():
+            for labels, value in items:
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+    
+    def _render_samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.collect().items())
+        ]
+
+# 直方图（耗时分布）；每个标签组合的状态为 [各分桶计数..., +Inf分桶计数, 总和]
+class Histogram(Metric):
+    type = "histogram"
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value, *labels):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+    
+    def collect(self):
+        totals = {}
+        for items in self._snapshots():
+            for labels, state in items:
+                state = list(state)
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = state
+                else:
+                    totals[labels] = [a + b for a, b in zip(total, state)]
+        return totals
+    
+    def _render_samples(self):
+        lines = []
+        bounds = self.buckets + (math.inf,)
+        for labels, state in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+# 仪表（当前值）：直接设置，或在导出时调用function获取 {标签值元组: 数值}
+class Gauge(Metric):
+    type = "gauge"
+    
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self._values = {}
+    
+    def set(self, value, *labels):
+        self._values[labels] = value
+    
+    def collect(self):
+        if self.function is not None:
+            return self.function()
+        return dict(self._values)
+    
+    def _render_samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.collect().items())
+        ]
+
+# 导出所有指标（单个指标出错时跳过，不影响其他指标）
+def render_metrics():
+    lines = []
+    for metric in list(_registry):
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            from utils import logger
+            logger.error(f"导出指标 {metric.name} 失败: {str(e)}")
+    return "\n".join(lines) + "\n"
+
+# 命令
+COMMANDS = Counter("commands_total", "已处理的命令数", ("command", "result"))
+COMMAND_DURATION = Histogram("command_duration_seconds", "命令处理耗时", ("command",))
+
+# 数据库
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "SQL执行耗时", ("driver", "operation"))
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "执行失败的SQL数", ("driver", "operation"))
+
+# OneBot消息发送
+ONEBOT_SEND_DURATION = Histogram("onebot_send_duration_seconds", "OneBot发送消息耗时（含重试）", ("action",))
+ONEBOT_SEND_FAILURES = Counter("onebot_send_failures_total", "OneBot发送消息失败数", ("action",))
+
+# 出站消息队列
+def _outbox_depth():
+    from outbox import outbox
+    return {(name,): depth for name, depth in outbox.get_stats()["depth_by_priority"].items()}
+
+OUTBOX_DEPTH = Gauge("outbox_depth", "出站消息队列中待发送的消息数", ("priority",), function=_outbox_depth)
+OUTBOX_SEND_LATENCY = Histogram(
+    "outbox_send_latency_seconds", "出站消息从入队到发出的耗时（含合并等待、限速和重试）", ("priority",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+)
+
+# 服务器监控
+MONITOR_POLL_DURATION = Histogram("monitor_poll_duration_seconds", "服务器状态检查耗时", ("server",))
+MONITOR_POLLS = Counter("monitor_polls_total", "服务器状态检查次数（result：online/offline/error）", ("server", "result"))
+
+# 数据保留
+RETENTION_ROWS = Counter("retention_rows_total", "数据保留任务处理的过期行数（action：archived/deleted）", ("table", "action"))
+
+# 事件循环延迟
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "事件循环定时唤醒的延迟",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+LOOP_LAG_LAST = Gauge("event_loop_lag_last_seconds", "最近一次测得的事件循环延迟")
+
+# 事件循环延迟监测：定时休眠，实际唤醒时间与预期的差值即为延迟
+class LoopLagMonitor:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LoopLagMonitor, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.is_running = False
+            self.task = None
+            self._initialized = True
+    
+    async def start(self):
+        if not self.is_running and config.METRICS_ENABLED:
+            self.is_running = True
+            self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self.is_running:
+            self.is_running = False
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        interval = max(0.01, config.METRICS_LOOP_LAG_INTERVAL)
+        while self.is_running:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+
+# 创建全局事件循环延迟监测实例
+loop_lag_monitor = LoopLagMonitor()
@@ -0,0 +1,308 @@
+import argparse
+import datetime
+import sys
+import time
+from sqlalchemy import column, delete, func, inspect, insert, select, table, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from database import engine
+from models import CommandLogs, PlayerStats, SchemaMigration, ServerStatus
+from utils import logger
+
+# 数据库迁移：按版本号顺序执行，已执行的版本记录在schema_migrations表中，每个版本只执行一次
+# 新建的数据库由create_all直接按模型建表和索引，迁移只需补齐旧数据库缺少的部分，因此迁移必须可重复执行
+# 标记为online的迁移在自动提交模式下执行：PostgreSQL使用CREATE INDEX CONCURRENTLY，
+# MySQL使用ALGORITHM=INPLACE, LOCK=NONE，建索引期间不阻塞表的读写；SQLite直接建索引
+# 迁移由init_db在模型结构变化后自动执行，也可以手动执行：
+#
+# python migrations.py                 应用尚未执行的迁移
+# python migrations.py --status        查看迁移状态
+# python migrations.py --check-plans   检查热点查询的执行计划是否使用了索引（未使用时以非零状态退出）
+
+# 迁移定义
+class Migration:
+    __slots__ = ("version", "description", "upgrade", "online")
+    
+    def __init__(self, version, description, upgrade, online=False):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.online = online
+
+# 所有迁移（按版本号排序）
+MIGRATIONS = []
+
+# 注册迁移，upgrade(conn)接收数据库连接
+def migration(version, description, online=False):
+    def decorator(func):
+        if any(item.version == version for item in MIGRATIONS):
+            raise ValueError(f"迁移版本重复: {version}")
+        MIGRATIONS.append(Migration(version, description, func, online))
+        MIGRATIONS.sort(key=lambda item: item.version)
+        return func
+    return decorator
+
+def _is_autocommit(conn):
+    return conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+
+# PostgreSQL在线建索引中断后会留下无效索引，需要删除后重建
+def _drop_invalid_index(conn, name):
+    invalid = conn.execute(
+        text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": name}
+    ).first()
+    if invalid:
+        concurrently = "CONCURRENTLY " if _is_autocommit(conn) else ""
+        conn.exec_driver_sql(f"DROP INDEX {concurrently}{conn.dialect.identifier_preparer.quote(name)}")
+
+# 创建索引（已存在时跳过），返回是否新建了索引；在自动提交模式下在线创建
+def create_index(conn, table_name, name, columns, unique=False):
+    dialect_name = conn.dialect.name
+    online = _is_autocommit(conn)
+    if dialect_name == "postgresql":
+        _drop_invalid_index(conn, name)
+    if name in {index["name"] for index in inspect(conn).get_indexes(table_name)}:
+        return False
+    
+    quote = conn.dialect.identifier_preparer.quote
+    ddl = (
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX "
+        f"{'CONCURRENTLY ' if online and dialect_name == 'postgresql' else ''}"
+        f"{quote(name)} ON {quote(table_name)} ({', '.join(quote(name) for name in columns)})"
+    )
+    if online and dialect_name == "mysql":
+        ddl += " ALGORITHM=INPLACE LOCK=NONE"
+    
+    started = time.perf_counter()
+    conn.exec_driver_sql(ddl)
+    logger.info(f"已创建索引 {name}（{(time.perf_counter() - started) * 1000:.0f}ms）")
+    return True
+
+# 删除key列重复的行，每个key保留按keep_order（降序，空值视为0）排在最前的一行，返回删除的行数
+def delete_duplicates(conn, table_name, key, keep_order=()):
+    target = table(table_name, column("id"), column(key), *[column(name) for name in keep_order])
+    key_column = target.c[key]
+    duplicated = conn.execute(
+        select(key_column).where(key_column.is_not(None)).group_by(key_column).having(func.count() > 1)
+    ).scalars().all()
+    
+    removed = 0
+    for value in duplicated:
+        ids = conn.execute(
+            select(target.c.id)
+            .where(key_column == value)
+            .order_by(*[func.coalesce(target.c[name], 0).desc() for name in keep_order], target.c.id)
+        ).scalars().all()
+        conn.execute(delete(target).where(target.c.id.in_(ids[1:])))
+        removed += len(ids) - 1
+    if removed:
+        logger.warning(f"{table_name} 表中有 {len(duplicated)} 个 {key} 存在重复记录，已删除 {removed} 条")
+    return removed
+
+# 迁移列表（只追加，不修改已发布的迁移）
+@migration(1, "server_status 表增加 server_key 列")
+def _add_server_status_server_key(conn):
+    columns = [item["name"] for item in inspect(conn).get_columns("server_status")]
+    if "server_key" not in columns:
+        conn.exec_driver_sql("ALTER TABLE server_status ADD COLUMN server_key VARCHAR(50) DEFAULT 'default'")
+        create_index(conn, "server_status", "ix_server_status_server_key", ["server_key"])
+
+@migration(2, "player_stats 和 daily_signin 的 player_id 唯一索引", online=True)
+def _unique_player_id(conn):
+    # 两张表与玩家一一对应，建唯一索引前先清理重复记录（保留数据最多的一条）
+    delete_duplicates(conn, "player_stats", "player_id", ("play_time",))
+    create_index(conn, "player_stats", "uq_player_stats_player_id", ["player_id"], unique=True)
+    delete_duplicates(conn, "daily_signin", "player_id", ("total_days",))
+    create_index(conn, "daily_signin", "uq_daily_signin_player_id", ["player_id"], unique=True)
+
+@migration(3, "server_status (server_key, timestamp) 复合索引", online=True)
+def _server_status_timestamp(conn):
+    create_index(conn, "server_status", "ix_server_status_server_key_timestamp", ["server_key", "timestamp"])
+
+@migration(4, "command_logs 时间、用户和群索引", online=True)
+def _command_logs_indexes(conn):
+    create_index(conn, "command_logs", "ix_command_logs_timestamp", ["timestamp"])
+    create_index(conn, "command_logs", "ix_command_logs_user_id_timestamp", ["user_id", "timestamp"])
+    create_index(conn, "command_logs", "ix_command_logs_group_id_timestamp", ["group_id", "timestamp"])
+
+def _applied_versions(conn):
+    return set(conn.execute(select(SchemaMigration.version)).scalars())
+
+# 应用尚未执行的迁移，返回本次应用的版本号列表；迁移失败时抛出异常，之后的迁移不再执行
+def run_migrations(bind=None):
+    bind = bind or engine
+    SchemaMigration.__table__.create(bind, checkfirst=True)
+    with bind.connect() as conn:
+        applied = _applied_versions(conn)
+    
+    versions = []
+    for item in MIGRATIONS:
+        if item.version in applied:
+            continue
+        started = time.perf_counter()
+        with bind.connect() as conn:
+            if item.online:
+                conn.execution_options(isolation_level="AUTOCOMMIT")
+            item.upgrade(conn)
+            conn.execute(insert(SchemaMigration).values(
+                version=item.version,
+                description=item.description,
+                applied_at=datetime.datetime.utcnow()
+            ))
+            conn.commit()
+        logger.info(f"已应用数据库迁移 {item.version}: {item.description}（{(time.perf_counter() - started) * 1000:.0f}ms）")
+        versions.append(item.version)
+    return versions
+
+# 迁移状态（未执行的迁移applied_at为None）
+def get_migration_status(bind=None):
+    bind = bind or engine
+    with bind.connect() as conn:
+        if not inspect(conn).has_table(SchemaMigration.__tablename__):
+            applied = {}
+        else:
+            applied = dict(conn.execute(select(SchemaMigration.version, SchemaMigration.applied_at)).all())
+    return [
+        {"version": item.version, "description": item.description, "applied_at": applied.get(item.version)}
+        for item in MIGRATIONS
+    ]
+
+# EXPLAIN语句（参数按原语句的类型处理）
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+    
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    prefix = "EXPLAIN QUERY PLAN" if compiler.dialect.name == "sqlite" else "EXPLAIN"
+    return f"{prefix} {compiler.process(element.statement, **kw)}"
+
+# 获取查询的执行计划（文本，每行一个步骤）
+def explain(conn, statement, params=None):
+    dialect_name = conn.dialect.name
+    if dialect_name == "postgresql":
+        # 表中数据很少时PostgreSQL总是选择顺序扫描，这里检查的是索引能否用于该查询
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    rows = conn.execute(Explain(statement), params or {}).all()
+    if dialect_name == "sqlite":
+        return "\n".join(row[-1] for row in rows)
+    if dialect_name == "mysql":
+        return "\n".join(f"{row._mapping['table']} key={row._mapping['key']}" for row in rows)
+    return "\n".join(str(row[0]) for row in rows)
+
+# 热点查询：(名称, 语句, 参数, 应使用的索引)
+def hot_queries():
+    from repository import _profile_by_qq_id, _signin_counts
+    now = datetime.datetime.utcnow()
+    return [
+        (
+            "玩家资料（/me、/sign）",
+            _profile_by_qq_id,
+            {"qq_id": "10001"},
+            ("ix_qq_bot_players_qq_id", "uq_player_stats_player_id", "uq_daily_signin_player_id")
+        ),
+        (
+            "签到天数（/sign）",
+            _signin_counts,
+            {"player_qq_id": "10001"},
+            ("ix_qq_bot_players_qq_id", "uq_daily_signin_player_id")
+        ),
+        (
+            "玩家统计（日志采集、在线时长）",
+            select(PlayerStats.id).where(PlayerStats.player_id == 1),
+            None,
+            ("uq_player_stats_player_id",)
+        ),
+        (
+            "服务器状态区间（历史汇总）",
+            select(ServerStatus)
+            .where(
+                ServerStatus.server_key == "default",
+                ServerStatus.timestamp >= now - datetime.timedelta(hours=1),
+                ServerStatus.timestamp < now
+            )
+            .order_by(ServerStatus.timestamp),
+            None,
+            ("ix_server_status_server_key_timestamp",)
+        ),
+        (
+            "用户最近的命令",
+            select(CommandLogs).where(CommandLogs.user_id == "10001").order_by(CommandLogs.timestamp.desc()).limit(50),
+            None,
+            ("ix_command_logs_user_id_timestamp",)
+        ),
+        (
+            "群最近的命令",
+            select(CommandLogs).where(CommandLogs.group_id == "123456789").order_by(CommandLogs.timestamp.desc()).limit(50),
+            None,
+            ("ix_command_logs_group_id_timestamp",)
+        ),
+        (
+            "过期的命令日志",
+            select(CommandLogs.id).where(CommandLogs.timestamp < now - datetime.timedelta(days=30)),
+            None,
+            ("ix_command_logs_timestamp",)
+        )
+    ]
+
+# 检查热点查询的执行计划，返回每个查询的结果（missing为未使用的索引）
+def check_query_plans(bind=None):
+    bind = bind or engine
+    results = []
+    with bind.connect() as conn:
+        for name, statement, params, indexes in hot_queries():
+            plan = explain(conn, statement, params)
+            conn.rollback()
+            results.append({
+                "name": name,
+                "indexes": list(indexes),
+                "missing": [index for index in indexes if index not in plan],
+                "plan": plan
+            })
+    return results
+
+# 断言所有热点查询都使用了应使用的索引
+def assert_query_plans(bind=None):
+    failures = [result for result in check_query_plans(bind) if result["missing"]]
+    if failures:
+        details = "\n".join(
+            f"{result['name']}: 未使用索引 {', '.join(result['missing'])}\n{result['plan']}"
+            for result in failures
+        )
+        raise AssertionError(f"{len(failures)} 个热点查询没有使用索引:\n{details}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Unturned服务器助手数据库迁移")
+    parser.add_argument("--status", action="store_true", help="查看迁移状态")
+    parser.add_argument("--check-plans", action="store_true", help="检查热点查询的执行计划是否使用了索引")
+    args = parser.parse_args(argv)
+    
+    if args.status:
+        for item in get_migration_status():
+            applied_at = item["applied_at"].isoformat(sep=" ", timespec="seconds") if item["applied_at"] else "未执行"
+            print(f"{item['version']:>4}  {applied_at:<19}  {item['description']}")
+        return 0
+    
+    if args.check_plans:
+        results = check_query_plans()
+        for result in results:
+            print(f"[{'FAIL' if result['missing'] else 'OK'}] {result['name']}")
+            if result["missing"]:
+                print(f"  未使用索引: {', '.join(result['missing'])}")
+                print("  " + result["plan"].replace("\n", "\n  "))
+        return 1 if any(result["missing"] for result in results) else 0
+    
+    # 与启动时相同：建表、执行迁移并记录结构版本
+    from database import init_db
+    init_db()
+    applied = [item for item in get_migration_status() if item["applied_at"]]
+    print(f"数据库迁移完成，已执行 {len(applied)}/{len(MIGRATIONS)} 个迁移")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
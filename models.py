@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 import datetime
 from database import Base
@@ -24,6 +24,9 @@ class QQBotPlayers(Base):
 # 玩家游戏统计数据
 class PlayerStats(Base):
     __tablename__ = "player_stats"
+    __table_args__ = (
+        Index("uq_player_stats_player_id", "player_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     player_id = Column(Integer, ForeignKey("qq_bot_players.id"))
@@ -48,8 +51,12 @@ class Uconomy(Base):
 # 服务器状态历史
 class ServerStatus(Base):
     __tablename__ = "server_status"
+    __table_args__ = (
+        Index("ix_server_status_server_key_timestamp", "server_key", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
+    server_key = Column(String(50), index=True, default="default")
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     is_online = Column(Boolean, default=False)
     players = Column(Integer, default=0)
@@ -57,9 +64,32 @@ class ServerStatus(Base):
     map = Column(String(100))
     message = Column(String(255))
 
+# 服务器状态聚合（按分钟/小时/天汇总的历史数据）
+class ServerStatusRollup(Base):
+    __tablename__ = "server_status_rollup"
+    __table_args__ = (
+        UniqueConstraint("server_key", "resolution", "bucket_start", name="uq_server_status_rollup_bucket"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    server_key = Column(String(50), default="default")
+    resolution = Column(String(4))  # 1m / 1h / 1d
+    bucket_start = Column(DateTime)
+    covered_seconds = Column(Float, default=0)  # 有监控数据覆盖的时长
+    online_seconds = Column(Float, default=0)
+    player_seconds = Column(Float, default=0)  # 玩家数对时间的积分
+    min_players = Column(Integer, default=0)
+    peak_players = Column(Integer, default=0)
+    avg_players = Column(Float, default=0)
+    uptime_ratio = Column(Float, default=0)
+    capacity = Column(Integer, default=0)  # 服务器最大玩家数
+
 # 玩家签到记录
 class DailySignIn(Base):
     __tablename__ = "daily_signin"
+    __table_args__ = (
+        Index("uq_daily_signin_player_id", "player_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     player_id = Column(Integer, ForeignKey("qq_bot_players.id"))
@@ -84,6 +114,11 @@ class GroupManagement(Base):
 # 命令执行日志
 class CommandLogs(Base):
     __tablename__ = "command_logs"
+    __table_args__ = (
+        Index("ix_command_logs_timestamp", "timestamp"),
+        Index("ix_command_logs_user_id_timestamp", "user_id", "timestamp"),
+        Index("ix_command_logs_group_id_timestamp", "group_id", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
@@ -103,4 +138,45 @@ class Announcements(Base):
     content = Column(String(500))
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     created_by = Column(String(20))
-    is_active = Column(Boolean, default=True)
\ No newline at end of file
+    is_active = Column(Boolean, default=True)
+
+# 日志采集进度（每个日志文件已处理到的位置，重启后从该位置继续）
+class LogIngestOffset(Base):
+    __tablename__ = "log_ingest_offsets"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    path = Column(String(255), unique=True, index=True)
+    fingerprint = Column(String(64))  # 文件开头内容的摘要，用于识别日志轮转
+    offset = Column(BigInteger, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# 玩家在线会话（由服务器在线玩家列表的变化生成）
+class PlayerSession(Base):
+    __tablename__ = "player_sessions"
+    __table_args__ = (
+        Index("ix_player_sessions_steam_id_started_at", "steam_id", "started_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    server_key = Column(String(50), default="default")
+    player_name = Column(String(100))  # 游戏内名称
+    steam_id = Column(String(50), nullable=True)  # 无法对应到SteamID时为空
+    started_at = Column(DateTime, index=True)
+    ended_at = Column(DateTime, nullable=True)  # 会话进行中时为空
+    credited_seconds = Column(Float, default=0)  # 已计入游戏时长的秒数
+
+# 数据库结构版本（与当前模型定义一致时启动时跳过建表检查）
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(String(64))
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# 已应用的数据库迁移
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    
+    version = Column(Integer, primary_key=True)
+    description = Column(String(255))
+    applied_at = Column(DateTime, default=datetime.datetime.utcnow)
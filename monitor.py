@@ -1,15 +1,90 @@
 import asyncio
+import functools
+import random
 import time
 from nonebot import get_driver
 from settings import get_config
-from utils import logger, send_onebot_message
-from database import get_db
+from utils import logger, startup_timer
+from outbox import outbox, PRIORITY_ALERT
+from cache import response_cache
+from database import AsyncSessionLocal
 from models import ServerStatus
+from a2s import query_server, A2SError
+from history import should_persist_status
+from sessions import session_tracker
+from metrics import MONITOR_POLL_DURATION, MONITOR_POLLS
 import datetime
 
 # 获取配置
 config = get_config()
 
+# 默认服务器标识（未配置MONITOR_SERVERS时使用）
+DEFAULT_SERVER_KEY = "default"
+
+# API状态响应中会变化的字段，只有这些字段变化时才让缓存的响应失效
+CACHED_STATUS_FIELDS = ("is_online", "players", "map")
+
+# 被监控的服务器
+class MonitoredServer:
+    def __init__(self, key, name, ip, port, query_port, interval=None, jitter=None):
+        self.key = key
+        self.name = name or key
+        self.ip = ip
+        self.port = port
+        self.query_port = query_port
+        self.interval = config.MONITOR_INTERVAL if interval is None else interval
+        self.jitter = config.MONITOR_JITTER if jitter is None else jitter
+    
+    @property
+    def address(self):
+        return f"{self.ip}:{self.port}"
+    
+    def next_delay(self):
+        # 检查间隔加上随机抖动，避免所有服务器在同一时刻查询
+        return max(1.0, self.interval + random.uniform(-self.jitter, self.jitter))
+
+# 从配置加载服务器列表
+def load_monitored_servers():
+    servers = {}
+    for item in config.MONITOR_SERVERS:
+        try:
+            port = int(item.get("port", config.SERVER_PORT))
+            interval = item.get("interval")
+            interval = float(config.MONITOR_INTERVAL if interval is None else interval)
+            if interval <= 0:
+                raise ValueError("interval 必须大于0")
+            jitter = item.get("jitter")
+            jitter = float(config.MONITOR_JITTER if jitter is None else jitter)
+            if jitter < 0:
+                raise ValueError("jitter 不能小于0")
+            server = MonitoredServer(
+                key=str(item["key"]),
+                name=item.get("name"),
+                ip=item.get("ip", config.SERVER_IP),
+                port=port,
+                query_port=int(item.get("query_port", port + 1)),
+                interval=interval,
+                jitter=jitter
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"服务器监控配置无效: {item} ({str(e)})")
+            continue
+        
+        if server.key in servers:
+            logger.error(f"服务器标识重复，已忽略: {server.key}")
+            continue
+        servers[server.key] = server
+    
+    if not servers:
+        servers[DEFAULT_SERVER_KEY] = MonitoredServer(
+            key=DEFAULT_SERVER_KEY,
+            name="Unturned服务器",
+            ip=config.SERVER_IP,
+            port=config.SERVER_PORT,
+            query_port=config.SERVER_QUERY_PORT
+        )
+    return servers
+
 # 监控状态
 class ServerMonitor:
     _instance = None
@@ -23,56 +98,101 @@ class ServerMonitor:
     def __init__(self):
         if not self._initialized:
             self.is_running = False
-            self.last_status = None
-            self.monitor_task = None
+            self.servers = load_monitored_servers()
+            self.statuses = {}
+            self.monitor_tasks = {}
+            self.last_saved = {}
+            self._query_semaphore = None
             self._initialized = True
     
+    @property
+    def default_server(self):
+        return next(iter(self.servers.values()))
+    
+    @property
+    def last_status(self):
+        # 兼容单服务器用法：返回第一个服务器的最新状态
+        return self.statuses.get(self.default_server.key)
+    
     async def start(self):
         if not self.is_running and config.MONITOR_ENABLED:
             self.is_running = True
-            self.monitor_task = asyncio.create_task(self._monitor_loop())
-            logger.info("服务器监控已启动")
+            self._query_semaphore = asyncio.Semaphore(max(1, config.MONITOR_MAX_CONCURRENT_QUERIES))
+            for server in self.servers.values():
+                self.monitor_tasks[server.key] = asyncio.create_task(self._monitor_loop(server))
+            logger.info(f"服务器监控已启动，共 {len(self.servers)} 台服务器")
     
     async def stop(self):
         if self.is_running:
             self.is_running = False
-            if self.monitor_task:
-                self.monitor_task.cancel()
-                try:
-                    await self.monitor_task
-                except asyncio.CancelledError:
-                    pass
-                self.monitor_task = None
+            tasks = list(self.monitor_tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.monitor_tasks.clear()
             logger.info("服务器监控已停止")
     
-    async def _monitor_loop(self):
+    async def _monitor_loop(self, server):
+        # 首次检查随机错开，避免启动时所有服务器同时查询
+        await asyncio.sleep(random.uniform(0, min(server.jitter, server.interval)))
         while self.is_running:
+            started = time.perf_counter()
             try:
-                await self._check_server_status()
+                status = await self._check_server_status(server)
+                result = "online" if status["is_online"] else "offline"
             except Exception as e:
-                logger.error(f"服务器监控出错: {str(e)}")
+                result = "error"
+                logger.error(f"服务器监控出错 [{server.key}]: {str(e)}")
+            MONITOR_POLL_DURATION.observe(time.perf_counter() - started, server.key)
+            MONITOR_POLLS.inc(server.key, result)
             
             # 等待下一次检查
-            await asyncio.sleep(config.MONITOR_INTERVAL)
+            await asyncio.sleep(server.next_delay())
     
-    async def _check_server_status(self):
-        # 获取服务器状态
-        status = await self._query_server_status()
+    async def _check_server_status(self, server=None):
+        server = server or self.default_server
+        
+        # 获取服务器状态（限制同时进行的查询数量）
+        if self._query_semaphore is not None:
+            async with self._query_semaphore:
+                status = await self._query_server_status(server)
+        else:
+            status = await self._query_server_status(server)
         
         # 保存状态到数据库
-        self._save_status_to_db(status)
+        await self._save_status_to_db(server, status)
         
         # 检查状态变化并发送通知
-        if self.last_status is not None and config.NOTIFY_STATUS_CHANGE:
-            if self.last_status["is_online"] != status["is_online"]:
-                await self._send_status_change_notification(status)
+        last_status = self.statuses.get(server.key)
+        if last_status is not None and config.NOTIFY_STATUS_CHANGE:
+            if last_status["is_online"] != status["is_online"]:
+                await self._send_status_change_notification(server, status)
+        
+        # 更新上次状态；状态有变化时让API缓存的状态响应失效（未变化时缓存按TTL过期）
+        self.statuses[server.key] = status.copy()
+        if last_status is None or any(last_status[field] != status[field] for field in CACHED_STATUS_FIELDS):
+            response_cache.invalidate()
         
-        # 更新上次状态
-        self.last_status = status.copy()
+        # 根据在线玩家列表的变化更新玩家会话
+        await self._track_sessions(server, status)
+        return status
     
-    async def _query_server_status(self):
+    async def _track_sessions(self, server, status):
+        try:
+            if not status["is_online"]:
+                await session_tracker.close_server(server.key)
+            elif status["players_list"] or status["players"] == 0:
+                # 有玩家但玩家列表查询失败时，不作为所有玩家离开处理
+                await session_tracker.observe(server.key, status["players_list"])
+        except Exception as e:
+            logger.error(f"更新玩家会话失败 [{server.key}]: {str(e)}")
+    
+    async def _query_server_status(self, server):
         # 默认状态（离线）
         status = {
+            "server_key": server.key,
+            "name": server.name,
+            "address": server.address,
             "is_online": False,
             "players": 0,
             "max_players": config.DEFAULT_MAX_PLAYERS,
@@ -82,68 +202,100 @@ class ServerMonitor:
         }
         
         try:
-            # 这里应该是实际的服务器查询逻辑
-            # 由于没有具体的Unturned服务器查询库，这里使用模拟数据
-            # 在实际使用中，应该使用类似python-valve或其他游戏服务器查询库
-            
-            # 模拟服务器在线（80%概率）
-            import random
-            if random.random() < 0.8:
-                status["is_online"] = True
-                status["players"] = random.randint(0, status["max_players"])
-                status["message"] = "服务器运行正常"
-                
-                # 生成模拟玩家列表
-                if status["players"] > 0:
-                    status["players_list"] = [f"Player{i}" for i in range(1, status["players"] + 1)]
+            # 通过A2S协议查询服务器信息和在线玩家，整体耗时受SERVER_TIMEOUT限制
+            info, players = await query_server(
+                server.ip,
+                server.query_port,
+                timeout=config.SERVER_TIMEOUT
+            )
+            status["is_online"] = True
+            status["players"] = info["players"]
+            status["max_players"] = info["max_players"] or config.DEFAULT_MAX_PLAYERS
+            status["map"] = info["map"] or config.DEFAULT_MAP_NAME
+            status["players_list"] = [player["name"] for player in players if player["name"]]
+            status["message"] = "服务器运行正常"
             
-            logger.debug(f"查询服务器状态: {status}")
+            logger.debug(f"查询服务器状态 [{server.key}]: {status}")
+        except asyncio.TimeoutError:
+            status["message"] = "服务器查询超时"
+            logger.warning(f"服务器查询超时 [{server.key}]: {server.ip}:{server.query_port}")
+        except (A2SError, OSError) as e:
+            status["message"] = f"服务器查询失败: {str(e)}"[:255]
+            logger.warning(f"服务器查询失败 [{server.key}]: {str(e)}")
         except Exception as e:
-            logger.error(f"服务器查询出错: {str(e)}")
+            logger.error(f"服务器查询出错 [{server.key}]: {str(e)}")
         
         return status
     
-    def _save_status_to_db(self, status):
+    async def _save_status_to_db(self, server, status):
+        # 变化写入模式下只在状态明显变化或到达心跳间隔时写入
+        now = datetime.datetime.utcnow()
+        last_status, last_saved_at = self.last_saved.get(server.key, (None, None))
+        if not should_persist_status(status, last_status, last_saved_at, now):
+            return
+        
         try:
-            db = next(get_db())
-            status_record = ServerStatus(
-                is_online=status["is_online"],
-                players=status["players"],
-                max_players=status["max_players"],
-                map=status["map"],
-                message=status["message"]
-            )
-            db.add(status_record)
-            db.commit()
+            async with AsyncSessionLocal() as db:
+                status_record = ServerStatus(
+                    server_key=server.key,
+                    timestamp=now,
+                    is_online=status["is_online"],
+                    players=status["players"],
+                    max_players=status["max_players"],
+                    map=status["map"],
+                    message=status["message"]
+                )
+                db.add(status_record)
+                await db.commit()
+            self.last_saved[server.key] = (status.copy(), now)
         except Exception as e:
             logger.error(f"保存服务器状态到数据库失败: {str(e)}")
-        finally:
-            db.close()
-    
-    async def _send_status_change_notification(self, status):
-        # 构建通知消息
-        if status["is_online"]:
-            message = [
-                "🟢 服务器已上线！",
-                f"服务器地址: {config.SERVER_IP}:{config.SERVER_PORT}",
-                f"当前状态: 运行正常",
-                f"可容纳玩家: {status['max_players']}人"
-            ]
-        else:
-            message = [
-                "🔴 服务器已离线！",
-                f"服务器地址: {config.SERVER_IP}:{config.SERVER_PORT}",
-                f"离线原因: {status['message']}"
-            ]
-        
-        # 发送通知到所有监控群
+    
+    async def _send_status_change_notification(self, server, status):
+        # 投递到出站消息队列（告警优先级）；同一服务器的状态变化在合并窗口内只发出第一条，
+        # 之后的变化在窗口结束时合并为一条摘要（窗口不短于检查间隔，才能覆盖连续几次检查的反复上下线）
+        event = {
+            "is_online": status["is_online"],
+            "max_players": status["max_players"],
+            "message": status["message"]
+        }
         for group_id in config.MONITOR_GROUPS:
-            await send_onebot_message(
-                "group",
-                group_id=group_id,
-                message="\n".join(message)
+            outbox.post(
+                group_id,
+                event,
+                priority=PRIORITY_ALERT,
+                coalesce_key=f"status:{server.key}",
+                render=functools.partial(render_status_change, server),
+                coalesce_window=max(config.OUTBOX_COALESCE_WINDOW, server.interval)
             )
 
+# 构建服务器状态变化通知（events为尚未发出的状态变化，多于一条时生成摘要）
+def render_status_change(server, events):
+    status = events[-1]
+    if len(events) > 1:
+        online_count = sum(1 for event in events if event["is_online"])
+        offline_count = len(events) - online_count
+        message = [
+            f"⚠️ {server.name} 状态频繁变化！",
+            f"服务器地址: {server.address}",
+            f"最近变化: 上线 x{online_count}，离线 x{offline_count}",
+            f"当前状态: {'🟢 运行正常' if status['is_online'] else '🔴 离线（' + status['message'] + '）'}"
+        ]
+    elif status["is_online"]:
+        message = [
+            f"🟢 {server.name} 已上线！",
+            f"服务器地址: {server.address}",
+            f"当前状态: 运行正常",
+            f"可容纳玩家: {status['max_players']}人"
+        ]
+    else:
+        message = [
+            f"🔴 {server.name} 已离线！",
+            f"服务器地址: {server.address}",
+            f"离线原因: {status['message']}"
+        ]
+    return "\n".join(message)
+
 # 创建全局监控实例
 server_monitor = ServerMonitor()
 
@@ -152,19 +304,27 @@ driver = get_driver()
 
 @driver.on_startup
 async def on_startup():
-    await server_monitor.start()
+    with startup_timer.phase("monitor"):
+        await server_monitor.start()
 
 @driver.on_shutdown
 async def on_shutdown():
     await server_monitor.stop()
 
-# 获取服务器状态
-def get_server_status():
-    if server_monitor.last_status:
-        return server_monitor.last_status
+# 获取服务器状态（未指定server_key时返回默认服务器）
+def get_server_status(server_key=None):
+    server = server_monitor.servers.get(server_key) if server_key else server_monitor.default_server
+    if server is None:
+        return None
+    
+    if server.key in server_monitor.statuses:
+        return server_monitor.statuses[server.key]
     else:
         # 返回默认状态
         return {
+            "server_key": server.key,
+            "name": server.name,
+            "address": server.address,
             "is_online": False,
             "players": 0,
             "max_players": config.DEFAULT_MAX_PLAYERS,
@@ -173,9 +333,23 @@ def get_server_status():
             "message": "服务器状态未知"
         }
 
-# 手动触发服务器检查
-async def trigger_server_check():
-    if server_monitor.is_running:
-        await server_monitor._check_server_status()
-        return True
-    return False
\ No newline at end of file
+# 获取所有服务器状态
+def get_all_server_status():
+    return [get_server_status(key) for key in server_monitor.servers]
+
+# 手动触发服务器检查（未指定server_key时检查所有服务器）
+async def trigger_server_check(server_key=None):
+    if not server_monitor.is_running:
+        return False
+    
+    if server_key:
+        server = server_monitor.servers.get(server_key)
+        if server is None:
+            return False
+        await server_monitor._check_server_status(server)
+    else:
+        await asyncio.gather(*(
+            server_monitor._check_server_status(server)
+            for server in server_monitor.servers.values()
+        ))
+    return True
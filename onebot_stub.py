@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+# 本地OneBot HTTP模拟服务（用于调试和测试，无需运行真实的go-cqhttp）
+# 支持keep-alive长连接，可注入失败和延迟以验证重试逻辑
+class OneBotStubServer:
+    def __init__(self, fail_times=0, fail_status=500, delay=0.0):
+        self.fail_times = fail_times
+        self.fail_status = fail_status
+        self.delay = delay
+        self.requests = []
+        self.connections = 0
+        self._server = None
+        self._message_id = 0
+    
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+    
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+    
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _version = request_line.decode("latin-1").split(" ", 2)
+                
+                # 读取请求头
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                
+                body = b""
+                if "content-length" in headers:
+                    body = await reader.readexactly(int(headers["content-length"]))
+                
+                status, payload = await self._dispatch(method, path, headers, body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _dispatch(self, method, path, headers, body):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        
+        request = {
+            "method": method,
+            "path": path,
+            "authorization": headers.get("authorization"),
+            "data": json.loads(body) if body else None
+        }
+        self.requests.append(request)
+        
+        # 注入失败
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            return self.fail_status, {"status": "failed", "retcode": 100}
+        
+        self._message_id += 1
+        return 200, {"status": "ok", "retcode": 0, "data": {"message_id": self._message_id}}
+
+# 命令行启动：python onebot_stub.py [port]
+if __name__ == "__main__":
+    import sys
+    
+    async def _main():
+        server = OneBotStubServer()
+        port = await server.start(port=int(sys.argv[1]) if len(sys.argv) > 1 else 5700)
+        print(f"OneBot模拟服务已启动: http://127.0.0.1:{port}")
+        await asyncio.Event().wait()
+    
+    asyncio.run(_main())
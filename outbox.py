@@ -0,0 +1,434 @@
+import asyncio
+import collections
+import itertools
+import random
+import threading
+import time
+from settings import get_config
+from utils import logger, OneBotError, send_group_message
+from metrics import OUTBOX_SEND_LATENCY
+
+# 获取配置
+config = get_config()
+
+# 消息优先级（数值越小越先发送）
+PRIORITY_ALERT = 0  # 服务器状态告警
+PRIORITY_NOTICE = 1  # 启动等系统通知
+PRIORITY_BROADCAST = 2  # 广播等普通消息
+
+# 优先级在统计和指标中的名称
+PRIORITY_NAMES = {
+    PRIORITY_ALERT: "alert",
+    PRIORITY_NOTICE: "notice",
+    PRIORITY_BROADCAST: "broadcast"
+}
+
+# 合并后单条消息之间的分隔
+MERGE_SEPARATOR = "\n\n"
+
+# 令牌桶（预约式：每次取令牌时计算需要等待的时间，令牌可以透支，
+# 透支部分即排队时间。不依赖asyncio锁，可以跨线程共用）
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def reserve(self):
+        """取一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+    
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# 按群限速：同一个群两条消息之间至少间隔interval秒
+class GroupRateLimiter:
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_send = {}
+        self._lock = threading.Lock()
+    
+    def next_send(self, group_id):
+        """该群下一次允许发送的时间（time.monotonic）"""
+        return self._next_send.get(group_id, 0.0)
+    
+    def reserve(self, group_id):
+        with self._lock:
+            now = time.monotonic()
+            send_at = max(now, self._next_send.get(group_id, now))
+            self._next_send[group_id] = send_at + self.interval
+            
+            # 清理已经过期的记录，避免字典无限增长
+            if len(self._next_send) > 10000:
+                self._next_send = {key: value for key, value in self._next_send.items() if value > now}
+            return send_at - now
+
+# 队列中的一条待发送消息
+class OutboxItem:
+    def __init__(self, group_id, event, priority, sequence, coalesce_key=None, render=None,
+                 sender=None, retries=0, coalesce_window=0.0):
+        now = time.monotonic()
+        self.group_id = str(group_id)
+        self.events = [event]  # 合并到同一coalesce_key的事件
+        self.priority = priority
+        self.sequence = sequence
+        self.coalesce_key = coalesce_key
+        self.coalesce_window = coalesce_window
+        self.render = render
+        self.sender = sender
+        self.retries = retries
+        self.attempts = 0
+        self.created_at = now
+        self.ready_at = now + config.OUTBOX_MERGE_WINDOW  # 短暂停留，等待同群的消息一起合并
+        self.deferred = False  # 重试退避或等待合并摘要中，到达ready_at之前不会随同群的其他消息提前发出
+        self.future = None
+    
+    @property
+    def sort_key(self):
+        return (self.priority, self.sequence)
+    
+    def message(self):
+        # 没有render时，同一coalesce_key只保留最新的一条
+        return self.render(self.events) if self.render else self.events[-1]
+
+# 出站消息队列：所有主动发送的群消息都经过这里
+# - 按优先级发送（告警优先于普通消息）
+# - 同一coalesce_key的待发送消息合并为一条摘要（如服务器反复上下线）；
+#   发出后coalesce_window内同一coalesce_key的后续消息在窗口结束时合并发出
+# - 发往同一个群的消息在短时间窗口内合并为一条
+# - 全局令牌桶和按群间隔限速，队列有上限，满时优先淘汰低优先级消息
+class Outbox:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Outbox, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.bucket = TokenBucket(config.OUTBOX_RATE, config.OUTBOX_BURST)
+            self.group_limiter = GroupRateLimiter(config.OUTBOX_GROUP_INTERVAL)
+            self.max_size = max(1, config.OUTBOX_MAX_SIZE)
+            self._pending = []
+            self._sequence = itertools.count()
+            self._loop = None
+            self._wakeup = None
+            self._space = None
+            self._slots = None
+            self._worker_task = None
+            self._send_tasks = set()
+            self._stopping = False
+            self._coalesce_holds = {}  # (coalesce_key, 群号) -> 后续消息最早的发送时间
+            
+            # 统计信息
+            self.sent = 0
+            self.failed = 0
+            self.dropped = 0
+            self.evicted = 0
+            self.merged = 0
+            self.coalesced = 0
+            self.retried = 0
+            self._latencies = collections.deque(maxlen=1000)
+            self._initialized = True
+    
+    async def start(self):
+        self._ensure_started()
+    
+    def _ensure_started(self):
+        # 在当前事件循环中启动发送任务（未显式启动时由第一次投递触发）
+        if self._worker_task is None:
+            self._loop = asyncio.get_running_loop()
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._space = asyncio.Condition()
+            self._slots = asyncio.Semaphore(max(1, config.OUTBOX_CONCURRENCY))
+            self._worker_task = asyncio.create_task(self._worker())
+            logger.info("出站消息队列已启动")
+    
+    async def stop(self):
+        if self._worker_task is None:
+            return
+        
+        # 尽量在截止时间内发完剩余消息
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + config.OUTBOX_DRAIN_TIMEOUT
+        for item in self._pending:
+            item.ready_at = 0
+        self._wakeup.set()
+        while (self._pending or self._send_tasks) and loop.time() < expires_at:
+            await asyncio.sleep(0.05)
+        
+        self._stopping = True
+        self._wakeup.set()
+        self._worker_task.cancel()
+        for task in list(self._send_tasks):
+            task.cancel()
+        await asyncio.gather(self._worker_task, *self._send_tasks, return_exceptions=True)
+        self._worker_task = None
+        
+        # 未发送的消息直接失败
+        for item in self._pending:
+            self._fail(item, OneBotError("出站消息队列已停止"))
+        logger.info(f"出站消息队列已停止，丢弃 {len(self._pending)} 条未发送的消息")
+        self._pending = []
+    
+    def post(self, group_id, message, priority=PRIORITY_NOTICE, coalesce_key=None, render=None,
+             coalesce_window=0.0):
+        """投递消息后立即返回（不等待发送结果），临时故障会自动重试；
+        指定coalesce_window时，同一coalesce_key的消息发出后，窗口内的后续消息合并为一条在窗口结束时发出"""
+        if self._worker_task is None:
+            try:
+                self._ensure_started()
+            except RuntimeError:
+                logger.warning("没有运行中的事件循环，消息被丢弃")
+                self.dropped += 1
+                return False
+        
+        args = (group_id, message, priority, coalesce_key, render, None, config.OUTBOX_MAX_RETRIES, coalesce_window)
+        if self._in_worker_loop():
+            return self._enqueue(*args) is not None
+        
+        # 来自其他线程（如API服务）的消息交给队列所在的事件循环处理
+        self._loop.call_soon_threadsafe(self._enqueue, *args)
+        return True
+    
+    async def send(self, group_id, message, priority=PRIORITY_BROADCAST, sender=None, retries=0):
+        """投递消息并等待发送完成，失败抛出OneBotError；队列已满时最多等待OUTBOX_PUT_TIMEOUT秒"""
+        if self._worker_task is None:
+            self._ensure_started()
+        
+        if not self._in_worker_loop():
+            future = asyncio.run_coroutine_threadsafe(
+                self.send(group_id, message, priority, sender, retries), self._loop
+            )
+            return await asyncio.wrap_future(future)
+        
+        if len(self._pending) >= self.max_size and not self._has_lower_priority(priority):
+            try:
+                async with self._space:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: len(self._pending) < self.max_size),
+                        config.OUTBOX_PUT_TIMEOUT
+                    )
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                raise OneBotError("出站消息队列已满", transient=True)
+        
+        item = self._enqueue(group_id, message, priority, None, None, sender, retries)
+        if item is None:
+            raise OneBotError("出站消息队列已满", transient=True)
+        item.future = self._loop.create_future()
+        return await item.future
+    
+    def get_stats(self):
+        depth_by_priority = collections.Counter(item.priority for item in self._pending)
+        latencies = sorted(self._latencies)
+        return {
+            "depth": len(self._pending),
+            "depth_by_priority": {
+                name: depth_by_priority.get(priority, 0) for priority, name in PRIORITY_NAMES.items()
+            },
+            "in_flight": len(self._send_tasks),
+            "max_size": self.max_size,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "merged": self.merged,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "latency": {
+                "avg": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                "p50": round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+                "p95": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else 0.0,
+                "max": round(latencies[-1], 3) if latencies else 0.0
+            }
+        }
+    
+    def _in_worker_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+    
+    def _has_lower_priority(self, priority):
+        return any(item.priority > priority for item in self._pending)
+    
+    def _enqueue(self, group_id, message, priority, coalesce_key, render, sender, retries, coalesce_window=0.0):
+        group_id = str(group_id)
+        
+        # 同一个群、同一coalesce_key且尚未发送的消息合并为一条
+        if coalesce_key is not None:
+            for item in self._pending:
+                if item.coalesce_key == coalesce_key and item.group_id == group_id:
+                    item.events.append(message)
+                    item.priority = min(item.priority, priority)
+                    self.coalesced += 1
+                    self._wakeup.set()
+                    return item
+        
+        # 队列已满：淘汰优先级最低且最新的消息，新消息优先级不高于它们时丢弃新消息
+        if len(self._pending) >= self.max_size:
+            victim = max(self._pending, key=lambda item: item.sort_key)
+            if victim.priority <= priority:
+                self.dropped += 1
+                logger.warning(f"出站消息队列已满，丢弃发往群 {group_id} 的消息")
+                return None
+            self._pending.remove(victim)
+            self.evicted += 1
+            self._fail(victim, OneBotError("出站消息队列已满，消息被更高优先级的消息挤出", transient=True))
+        
+        item = OutboxItem(
+            group_id, message, priority, next(self._sequence),
+            coalesce_key=coalesce_key, render=render, sender=sender, retries=retries,
+            coalesce_window=coalesce_window
+        )
+        if coalesce_key is not None:
+            # 同一coalesce_key的上一条消息刚发出不久，等到窗口结束再发，期间的后续消息合并到这一条
+            hold_until = self._coalesce_holds.get((coalesce_key, group_id), 0.0)
+            if hold_until > item.ready_at:
+                item.ready_at = hold_until
+                item.deferred = True
+        self._pending.append(item)
+        self._wakeup.set()
+        return item
+    
+    def _next_ready_time(self, now):
+        """最早可以发送的时间，队列为空返回None"""
+        ready_times = [
+            max(item.ready_at, self.group_limiter.next_send(item.group_id))
+            for item in self._pending
+        ]
+        return min(ready_times) if ready_times else None
+    
+    def _take_batch(self, now):
+        """取出最高优先级的可发送消息，以及发往同一个群的其他待发送消息"""
+        ready = [
+            item for item in self._pending
+            if item.ready_at <= now and self.group_limiter.next_send(item.group_id) <= now
+        ]
+        if not ready:
+            return []
+        
+        first = min(ready, key=lambda item: item.sort_key)
+        batch = [first]
+        length = len(first.message())
+        candidates = sorted(
+            (item for item in self._pending
+             if item is not first and item.group_id == first.group_id and item.sender is first.sender
+             and (not item.deferred or item.ready_at <= now)),
+            key=lambda item: item.sort_key
+        )
+        for item in candidates:
+            length += len(MERGE_SEPARATOR) + len(item.message())
+            if length > config.OUTBOX_MERGE_MAX_LENGTH:
+                break
+            batch.append(item)
+        
+        for item in batch:
+            self._pending.remove(item)
+        self.merged += len(batch) - 1
+        return batch
+    
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                now = time.monotonic()
+                ready_at = self._next_ready_time(now)
+                if ready_at is None or ready_at > now:
+                    # 队列为空或者还没有可发送的消息，等待新消息或到达可发送时间
+                    self._wakeup.clear()
+                    timeout = None if ready_at is None else ready_at - now
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                
+                # 先取得令牌和发送名额，再挑选此刻优先级最高的消息
+                await self.bucket.acquire()
+                await self._slots.acquire()
+                batch = self._take_batch(time.monotonic())
+                if not batch:
+                    self._slots.release()
+                    continue
+                
+                self.group_limiter.reserve(batch[0].group_id)
+                task = asyncio.create_task(self._deliver(batch))
+                self._send_tasks.add(task)
+                task.add_done_callback(self._send_tasks.discard)
+                
+                # 腾出了队列空间，唤醒等待的生产者
+                async with self._space:
+                    self._space.notify_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"出站消息队列出错: {str(e)}")
+                await asyncio.sleep(1)
+    
+    async def _deliver(self, batch):
+        first = batch[0]
+        sender = first.sender or send_group_message
+        try:
+            message = MERGE_SEPARATOR.join(item.message() for item in batch)
+            await sender(first.group_id, message)
+        except OneBotError as e:
+            for item in batch:
+                self._retry_or_fail(item, e)
+        except Exception as e:
+            for item in batch:
+                self._fail(item, OneBotError(str(e) or type(e).__name__))
+        else:
+            now = time.monotonic()
+            for item in batch:
+                self.sent += 1
+                self._latencies.append(now - item.created_at)
+                OUTBOX_SEND_LATENCY.observe(now - item.created_at, PRIORITY_NAMES.get(item.priority, str(item.priority)))
+                if item.coalesce_key is not None and item.coalesce_window > 0:
+                    self._hold_coalesce_key(item, now)
+                if item.future is not None and not item.future.done():
+                    item.future.set_result(True)
+        finally:
+            self._slots.release()
+    
+    def _hold_coalesce_key(self, item, now):
+        self._coalesce_holds[(item.coalesce_key, item.group_id)] = now + item.coalesce_window
+        
+        # 清理已经过期的记录，避免字典无限增长
+        if len(self._coalesce_holds) > 10000:
+            self._coalesce_holds = {key: value for key, value in self._coalesce_holds.items() if value > now}
+    
+    def _retry_or_fail(self, item, error):
+        item.attempts += 1
+        if not error.transient or item.attempts > item.retries or self._stopping:
+            logger.error(f"发送消息到群 {item.group_id} 失败: {str(error)}")
+            self._fail(item, error)
+            return
+        
+        # 指数退避加随机抖动后重新排队（保留原来的顺序号，不会被新消息插队）
+        delay = config.OUTBOX_RETRY_BASE * (2 ** (item.attempts - 1))
+        item.ready_at = time.monotonic() + random.uniform(delay / 2, delay * 1.5)
+        item.deferred = True
+        self.retried += 1
+        self._pending.append(item)
+        self._wakeup.set()
+    
+    def _fail(self, item, error):
+        self.failed += 1
+        if item.future is not None and not item.future.done():
+            item.future.set_exception(error)
+
+# 创建全局出站消息队列实例
+outbox = Outbox()
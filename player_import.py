@@ -0,0 +1,288 @@
+import csv
+import datetime
+import io
+import json
+from sqlalchemy import bindparam, func, insert, select, update
+from models import QQBotPlayers, PlayerStats, DailySignIn
+from repository import default_nickname
+from utils import is_valid_steam_id, logger
+
+# 批量导入玩家（从其他机器人迁移玩家数据）
+# 数据按块处理：每块先用一条查询取回已有玩家和SteamID占用情况，
+# 再用数据库原生的多行UPSERT写入玩家（MySQL：ON DUPLICATE KEY UPDATE，SQLite/PostgreSQL：ON CONFLICT），
+# 新玩家的统计和签到记录同样批量插入，每块一个事务
+# 同步函数，异步代码中通过 AsyncSession.run_sync(import_players, 内容, 格式) 调用
+
+# 支持的导入格式
+IMPORT_FORMAT_CSV = "csv"
+IMPORT_FORMAT_NDJSON = "ndjson"
+IMPORT_FORMATS = (IMPORT_FORMAT_CSV, IMPORT_FORMAT_NDJSON)
+
+# 可导入的字段（qq_id和steam_id必填，其余字段缺省时新玩家使用默认值、已有玩家保持原值）
+IMPORT_FIELDS = ("qq_id", "steam_id", "nickname", "points", "bind_time", "last_login")
+
+# 每块的行数（IN查询同时包含QQ号和SteamID，注意数据库的参数数量限制）
+IMPORT_CHUNK_SIZE = 500
+
+# 报告中最多列出的错误行数
+IMPORT_MAX_ERRORS = 1000
+
+# 支持原生UPSERT的数据库
+UPSERT_DIALECTS = ("mysql", "sqlite", "postgresql")
+
+# 导入报告
+class ImportReport:
+    def __init__(self):
+        self.total = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+    
+    def add_error(self, line, qq_id, error):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "qq_id": qq_id, "error": error})
+    
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "created": self.created,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+# 逐行读取导入内容，生成 (行号, 原始数据字典或错误信息)
+def iter_import_rows(content, fmt):
+    if fmt == IMPORT_FORMAT_CSV:
+        reader = csv.DictReader(io.StringIO(content))
+        missing = [field for field in ("qq_id", "steam_id") if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV表头缺少字段: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+    
+    for line_number, line in enumerate(io.StringIO(content), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, "不是有效的JSON"
+            continue
+        yield line_number, row if isinstance(row, dict) else "每行必须是一个JSON对象"
+
+def _parse_datetime(value, field):
+    if isinstance(value, str):
+        value = value.strip()
+        if value.endswith("Z"):
+            value = value[:-1] + "+00:00"
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"{field} 不是有效的时间")
+        # 数据库统一存储UTC时间
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+    raise ValueError(f"{field} 不是有效的时间")
+
+# 校验一行数据，返回规范化后的玩家数据（缺省字段为None）；数据无效时抛出ValueError
+def validate_import_row(row):
+    values = {}
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        values[field] = None if value in (None, "") else value
+    
+    qq_id = str(values["qq_id"]) if values["qq_id"] is not None else ""
+    if not qq_id.isdigit() or len(qq_id) > 20:
+        raise ValueError("qq_id 必须是不超过20位的数字")
+    values["qq_id"] = qq_id
+    
+    steam_id = str(values["steam_id"]) if values["steam_id"] is not None else ""
+    if not is_valid_steam_id(steam_id):
+        raise ValueError("steam_id 不是有效的SteamID64")
+    values["steam_id"] = steam_id
+    
+    if values["nickname"] is not None:
+        values["nickname"] = str(values["nickname"])[:100]
+    
+    if values["points"] is not None:
+        try:
+            values["points"] = int(values["points"])
+        except (TypeError, ValueError):
+            raise ValueError("points 必须是整数")
+        if values["points"] < 0:
+            raise ValueError("points 不能为负数")
+    
+    for field in ("bind_time", "last_login"):
+        if values[field] is not None:
+            values[field] = _parse_datetime(values[field], field)
+    
+    return values
+
+# 已有玩家：未提供的字段保持原值
+def _upsert_values(new):
+    return {
+        "steam_id": new["steam_id"],
+        "nickname": func.coalesce(new["nickname"], QQBotPlayers.nickname),
+        "points": func.coalesce(new["points"], QQBotPlayers.points),
+        "bind_time": func.coalesce(new["bind_time"], QQBotPlayers.bind_time),
+        "last_login": func.coalesce(new["last_login"], QQBotPlayers.last_login)
+    }
+
+# 按数据库类型构建UPSERT语句（以qq_id为冲突键）
+def _upsert_statement(dialect_name):
+    if dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(QQBotPlayers)
+        return stmt.on_duplicate_key_update(**_upsert_values(stmt.inserted))
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(QQBotPlayers)
+    else:
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        stmt = postgresql_insert(QQBotPlayers)
+    return stmt.on_conflict_do_update(index_elements=[QQBotPlayers.qq_id], set_=_upsert_values(stmt.excluded))
+
+# 不支持UPSERT的数据库：已有玩家逐行更新（executemany）
+_update_player = (
+    update(QQBotPlayers)
+    .where(QQBotPlayers.qq_id == bindparam("b_qq_id"))
+    .values(_upsert_values({field: bindparam(f"b_{field}") for field in IMPORT_FIELDS}))
+    .execution_options(synchronize_session=False)
+)
+
+# 写入一块玩家数据（一个事务），返回 (新建数量, 更新数量, SteamID冲突的行)
+def _write_chunk(db, rows):
+    # 直接使用Core连接执行，ORM的批量INSERT会把显式的None替换为列默认值（已有玩家的缺省字段需要保持原值）
+    conn = db.connection()
+    qq_ids = [values["qq_id"] for _, values in rows]
+    steam_ids = [values["steam_id"] for _, values in rows]
+    existing = conn.execute(
+        select(QQBotPlayers.qq_id, QQBotPlayers.steam_id)
+        .where(QQBotPlayers.qq_id.in_(qq_ids) | QQBotPlayers.steam_id.in_(steam_ids))
+    ).all()
+    existing_qq_ids = {row.qq_id for row in existing}
+    steam_owners = {row.steam_id: row.qq_id for row in existing}
+    
+    # SteamID已被其他玩家绑定的行不写入
+    # （MySQL的ON DUPLICATE KEY对所有唯一键生效，写入会误更新另一个玩家）
+    conflicts = {}
+    for line, values in rows:
+        owner = steam_owners.get(values["steam_id"])
+        if owner is not None and owner != values["qq_id"]:
+            conflicts[line] = f"steam_id 已被QQ {owner} 绑定"
+    
+    now = datetime.datetime.utcnow()
+    created_at = now.strftime('%Y-%m-%d %H:%M:%S')
+    params = []
+    for line, values in rows:
+        if line in conflicts:
+            continue
+        if values["qq_id"] in existing_qq_ids:
+            params.append(dict(values, created_at=created_at))
+            continue
+        params.append({
+            "qq_id": values["qq_id"],
+            "steam_id": values["steam_id"],
+            "nickname": values["nickname"] or default_nickname(values["qq_id"]),
+            "points": values["points"] or 0,
+            "bind_time": values["bind_time"] or now,
+            "last_login": values["last_login"] or now,
+            "created_at": created_at
+        })
+    
+    new_qq_ids = [item["qq_id"] for item in params if item["qq_id"] not in existing_qq_ids]
+    if params:
+        dialect_name = conn.dialect.name
+        if dialect_name in UPSERT_DIALECTS:
+            conn.execute(_upsert_statement(dialect_name), params)
+        else:
+            if new_qq_ids:
+                conn.execute(insert(QQBotPlayers), [item for item in params if item["qq_id"] not in existing_qq_ids])
+            updates = [
+                {f"b_{field}": item[field] for field in IMPORT_FIELDS}
+                for item in params if item["qq_id"] in existing_qq_ids
+            ]
+            if updates:
+                conn.execute(_update_player, updates)
+    
+    # 新玩家的统计和签到记录批量插入
+    if new_qq_ids:
+        player_ids = conn.execute(
+            select(QQBotPlayers.id).where(QQBotPlayers.qq_id.in_(new_qq_ids))
+        ).scalars().all()
+        conn.execute(insert(PlayerStats), [{"player_id": player_id} for player_id in player_ids])
+        conn.execute(insert(DailySignIn), [{"player_id": player_id} for player_id in player_ids])
+    
+    db.commit()
+    return len(new_qq_ids), len(params) - len(new_qq_ids), conflicts
+
+def _import_chunk(db, rows, report):
+    try:
+        created, updated, conflicts = _write_chunk(db, rows)
+    except Exception as e:
+        db.rollback()
+        if len(rows) > 1:
+            # 整块失败时逐行重试，只有出错的行记入报告
+            for row in rows:
+                _import_chunk(db, [row], report)
+            return
+        line, values = rows[0]
+        logger.warning(f"导入玩家 {values['qq_id']} 失败: {str(e)}")
+        report.add_error(line, values["qq_id"], "写入数据库失败")
+        return
+    
+    report.created += created
+    report.updated += updated
+    for line, values in rows:
+        if line in conflicts:
+            report.add_error(line, values["qq_id"], conflicts[line])
+
+# 导入玩家，返回导入报告（每行的错误附带行号）；内容格式错误（如CSV缺少必填列）时抛出ValueError
+def import_players(db, content, fmt=IMPORT_FORMAT_NDJSON, chunk_size=IMPORT_CHUNK_SIZE):
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"不支持的导入格式: {fmt}")
+    
+    report = ImportReport()
+    seen_qq_ids = {}
+    seen_steam_ids = {}
+    chunk = []
+    
+    for line, row in iter_import_rows(content, fmt):
+        report.total += 1
+        if isinstance(row, str):
+            report.add_error(line, None, row)
+            continue
+        try:
+            values = validate_import_row(row)
+        except ValueError as e:
+            report.add_error(line, row.get("qq_id"), str(e))
+            continue
+        
+        # 同一份导入数据中的重复行
+        qq_id, steam_id = values["qq_id"], values["steam_id"]
+        if qq_id in seen_qq_ids:
+            report.add_error(line, qq_id, f"qq_id 与第 {seen_qq_ids[qq_id]} 行重复")
+            continue
+        if steam_id in seen_steam_ids:
+            report.add_error(line, qq_id, f"steam_id 与第 {seen_steam_ids[steam_id]} 行重复")
+            continue
+        seen_qq_ids[qq_id] = line
+        seen_steam_ids[steam_id] = line
+        
+        chunk.append((line, values))
+        if len(chunk) >= chunk_size:
+            _import_chunk(db, chunk, report)
+            chunk = []
+    
+    if chunk:
+        _import_chunk(db, chunk, report)
+    return report
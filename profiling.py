@@ -0,0 +1,201 @@
+import collections
+import contextvars
+import cProfile
+import datetime
+import io
+import itertools
+import json
+import logging
+import pstats
+import time
+from nonebot.adapters import Bot
+from settings import get_config
+from utils import logger
+
+# 命令性能剖析：process_command 为每次命令创建一条剖析记录，分阶段计时（纳秒）：
+# 权限检查、数据库（SQL执行，由database的执行事件累加）、OneBot接口调用（NoneBot的API调用钩子），
+# 其余时间计为处理器自身耗时。超过阈值的命令写入慢命令日志；
+# 开启采样后每N次命令用cProfile完整剖析一次，结果可通过API查看
+
+# 获取配置
+config = get_config()
+
+# 计时阶段
+PHASE_PERMISSION = "permission"
+PHASE_DB = "db"
+PHASE_ONEBOT = "onebot"
+PHASE_HANDLER = "handler"
+
+# 采样结果中保留的函数数量（按累计耗时排序）
+PROFILE_STATS_LIMIT = 40
+
+# 当前命令的剖析记录（每个命令在自己的任务上下文中设置，子任务继承）
+current_profile = contextvars.ContextVar("current_command_profile", default=None)
+
+# 一次命令的剖析记录
+class CommandProfile:
+    __slots__ = ("command", "user_id", "group_id", "started_ns", "phases", "db_queries", "onebot_calls", "_api_started")
+    
+    def __init__(self, command, user_id, group_id):
+        self.command = command
+        self.user_id = user_id
+        self.group_id = group_id
+        self.started_ns = time.perf_counter_ns()
+        self.phases = {PHASE_PERMISSION: 0, PHASE_DB: 0, PHASE_ONEBOT: 0}
+        self.db_queries = 0
+        self.onebot_calls = 0
+        self._api_started = {}
+    
+    def add(self, phase, elapsed_ns):
+        self.phases[phase] += elapsed_ns
+    
+    def add_query(self, elapsed_ns):
+        self.phases[PHASE_DB] += elapsed_ns
+        self.db_queries += 1
+
+def _ms(elapsed_ns):
+    return round(elapsed_ns / 1e6, 3)
+
+# OneBot接口调用计时（调用前后的钩子收到的是同一个参数字典）
+@Bot.on_calling_api
+async def _on_calling_api(bot, api, data):
+    profile = current_profile.get()
+    if profile is not None:
+        profile._api_started[id(data)] = time.perf_counter_ns()
+
+@Bot.on_called_api
+async def _on_called_api(bot, exception, api, data, result):
+    profile = current_profile.get()
+    if profile is not None:
+        started = profile._api_started.pop(id(data), None)
+        if started is not None:
+            profile.add(PHASE_ONEBOT, time.perf_counter_ns() - started)
+            profile.onebot_calls += 1
+
+# 慢命令日志文件（每行一条JSON）
+def _setup_journal_logger():
+    journal_logger = logging.getLogger("unturned_bot.slow_commands")
+    journal_logger.setLevel(logging.INFO)
+    journal_logger.propagate = False
+    if journal_logger.handlers:
+        journal_logger.handlers.clear()
+    if config.COMMAND_SLOW_LOG_FILE:
+        handler = logging.FileHandler(config.COMMAND_SLOW_LOG_FILE, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        journal_logger.addHandler(handler)
+    return journal_logger
+
+# 命令剖析管理：慢命令日志和采样剖析结果
+class CommandProfiler:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(CommandProfiler, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.slow_threshold_ns = config.COMMAND_SLOW_THRESHOLD_MS * 1_000_000
+            self.sample_rate = max(0, config.COMMAND_PROFILE_SAMPLE_RATE)
+            self.slow_commands = collections.deque(maxlen=max(1, config.COMMAND_SLOW_JOURNAL_SIZE))
+            self.samples = collections.deque(maxlen=max(1, config.COMMAND_PROFILE_HISTORY))
+            self._journal_logger = _setup_journal_logger()
+            self._invocations = itertools.count(1)
+            self._sample_ids = itertools.count(1)
+            self._sampling = False
+            self.profiled = 0
+            self.slow = 0
+            self._initialized = True
+    
+    def begin(self, command, user_id, group_id):
+        """开始记录一次命令，返回 (剖析记录, 上下文令牌, cProfile实例或None)"""
+        profile = CommandProfile(command, user_id, group_id)
+        token = current_profile.set(profile)
+        profiler = None
+        
+        # cProfile同一时间只能有一个在运行；采样期间事件循环上其他任务的调用也会被记录
+        if self.sample_rate and not self._sampling and next(self._invocations) % self.sample_rate == 0:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._sampling = True
+            except ValueError:
+                # 已有其他剖析工具在运行
+                profiler = None
+        return profile, token, profiler
+    
+    def finish(self, profile, token, profiler, success):
+        """结束记录：超过阈值时写入慢命令日志，采样时保存剖析结果"""
+        total_ns = time.perf_counter_ns() - profile.started_ns
+        current_profile.reset(token)
+        if profiler is not None:
+            profiler.disable()
+            self._sampling = False
+        
+        if total_ns < self.slow_threshold_ns and profiler is None:
+            return total_ns
+        
+        entry = self._entry(profile, total_ns, success)
+        if total_ns >= self.slow_threshold_ns:
+            self.slow += 1
+            self.slow_commands.append(entry)
+            self._journal_logger.info(json.dumps(entry, ensure_ascii=False))
+            phases = entry["phases"]
+            logger.warning(
+                f"慢命令 /{profile.command} 耗时 {entry['total_ms']}ms"
+                f"（数据库 {phases['db_ms']}ms/{profile.db_queries}条SQL，"
+                f"OneBot {phases['onebot_ms']}ms/{profile.onebot_calls}次调用）"
+            )
+        if profiler is not None:
+            self.profiled += 1
+            self.samples.append(dict(entry, id=next(self._sample_ids), stats=self._format_stats(profiler)))
+        return total_ns
+    
+    def _entry(self, profile, total_ns, success):
+        phases = dict(profile.phases)
+        phases[PHASE_HANDLER] = max(0, total_ns - sum(phases.values()))
+        return {
+            "time": datetime.datetime.utcnow().isoformat(timespec="milliseconds") + "Z",
+            "command": profile.command,
+            "user_id": str(profile.user_id),
+            "group_id": str(profile.group_id) if profile.group_id else None,
+            "success": success,
+            "total_ms": _ms(total_ns),
+            "phases": {f"{phase}_ms": _ms(elapsed_ns) for phase, elapsed_ns in phases.items()},
+            "db_queries": profile.db_queries,
+            "onebot_calls": profile.onebot_calls
+        }
+    
+    def _format_stats(self, profiler):
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_STATS_LIMIT)
+        return output.getvalue()
+    
+    def get_slow_commands(self, limit=50, command=None):
+        """最近的慢命令（新的在前）"""
+        entries = [entry for entry in reversed(self.slow_commands) if command is None or entry["command"] == command]
+        return entries[:limit]
+    
+    def get_samples(self):
+        """采样剖析结果列表（不含剖析详情，新的在前）"""
+        return [{key: value for key, value in sample.items() if key != "stats"} for sample in reversed(self.samples)]
+    
+    def get_sample(self, sample_id):
+        for sample in self.samples:
+            if sample["id"] == sample_id:
+                return sample
+        return None
+    
+    def get_stats(self):
+        return {
+            "slow_threshold_ms": config.COMMAND_SLOW_THRESHOLD_MS,
+            "sample_rate": self.sample_rate,
+            "slow": self.slow,
+            "profiled": self.profiled
+        }
+
+# 创建全局命令剖析实例
+command_profiler = CommandProfiler()
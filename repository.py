@@ -0,0 +1,289 @@
+import datetime
+from sqlalchemy import bindparam, case, func, insert, or_, select, update
+from sqlalchemy.orm import joinedload
+from models import QQBotPlayers, PlayerStats, DailySignIn
+from utils import calculate_sign_in_reward, get_sign_in_day
+from database import insert_ignore
+
+# 命令和API使用的数据访问层
+# 语句在模块加载时构建一次，通过bindparam传参，调用时直接命中SQLAlchemy的编译缓存；
+# 一对一关系使用joinedload，一次查询取回处理器需要的全部数据
+# 异步代码中通过 AsyncSession.run_sync(函数, 参数...) 调用，数据库IO由异步驱动完成
+
+# 玩家完整资料（玩家 + 游戏统计 + 签到记录）
+_profile_by_qq_id = (
+    select(QQBotPlayers)
+    .options(joinedload(QQBotPlayers.player_stats), joinedload(QQBotPlayers.daily_signin))
+    .where(QQBotPlayers.qq_id == bindparam("qq_id"))
+)
+
+_profile_by_steam_id = (
+    select(QQBotPlayers)
+    .options(joinedload(QQBotPlayers.player_stats), joinedload(QQBotPlayers.daily_signin))
+    .where(QQBotPlayers.steam_id == bindparam("steam_id"))
+)
+
+# 玩家 + 签到记录
+_signin_by_qq_id = (
+    select(QQBotPlayers)
+    .options(joinedload(QQBotPlayers.daily_signin))
+    .where(QQBotPlayers.qq_id == bindparam("qq_id"))
+)
+
+# 仅玩家本身
+_player_by_qq_id = select(QQBotPlayers).where(QQBotPlayers.qq_id == bindparam("qq_id"))
+
+# 绑定更新时需要的玩家ID和原SteamID
+_player_steam_id_by_qq_id = (
+    select(QQBotPlayers.id, QQBotPlayers.steam_id)
+    .where(QQBotPlayers.qq_id == bindparam("qq_id"))
+)
+
+# 玩家列表可选择的字段
+PLAYER_FIELDS = (
+    "id",
+    "qq_id",
+    "steam_id",
+    "nickname",
+    "points",
+    "bind_time",
+    "last_login",
+    "last_checkin_date",
+    "created_at"
+)
+
+# 玩家列表每页最大条数
+PLAYERS_MAX_LIMIT = 1000
+
+# 流式导出时每批从服务器端游标取回的行数
+PLAYERS_STREAM_BATCH = 1000
+
+# 签到：用一条带条件的UPDATE完成“检查今日是否已签到 + 更新签到记录”，
+# 并发签到时只有一个请求能更新成功，且行锁只持有一条语句的时间
+_signin_player_id = (
+    select(QQBotPlayers.id)
+    .where(QQBotPlayers.qq_id == bindparam("player_qq_id"))
+    .scalar_subquery()
+)
+
+_claim_signin = (
+    update(DailySignIn)
+    .where(
+        DailySignIn.player_id == _signin_player_id,
+        or_(DailySignIn.last_signin.is_(None), DailySignIn.last_signin < bindparam("day_start"))
+    )
+    # MySQL按书写顺序计算SET子句，last_signin必须最后更新
+    .ordered_values(
+        (DailySignIn.consecutive_days, case(
+            (DailySignIn.last_signin >= bindparam("yesterday_start"),
+             func.coalesce(DailySignIn.consecutive_days, 0) + 1),
+            else_=1
+        )),
+        (DailySignIn.total_days, func.coalesce(DailySignIn.total_days, 0) + 1),
+        (DailySignIn.last_signin, bindparam("signin_time"))
+    )
+    .execution_options(synchronize_session=False)
+)
+
+_signin_counts = (
+    select(DailySignIn.consecutive_days, DailySignIn.total_days)
+    .where(DailySignIn.player_id == _signin_player_id)
+)
+
+_award_points = (
+    update(QQBotPlayers)
+    .where(QQBotPlayers.qq_id == bindparam("player_qq_id"))
+    .values(
+        points=func.coalesce(QQBotPlayers.points, 0) + bindparam("reward"),
+        last_checkin_date=bindparam("checkin_date")
+    )
+    .execution_options(synchronize_session=False)
+)
+
+_player_points = (
+    select(QQBotPlayers.nickname, QQBotPlayers.points)
+    .where(QQBotPlayers.qq_id == bindparam("player_qq_id"))
+)
+
+# 支持UPDATE ... RETURNING的数据库（SQLite 3.35+、PostgreSQL、MariaDB）省去回读查询
+_claim_signin_returning = _claim_signin.returning(DailySignIn.consecutive_days, DailySignIn.total_days)
+_award_points_returning = _award_points.returning(QQBotPlayers.nickname, QQBotPlayers.points)
+
+# 签到结果
+SIGN_IN_OK = "ok"
+SIGN_IN_ALREADY = "already"
+SIGN_IN_UNBOUND = "unbound"
+
+# 查询玩家完整资料
+def get_player_profile(db, qq_id=None, steam_id=None):
+    if qq_id is not None:
+        return db.execute(_profile_by_qq_id, {"qq_id": str(qq_id)}).scalars().first()
+    return db.execute(_profile_by_steam_id, {"steam_id": str(steam_id)}).scalars().first()
+
+# 签到，返回 (签到结果, 签到信息)；签到信息包含昵称、奖励、当前积分、连续和累计签到天数
+def sign_in(db, qq_id, now=None):
+    now = now or datetime.datetime.utcnow()
+    local_day, day_start, yesterday_start = get_sign_in_day(now)
+    params = {
+        "player_qq_id": str(qq_id),
+        "day_start": day_start,
+        "yesterday_start": yesterday_start,
+        "signin_time": now
+    }
+    returning = db.get_bind().dialect.update_returning
+    
+    try:
+        row = _claim_signin_row(db, params, returning)
+        if row is None:
+            # 未更新任何行：未绑定、今日已签到，或者老数据缺少签到记录
+            player = db.execute(_signin_by_qq_id, {"qq_id": str(qq_id)}).scalars().first()
+            if player is None:
+                db.rollback()
+                return SIGN_IN_UNBOUND, None
+            if player.daily_signin is not None:
+                db.rollback()
+                return SIGN_IN_ALREADY, None
+            
+            player.daily_signin = DailySignIn(consecutive_days=0, total_days=0)
+            db.flush()
+            row = _claim_signin_row(db, params, returning)
+            if row is None:
+                db.rollback()
+                return SIGN_IN_ALREADY, None
+        
+        consecutive_days, total_days = row
+        reward = calculate_sign_in_reward(consecutive_days)
+        award_params = {
+            "player_qq_id": str(qq_id),
+            "reward": reward,
+            "checkin_date": local_day.strftime("%Y-%m-%d")
+        }
+        if returning:
+            nickname, points = db.execute(_award_points_returning, award_params).one()
+        else:
+            db.execute(_award_points, award_params)
+            nickname, points = db.execute(_player_points, award_params).one()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    
+    return SIGN_IN_OK, {
+        "nickname": nickname,
+        "reward": reward,
+        "points": points,
+        "consecutive_days": consecutive_days,
+        "total_days": total_days
+    }
+
+def _claim_signin_row(db, params, returning):
+    if returning:
+        return db.execute(_claim_signin_returning, params).first()
+    if db.execute(_claim_signin, params).rowcount != 1:
+        return None
+    return db.execute(_signin_counts, params).one()
+
+# 解析逗号分隔的字段列表，为空时返回全部字段；包含未知字段时抛出ValueError
+def parse_player_fields(fields=None):
+    if not fields:
+        return list(PLAYER_FIELDS)
+    selected = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in selected if field not in PLAYER_FIELDS]
+    if unknown or not selected:
+        raise ValueError(f"未知字段: {', '.join(unknown)}，可选字段: {', '.join(PLAYER_FIELDS)}")
+    return selected
+
+# 按id顺序查询玩家的指定字段（after_id为上一页最后一个玩家的id）
+def players_query(fields, after_id=None):
+    columns = [getattr(QQBotPlayers, field) for field in fields]
+    if "id" not in fields:
+        columns.append(QQBotPlayers.id)  # 作为游标，不输出
+    query = select(*columns).order_by(QQBotPlayers.id)
+    if after_id is not None:
+        query = query.where(QQBotPlayers.id > after_id)
+    return query
+
+# 将查询结果（或缓存快照）转换为可序列化的字典，只保留指定字段
+def player_to_dict(row, fields):
+    player = {}
+    for field in fields:
+        value = row[field]
+        player[field] = str(value) if isinstance(value, datetime.datetime) else value
+    return player
+
+# 分页查询玩家，返回 (玩家列表, 下一页游标)；没有更多数据时游标为None
+def list_players(db, fields=None, after_id=None, limit=100):
+    fields = fields or list(PLAYER_FIELDS)
+    limit = max(1, min(limit, PLAYERS_MAX_LIMIT))
+    rows = db.execute(players_query(fields, after_id).limit(limit + 1)).mappings().all()
+    
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return [player_to_dict(row, fields) for row in rows[:limit]], next_cursor
+
+# 新玩家未设置昵称时的默认昵称
+def default_nickname(qq_id):
+    return f"玩家{str(qq_id)[:4]}"
+
+# 新建玩家，同时创建统计和签到记录（一次flush写入）
+def _new_player(qq_id, steam_id, nickname=None, points=0):
+    player = QQBotPlayers(
+        qq_id=str(qq_id),
+        steam_id=steam_id,
+        nickname=nickname or default_nickname(qq_id),
+        points=points
+    )
+    player.player_stats = PlayerStats()
+    player.daily_signin = DailySignIn()
+    return player
+
+# 插入新玩家及其统计和签到记录，返回玩家ID；忽略冲突的语句未插入时返回None
+def _insert_player(db, statement, values):
+    result = db.execute(statement, values)
+    if not result.rowcount:
+        return None
+    player_id = result.inserted_primary_key[0]
+    db.execute(insert(PlayerStats.__table__).values(player_id=player_id))
+    db.execute(insert(DailySignIn.__table__).values(player_id=player_id))
+    return player_id
+
+# 创建玩家，QQ号已存在时更新；返回 (玩家ID, 是否新建, 原SteamID)
+# 先插入并忽略QQ号冲突，并发绑定同一个QQ号时不会因为“先查询后插入”而写入失败
+def _upsert_player(db, values, updates):
+    table = QQBotPlayers.__table__
+    statement = insert_ignore(table, db.get_bind().dialect.name, index_elements=["qq_id"])
+    if statement is not None:
+        player_id = _insert_player(db, statement, values)
+        if player_id is not None:
+            db.commit()
+            return player_id, True, None
+    
+    row = db.execute(_player_steam_id_by_qq_id, {"qq_id": values["qq_id"]}).first()
+    if row is None:
+        # 数据库不支持忽略冲突，或者是SteamID与其他玩家冲突（MySQL的IGNORE会忽略所有唯一键冲突）：
+        # 直接插入，SteamID冲突时抛出IntegrityError
+        player_id = _insert_player(db, insert(table), values)
+        db.commit()
+        return player_id, True, None
+    
+    db.execute(update(table).where(table.c.id == row.id).values(**updates))
+    db.commit()
+    return row.id, False, row.steam_id
+
+# 绑定或更新绑定，返回 (玩家ID, 是否新建, 原SteamID)
+def bind_player(db, qq_id, steam_id):
+    return _upsert_player(
+        db,
+        {"qq_id": str(qq_id), "steam_id": steam_id, "nickname": default_nickname(qq_id), "points": 0},
+        {"steam_id": steam_id, "last_login": datetime.datetime.utcnow()}
+    )
+
+# 创建或更新玩家信息（API使用），返回 (玩家ID, 是否新建, 原SteamID)
+def upsert_player(db, qq_id, steam_id, nickname=None, points=0, last_login=None):
+    updates = {"steam_id": steam_id, "points": points, "last_login": last_login}
+    if nickname:
+        updates["nickname"] = nickname
+    return _upsert_player(
+        db,
+        {"qq_id": str(qq_id), "steam_id": steam_id, "nickname": nickname or default_nickname(qq_id), "points": points},
+        updates
+    )
@@ -0,0 +1,276 @@
+import asyncio
+import datetime
+import gzip
+import itertools
+import json
+import os
+import threading
+import time
+import zlib
+from nonebot import get_driver
+from sqlalchemy import delete, select
+from settings import get_config
+from utils import logger, startup_timer
+from database import SessionLocal
+from models import CommandLogs, ServerStatus
+from history import raw_rollup_cutoff
+from metrics import RETENTION_ROWS
+
+# 数据保留：定期把过期的命令日志和原始服务器状态归档后从数据库删除
+# 过期的行按时间顺序分批处理，每批在一个短事务中完成“读取 -> 写入归档 -> 按主键删除”，
+# 批之间暂停片刻，不长时间持有锁，也不与正常写入争抢IO
+# 归档为gzip压缩的NDJSON文件（每批一个gzip成员，追加写入并同步到磁盘后才删除对应的行），
+# 进程在写入归档后、删除前退出时，下次运行会再次归档这些行，同一id可能出现两次
+# 归档数据可以通过 iter_archive 或API的 /api/archive/{table} 流式读取
+
+# 获取配置
+config = get_config()
+
+# 归档文件后缀
+ARCHIVE_SUFFIX = ".ndjson.gz"
+
+# 归档文件名中的创建时间格式（UTC）
+ARCHIVE_TIME_FORMAT = "%Y%m%dT%H%M%SZ"
+
+# 命令日志：超过保留天数的记录过期
+def _expired_command_logs(db, now):
+    if config.COMMAND_LOG_RETENTION_DAYS <= 0:
+        return []
+    cutoff = now - datetime.timedelta(days=config.COMMAND_LOG_RETENTION_DAYS)
+    return [[CommandLogs.timestamp < cutoff]]
+
+# 原始服务器状态：超过保留时长的记录过期；启用汇总时只处理已汇总的部分
+def _expired_server_status(db, now):
+    cutoff = now - datetime.timedelta(hours=config.STATUS_RAW_RETENTION_HOURS)
+    partitions = []
+    for server_key in db.execute(select(ServerStatus.server_key).distinct()).scalars().all():
+        server_cutoff = cutoff
+        if config.STATUS_ROLLUP_ENABLED:
+            rolled_up = raw_rollup_cutoff(db, server_key)
+            if rolled_up is None:
+                continue
+            server_cutoff = min(cutoff, rolled_up)
+        partitions.append([ServerStatus.server_key == server_key, ServerStatus.timestamp < server_cutoff])
+    return partitions
+
+# 表名 -> (模型, 过期条件)；过期条件返回分区列表，每个分区为一组WHERE条件
+RETENTION_TABLES = {
+    "command_logs": (CommandLogs, _expired_command_logs),
+    "server_status": (ServerStatus, _expired_server_status)
+}
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+def _archive_dir(table_name):
+    return os.path.join(config.RETENTION_ARCHIVE_DIR, table_name)
+
+# 由归档文件名解析创建时间，不是归档文件时返回None
+def _archive_time(table_name, filename):
+    prefix = f"{table_name}-"
+    if not filename.startswith(prefix) or not filename.endswith(ARCHIVE_SUFFIX):
+        return None
+    try:
+        return datetime.datetime.strptime(filename[len(prefix):-len(ARCHIVE_SUFFIX)], ARCHIVE_TIME_FORMAT)
+    except ValueError:
+        return None
+
+# 归档文件写入：每批数据压缩为一个独立的gzip成员追加到文件末尾
+class ArchiveWriter:
+    def __init__(self, table_name, created_at):
+        self.path = os.path.join(
+            _archive_dir(table_name),
+            f"{table_name}-{created_at.strftime(ARCHIVE_TIME_FORMAT)}{ARCHIVE_SUFFIX}"
+        )
+        self._file = None
+    
+    def write(self, rows):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "ab")
+        data = "".join(json.dumps(dict(row), ensure_ascii=False, default=_json_default) + "\n" for row in rows)
+        self._file.write(gzip.compress(data.encode("utf-8")))
+        # 归档落盘后才能删除数据库中的行
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# 分批归档并删除一个分区的过期行，返回处理的行数
+def _expire_partition(model, conditions, writer, stop_event):
+    table = model.__table__
+    batch_size = max(1, config.RETENTION_BATCH_SIZE)
+    query = select(table).where(*conditions).order_by(model.timestamp, model.id).limit(batch_size)
+    
+    total = 0
+    while not stop_event.is_set():
+        with SessionLocal() as db:
+            rows = db.execute(query).mappings().all()
+            if not rows:
+                break
+            if writer is not None:
+                writer.write(rows)
+            db.execute(delete(table).where(table.c.id.in_([row["id"] for row in rows])))
+            db.commit()
+        
+        total += len(rows)
+        if writer is not None:
+            RETENTION_ROWS.inc(table.name, "archived", amount=len(rows))
+        RETENTION_ROWS.inc(table.name, "deleted", amount=len(rows))
+        if len(rows) < batch_size:
+            break
+        time.sleep(config.RETENTION_BATCH_PAUSE_MS / 1000)
+    return total
+
+# 执行一次数据保留（同步，在线程池中运行），返回 {表名: {"deleted": 行数, "archive": 归档文件或None}}
+def run_retention(now=None, stop_event=None):
+    now = now or datetime.datetime.utcnow()
+    stop_event = stop_event or threading.Event()
+    result = {}
+    for table_name, (model, expired) in RETENTION_TABLES.items():
+        with SessionLocal() as db:
+            partitions = expired(db, now)
+        
+        writer = ArchiveWriter(table_name, now) if config.RETENTION_ARCHIVE_DIR else None
+        deleted = 0
+        try:
+            for conditions in partitions:
+                deleted += _expire_partition(model, conditions, writer, stop_event)
+        finally:
+            if writer is not None:
+                writer.close()
+        
+        result[table_name] = {"deleted": deleted, "archive": writer.path if writer is not None and deleted else None}
+        if deleted:
+            logger.info(f"已清理 {table_name} 表中 {deleted} 条过期记录" + (f"，归档到 {writer.path}" if writer else ""))
+    return result
+
+# 归档文件列表（按创建时间排序）
+def list_archives(table_name):
+    directory = _archive_dir(table_name)
+    if not config.RETENTION_ARCHIVE_DIR or not os.path.isdir(directory):
+        return []
+    archives = []
+    for filename in sorted(os.listdir(directory)):
+        created_at = _archive_time(table_name, filename)
+        if created_at is None:
+            continue
+        path = os.path.join(directory, filename)
+        archives.append({"file": filename, "path": path, "created_at": created_at, "size": os.path.getsize(path)})
+    return archives
+
+def _read_archive(table_name, start, end, filters):
+    for archive in list_archives(table_name):
+        # 归档文件只包含创建时已过期的行，不晚于start创建的文件中没有需要的行
+        if start is not None and archive["created_at"] <= start:
+            continue
+        try:
+            with gzip.open(archive["path"], "rt", encoding="utf-8") as f:
+                for line in f:
+                    row = json.loads(line)
+                    if start is not None or end is not None:
+                        timestamp = datetime.datetime.fromisoformat(row["timestamp"]) if row.get("timestamp") else None
+                        if timestamp is None or (start is not None and timestamp < start) or (end is not None and timestamp >= end):
+                            continue
+                    if any(str(row.get(name)) != value for name, value in filters.items()):
+                        continue
+                    yield row
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            # 写入中断的归档文件末尾可能不完整
+            logger.warning(f"归档文件 {archive['path']} 已损坏或不完整，跳过剩余内容: {str(e)}")
+
+# 流式读取归档数据（逐行解压，不一次性加载），按时间范围（UTC）和字段值过滤
+def iter_archive(table_name, start=None, end=None, limit=None, **filters):
+    if table_name not in RETENTION_TABLES:
+        raise ValueError(f"没有归档的表: {table_name}")
+    columns = RETENTION_TABLES[table_name][0].__table__.columns
+    unknown = [name for name in filters if name not in columns]
+    if unknown:
+        raise ValueError(f"{table_name} 表没有字段: {', '.join(unknown)}")
+    
+    rows = _read_archive(table_name, start, end, {name: str(value) for name, value in filters.items()})
+    return itertools.islice(rows, limit) if limit else rows
+
+# 后台数据保留任务
+class RetentionJob:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(RetentionJob, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.is_running = False
+            self.retention_task = None
+            self.last_run = None
+            self.last_result = {}
+            self.deleted = {}
+            self._stop_event = threading.Event()
+            self._initialized = True
+    
+    async def start(self):
+        if not self.is_running and config.RETENTION_ENABLED:
+            self.is_running = True
+            self._stop_event.clear()
+            self.retention_task = asyncio.create_task(self._retention_loop())
+            logger.info("数据保留任务已启动")
+    
+    async def stop(self):
+        if self.is_running:
+            self.is_running = False
+            # 通知线程池中正在执行的任务在当前批次完成后退出
+            self._stop_event.set()
+            if self.retention_task:
+                self.retention_task.cancel()
+                try:
+                    await self.retention_task
+                except asyncio.CancelledError:
+                    pass
+                self.retention_task = None
+            logger.info("数据保留任务已停止")
+    
+    async def _retention_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.is_running:
+            try:
+                self.last_result = await loop.run_in_executor(None, run_retention, None, self._stop_event)
+                self.last_run = datetime.datetime.utcnow()
+                for table_name, item in self.last_result.items():
+                    self.deleted[table_name] = self.deleted.get(table_name, 0) + item["deleted"]
+            except Exception as e:
+                logger.error(f"数据保留任务出错: {str(e)}")
+            
+            await asyncio.sleep(config.RETENTION_INTERVAL)
+    
+    def get_stats(self):
+        return {
+            "enabled": config.RETENTION_ENABLED,
+            "is_running": self.is_running,
+            "last_run": self.last_run,
+            "last_result": self.last_result,
+            "deleted": dict(self.deleted),
+            "archive_dir": config.RETENTION_ARCHIVE_DIR or None
+        }
+
+# 创建全局数据保留任务实例
+retention_job = RetentionJob()
+
+# 注册驱动事件
+driver = get_driver()
+
+@driver.on_startup
+async def on_startup():
+    with startup_timer.phase("retention"):
+        await retention_job.start()
+
+@driver.on_shutdown
+async def on_shutdown():
+    await retention_job.stop()
@@ -0,0 +1,364 @@
+import asyncio
+import collections
+import datetime
+from nonebot import get_driver
+from sqlalchemy import bindparam, func, select, update
+from settings import get_config
+from utils import logger, startup_timer
+from database import AsyncSessionLocal
+from models import QQBotPlayers, PlayerStats, PlayerSession
+
+# 获取配置
+config = get_config()
+
+# 在线时长统计：比较服务器相邻两次查询的在线玩家列表得到进入/离开事件，
+# 进行中的会话保存在内存中，玩家离开或定期检查点时把经过的时间计入PlayerStats.play_time
+# 每次查询只处理发生变化的玩家，数据库写入量与变化数成正比，与在线人数无关
+#
+# A2S协议只返回玩家的游戏内名称，名称到SteamID的对应关系来自服务器日志中的进入记录（见log_ingest），
+# 没有日志时按玩家昵称精确匹配；对应不上的会话照常记录，但不计入游戏时长
+
+# 启动时加载的名称对应关系数量（取最近的会话）
+BINDING_PRELOAD_LIMIT = 10000
+
+# 进行中的会话
+class OpenSession:
+    __slots__ = ("record_id", "name", "steam_id", "started_at", "checkpoint_at")
+    
+    def __init__(self, record_id, name, steam_id, started_at):
+        self.record_id = record_id
+        self.name = name
+        self.steam_id = steam_id
+        self.started_at = started_at
+        self.checkpoint_at = started_at  # 已计入游戏时长的截止时间
+
+# 计入会话时长（会话表和玩家统计）
+_credit_session = (
+    update(PlayerSession)
+    .where(PlayerSession.id == bindparam("b_id"))
+    .values(
+        steam_id=bindparam("b_steam_id"),
+        credited_seconds=func.coalesce(PlayerSession.credited_seconds, 0) + bindparam("b_seconds"),
+        ended_at=bindparam("b_ended_at")
+    )
+    .execution_options(synchronize_session=False)
+)
+
+_add_play_time = (
+    update(PlayerStats)
+    .where(PlayerStats.player_id == (
+        select(QQBotPlayers.id).where(QQBotPlayers.steam_id == bindparam("b_steam_id")).scalar_subquery()
+    ))
+    .values(
+        play_time=func.coalesce(PlayerStats.play_time, 0) + bindparam("b_hours"),
+        last_update=bindparam("b_now")
+    )
+    .execution_options(synchronize_session=False)
+)
+
+_end_session = (
+    update(PlayerSession)
+    .where(PlayerSession.id == bindparam("b_id"))
+    .values(ended_at=bindparam("b_ended_at"))
+    .execution_options(synchronize_session=False)
+)
+
+# 按玩家昵称查找SteamID（只使用唯一匹配的昵称）
+def resolve_names(db, names):
+    rows = db.execute(
+        select(QQBotPlayers.nickname, QQBotPlayers.steam_id).where(QQBotPlayers.nickname.in_(names))
+    ).all()
+    counts = collections.Counter(row.nickname for row in rows)
+    return {row.nickname: row.steam_id for row in rows if counts[row.nickname] == 1}
+
+# 在一个事务中写入会话变化：关闭/计时已有会话，创建新会话
+# credits: [(会话, 计入秒数)]，closed为True时同时结束这些会话（结束时间为计入的截止时间）；joins: [(名称, steam_id)]
+# 返回 (新会话的记录ID, 更新后的玩家游戏时长[(qq_id, play_time)])
+def write_session_changes(db, server_key, credits, joins, now, closed=True):
+    conn = db.connection()
+    
+    play_time = collections.defaultdict(float)
+    if credits:
+        conn.execute(_credit_session, [{
+            "b_id": session.record_id,
+            "b_steam_id": session.steam_id,
+            "b_seconds": seconds,
+            "b_ended_at": session.checkpoint_at + datetime.timedelta(seconds=seconds) if closed else None
+        } for session, seconds in credits])
+        for session, seconds in credits:
+            if session.steam_id and seconds > 0:
+                play_time[session.steam_id] += seconds
+    
+    if play_time:
+        conn.execute(_add_play_time, [
+            {"b_steam_id": steam_id, "b_hours": seconds / 3600, "b_now": now}
+            for steam_id, seconds in play_time.items()
+        ])
+    
+    record_ids = []
+    if joins:
+        records = [
+            PlayerSession(server_key=server_key, player_name=name, steam_id=steam_id, started_at=now, credited_seconds=0)
+            for name, steam_id in joins
+        ]
+        db.add_all(records)
+        db.flush()
+        record_ids = [record.id for record in records]
+    
+    updated = []
+    if play_time:
+        updated = conn.execute(
+            select(QQBotPlayers.qq_id, PlayerStats.play_time)
+            .join(PlayerStats, PlayerStats.player_id == QQBotPlayers.id)
+            .where(QQBotPlayers.steam_id.in_(list(play_time)))
+        ).all()
+    
+    db.commit()
+    return record_ids, updated
+
+# 在线会话跟踪
+class SessionTracker:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SessionTracker, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self.is_running = False
+            self.checkpoint_task = None
+            self.online = {}  # server_key -> 在线玩家名称计数（同名玩家可能同时在线）
+            self.sessions = {}  # (server_key, 名称) -> [进行中的会话]
+            self.last_seen = {}  # server_key -> 最后一次成功获取玩家列表的时间
+            self.bindings = {}  # 游戏内名称 -> steam_id
+            self._lock = None
+            
+            # 统计信息
+            self.joins = 0
+            self.leaves = 0
+            self.last_checkpoint = None
+            self._initialized = True
+    
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+    
+    async def start(self):
+        if not self.is_running and config.SESSION_TRACKING_ENABLED:
+            await self._recover()
+            self.is_running = True
+            self.checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+            logger.info("在线时长统计已启动")
+    
+    async def stop(self):
+        if self.is_running:
+            self.is_running = False
+            if self.checkpoint_task:
+                self.checkpoint_task.cancel()
+                try:
+                    await self.checkpoint_task
+                except asyncio.CancelledError:
+                    pass
+                self.checkpoint_task = None
+            
+            # 机器人停止后无法再观察到玩家离开，结束所有进行中的会话
+            try:
+                await self.checkpoint(close=True)
+            except Exception as e:
+                logger.error(f"结束在线会话失败: {str(e)}")
+            logger.info("在线时长统计已停止")
+    
+    def bind_name(self, name, steam_id):
+        """记录游戏内名称对应的SteamID（进行中但尚未对应的会话从下次计时开始计入游戏时长）"""
+        self.bindings[name] = steam_id
+        for key, sessions in self.sessions.items():
+            if key[1] == name:
+                for session in sessions:
+                    session.steam_id = session.steam_id or steam_id
+    
+    async def observe(self, server_key, names, now=None):
+        """处理一次在线玩家列表，返回 (进入人数, 离开人数)"""
+        if not self.is_running:
+            return 0, 0
+        now = now or datetime.datetime.utcnow()
+        
+        async with self._get_lock():
+            previous = self.online.get(server_key, collections.Counter())
+            current = collections.Counter(names)
+            joined = current - previous
+            left = previous - current
+            
+            if joined or left:
+                await self._apply(server_key, list(joined.elements()), left, now)
+            self.online[server_key] = current
+            self.last_seen[server_key] = now
+            return sum(joined.values()), sum(left.values())
+    
+    async def close_server(self, server_key):
+        """服务器离线：所有玩家在最后一次看到时离开"""
+        if not self.is_running:
+            return
+        async with self._get_lock():
+            previous = self.online.get(server_key)
+            if previous:
+                await self._apply(server_key, [], previous, self.last_seen.get(server_key) or datetime.datetime.utcnow())
+            self.online[server_key] = collections.Counter()
+    
+    async def checkpoint(self, now=None, close=False):
+        """把所有进行中会话经过的时间计入游戏时长（close为True时同时结束会话）"""
+        now = now or datetime.datetime.utcnow()
+        async with self._get_lock():
+            # 只计到各服务器最后一次看到玩家列表的时间，离线检测前的时间不计入
+            credits = []
+            for (server_key, _), sessions in self.sessions.items():
+                until = min(now, self.last_seen.get(server_key) or now)
+                for session in sessions:
+                    credits.append((session, max(0.0, (until - session.checkpoint_at).total_seconds())))
+            if credits:
+                async with AsyncSessionLocal() as db:
+                    _, updated = await db.run_sync(write_session_changes, None, credits, [], now, closed=close)
+                for session, seconds in credits:
+                    session.checkpoint_at += datetime.timedelta(seconds=seconds)
+                self._publish(updated)
+            if close:
+                self.sessions.clear()
+                self.online.clear()
+            self.last_checkpoint = now
+    
+    async def _apply(self, server_key, joined, left, now):
+        # 离开的玩家：每个名称结束最早开始的会话
+        credits = []
+        for name, count in left.items():
+            for session in self.sessions.get((server_key, name), [])[:count]:
+                credits.append((session, max(0.0, (now - session.checkpoint_at).total_seconds())))
+        
+        unresolved = [name for name in set(joined) if name not in self.bindings]
+        async with AsyncSessionLocal() as db:
+            if unresolved:
+                for name, steam_id in (await db.run_sync(resolve_names, unresolved)).items():
+                    self.bindings[name] = steam_id
+            joins = [(name, self.bindings.get(name)) for name in joined]
+            record_ids, updated = await db.run_sync(write_session_changes, server_key, credits, joins, now)
+        
+        # 写入成功后再更新内存中的会话
+        for name, count in left.items():
+            key = (server_key, name)
+            remaining = self.sessions.get(key, [])[count:]
+            if remaining:
+                self.sessions[key] = remaining
+            else:
+                self.sessions.pop(key, None)
+        for record_id, (name, steam_id) in zip(record_ids, joins):
+            self.sessions.setdefault((server_key, name), []).append(OpenSession(record_id, name, steam_id, now))
+        
+        self.joins += len(joins)
+        self.leaves += sum(left.values())
+        self._publish(updated)
+    
+    def _publish(self, updated):
+        if not updated:
+            return
+        from cache import player_cache
+        from leaderboard import leaderboard
+        for qq_id, play_time in updated:
+            player_cache.invalidate(qq_id=qq_id)
+            leaderboard.update(qq_id, play_time=play_time)
+    
+    async def _recover(self):
+        # 上次异常退出时未结束的会话：按最后一次检查点结束
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(PlayerSession.id, PlayerSession.started_at, PlayerSession.credited_seconds)
+                .where(PlayerSession.ended_at.is_(None))
+            )).all()
+            if rows:
+                conn = await db.connection()
+                await conn.execute(_end_session, [
+                    {
+                        "b_id": row.id,
+                        "b_ended_at": row.started_at + datetime.timedelta(seconds=row.credited_seconds or 0)
+                    }
+                    for row in rows
+                ])
+                await db.commit()
+                logger.info(f"已结束 {len(rows)} 个上次未正常结束的在线会话")
+            
+            # 加载最近会话中的名称对应关系
+            rows = (await db.execute(
+                select(PlayerSession.player_name, PlayerSession.steam_id)
+                .where(PlayerSession.steam_id.is_not(None))
+                .order_by(PlayerSession.id.desc())
+                .limit(BINDING_PRELOAD_LIMIT)
+            )).all()
+        for name, steam_id in reversed(rows):
+            self.bindings[name] = steam_id
+    
+    async def _checkpoint_loop(self):
+        while self.is_running:
+            await asyncio.sleep(config.SESSION_CHECKPOINT_INTERVAL)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                logger.error(f"在线时长检查点出错: {str(e)}")
+    
+    def get_online(self, server_key=None):
+        """进行中的会话"""
+        return [
+            {
+                "server_key": key[0],
+                "name": session.name,
+                "steam_id": session.steam_id,
+                "started_at": str(session.started_at)
+            }
+            for key, sessions in self.sessions.items()
+            if server_key is None or key[0] == server_key
+            for session in sessions
+        ]
+    
+    def get_stats(self):
+        return {
+            "enabled": self.is_running,
+            "open_sessions": sum(len(sessions) for sessions in self.sessions.values()),
+            "joins": self.joins,
+            "leaves": self.leaves,
+            "bindings": len(self.bindings),
+            "last_checkpoint": str(self.last_checkpoint) if self.last_checkpoint else None
+        }
+
+# 创建全局会话跟踪实例
+session_tracker = SessionTracker()
+
+# 按玩家查询会话历史（id倒序，before_id为上一页最后一条会话的id）
+def query_sessions(db, steam_id, before_id=None, limit=50):
+    query = select(PlayerSession).where(PlayerSession.steam_id == steam_id)
+    if before_id is not None:
+        query = query.where(PlayerSession.id < before_id)
+    rows = db.execute(query.order_by(PlayerSession.id.desc()).limit(limit + 1)).scalars().all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return [
+        {
+            "id": row.id,
+            "server_key": row.server_key,
+            "player_name": row.player_name,
+            "started_at": str(row.started_at),
+            "ended_at": str(row.ended_at) if row.ended_at else None,
+            "seconds": round(row.credited_seconds or 0, 1)
+        }
+        for row in rows[:limit]
+    ], next_cursor
+
+# 注册驱动事件
+driver = get_driver()
+
+@driver.on_startup
+async def on_startup():
+    with startup_timer.phase("sessions"):
+        await session_tracker.start()
+
+@driver.on_shutdown
+async def on_shutdown():
+    await session_tracker.stop()
@@ -0,0 +1,141 @@
+import asyncio
+import datetime
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from database import Base
+from models import QQBotPlayers, PlayerStats, DailySignIn
+from repository import sign_in, _new_player, SIGN_IN_OK, SIGN_IN_ALREADY
+from utils import calculate_sign_in_reward
+
+# 签到并发压测：模拟零点大量玩家同时签到（每人重复发送多次），
+# 检查每个玩家当天只签到成功一次、积分只发放一次，并统计吞吐量
+# 支持SQLite（sqlite+aiosqlite）和MySQL兼容数据库（mysql+aiomysql）
+# 压测玩家使用本次运行独有的QQ号，结束后删除，不影响已有数据
+
+async def run_signin_load(database_url, players=1000, attempts=3, pool_size=20):
+    # SQLite同一时间只允许一个写事务，加长等待锁的时间
+    connect_args = {"timeout": 60} if database_url.startswith("sqlite") else {}
+    engine = create_async_engine(
+        database_url,
+        pool_size=pool_size,
+        max_overflow=0,
+        connect_args=connect_args
+    )
+    run_id = random.randint(0, 999999)
+    qq_ids = [f"9{run_id:06d}{i:06d}" for i in range(players)]
+    
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        
+        # 批量创建压测玩家（每个玩家带统计和签到记录）
+        async with AsyncSession(engine) as db:
+            db.add_all([
+                _new_player(qq_id, f"7656{run_id:06d}{i:07d}")
+                for i, qq_id in enumerate(qq_ids)
+            ])
+            await db.commit()
+        
+        # 固定签到时间，保证所有请求落在同一天
+        now = datetime.datetime.utcnow()
+        requests = [qq_id for qq_id in qq_ids for _ in range(attempts)]
+        random.shuffle(requests)
+        
+        async def attempt(qq_id):
+            try:
+                async with AsyncSession(engine, expire_on_commit=False) as db:
+                    result, _ = await db.run_sync(sign_in, qq_id, now)
+                    return qq_id, result
+            except Exception as e:
+                return qq_id, f"error: {type(e).__name__}"
+        
+        started = time.perf_counter()
+        results = await asyncio.gather(*(attempt(qq_id) for qq_id in requests))
+        elapsed = time.perf_counter() - started
+        
+        # 统计结果
+        outcomes = {}
+        successes = {}
+        for qq_id, result in results:
+            outcomes[result] = outcomes.get(result, 0) + 1
+            if result == SIGN_IN_OK:
+                successes[qq_id] = successes.get(qq_id, 0) + 1
+        
+        # 校验数据库中的最终状态
+        reward = calculate_sign_in_reward(1)
+        async with AsyncSession(engine) as db:
+            rows = (await db.execute(
+                select(QQBotPlayers.qq_id, QQBotPlayers.points, DailySignIn.total_days)
+                .join(DailySignIn, DailySignIn.player_id == QQBotPlayers.id)
+                .where(QQBotPlayers.qq_id.in_(qq_ids))
+            )).all()
+        
+        errors = []
+        duplicated = [qq_id for qq_id, count in successes.items() if count > 1]
+        if duplicated:
+            errors.append(f"{len(duplicated)} 名玩家重复签到成功")
+        bad_rows = [row for row in rows if row.points != reward or row.total_days != 1]
+        if bad_rows:
+            errors.append(f"{len(bad_rows)} 名玩家积分或签到天数不正确")
+        failed = sum(count for result, count in outcomes.items() if result.startswith("error"))
+        if failed:
+            errors.append(f"{failed} 个签到请求执行出错")
+        missing = players - len(successes)
+        if missing:
+            errors.append(f"{missing} 名玩家未能签到")
+        
+        return {
+            "database": engine.dialect.name,
+            "players": players,
+            "requests": len(requests),
+            "elapsed": round(elapsed, 3),
+            "requests_per_second": round(len(requests) / elapsed, 1) if elapsed else None,
+            "signed_in": len(successes),
+            "already_signed_in": outcomes.get(SIGN_IN_ALREADY, 0),
+            "outcomes": outcomes,
+            "errors": errors
+        }
+    finally:
+        # 清理压测数据
+        async with AsyncSession(engine) as db:
+            player_ids = select(QQBotPlayers.id).where(QQBotPlayers.qq_id.in_(qq_ids))
+            await db.execute(delete(DailySignIn).where(DailySignIn.player_id.in_(player_ids)))
+            await db.execute(delete(PlayerStats).where(PlayerStats.player_id.in_(player_ids)))
+            await db.execute(delete(QQBotPlayers).where(QQBotPlayers.qq_id.in_(qq_ids)))
+            await db.commit()
+        await engine.dispose()
+
+# 命令行运行：python signin_loadtest.py [数据库地址] [玩家数] [每人请求次数]
+# 未指定数据库地址时使用临时SQLite文件
+if __name__ == "__main__":
+    import sys
+    import json
+    
+    async def _main():
+        if len(sys.argv) > 1 and sys.argv[1]:
+            database_url = sys.argv[1]
+            temp_path = None
+        else:
+            fd, temp_path = tempfile.mkstemp(suffix=".db")
+            os.close(fd)
+            database_url = f"sqlite+aiosqlite:///{temp_path}"
+        
+        try:
+            report = await run_signin_load(
+                database_url,
+                players=int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+                attempts=int(sys.argv[3]) if len(sys.argv) > 3 else 3
+            )
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+        
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if report["errors"]:
+            sys.exit(1)
+    
+    asyncio.run(_main())
@@ -1,35 +1,69 @@
-import nonebot
-from nonebot.adapters.onebot.v11 import Adapter as OneBotAdapter
 from settings import get_config
-from utils import logger
+from utils import logger, startup_timer
 
 # 获取配置
 config = get_config()
 
-# 初始化NoneBot
-nonebot.init(
-    debug=config.DEBUG,
-    superusers=set(config.SUPERUSERS),
-    nickname=config.NICKNAME,
-    command_start=config.COMMAND_START,
-    command_sep=config.COMMAND_SEP
-)
+with startup_timer.phase("nonebot"):
+    import nonebot
+    from nonebot.adapters.onebot.v11 import Adapter as OneBotAdapter
+    
+    # 初始化NoneBot
+    nonebot.init(
+        debug=config.DEBUG,
+        superusers=set(config.SUPERUSERS),
+        nickname=config.NICKNAME,
+        command_start=config.COMMAND_START,
+        command_sep=config.COMMAND_SEP
+    )
+    
+    # 加载OneBot适配器
+    driver = nonebot.get_driver()
+    driver.register_adapter(OneBotAdapter)
 
-# 加载OneBot适配器
-driver = nonebot.get_driver()
-driver.register_adapter(OneBotAdapter)
+# 数据库最先初始化（在线程池中执行，不阻塞事件循环；其他模块的启动流程依赖数据表）
+@driver.on_startup
+async def init_database():
+    from database import init_db_async
+    with startup_timer.phase("database"):
+        try:
+            await init_db_async()
+            logger.info("数据库初始化成功")
+        except Exception as e:
+            logger.error(f"数据库初始化失败: {str(e)}")
 
-# 从api模块注册事件
-from api import register_api_events
-register_api_events(driver)
+with startup_timer.phase("imports"):
+    # API服务（未启用时不导入）：挂载模式需要在NoneBot的服务器启动前完成挂载，
+    # 其他模式推迟到启动事件中再导入api模块（FastAPI应用和各接口），停止由core的关闭事件负责
+    if config.API_ENABLED and config.API_MODE == "mount":
+        from api import register_api_events
+        register_api_events(driver)
+    elif config.API_ENABLED:
+        @driver.on_startup
+        async def start_api():
+            with startup_timer.phase("api"):
+                from api import api_server
+                await api_server.start()
+    
+    # 加载插件
+    nonebot.load_builtin_plugins("echo")  # 加载内置回显插件用于测试
+    
+    # 加载自定义模块
+    import core  # 核心功能
+    import commands  # 命令处理
+    import monitor  # 服务器监控
+    import history  # 服务器状态历史汇总（monitor依赖该模块，总会被导入）
+    
+    # 可选功能只在启用时导入
+    if config.LOG_INGEST_ENABLED:
+        import log_ingest  # 服务器日志采集
+    if config.RETENTION_ENABLED:
+        import retention  # 过期数据归档与清理
 
-# 加载插件
-nonebot.load_builtin_plugins("echo")  # 加载内置回显插件用于测试
-
-# 加载自定义模块
-import core  # 核心功能
-import commands  # 命令处理
-import monitor  # 服务器监控
+# 所有模块的启动流程完成后报告各阶段耗时
+@driver.on_startup
+async def report_startup():
+    startup_timer.mark_ready()
 
 # 启动机器人
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+# 测试使用临时SQLite文件和本地模拟服务，不连接真实的数据库、游戏服务器和OneBot
+# 项目模块在导入时读取配置，环境变量必须在导入项目模块之前设置
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+TEST_DIR = tempfile.mkdtemp(prefix="unturned-bot-test-")
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}",
+    "ASYNC_DATABASE_URL": "",
+    "LOG_TO_FILE": "False",
+    "LOG_LEVEL": "WARNING",
+    "API_KEY": "",
+    "MONITOR_ENABLED": "False",
+    "NOTIFY_STATUS_CHANGE": "False",
+    "SESSION_TRACKING_ENABLED": "False",
+    "LOG_INGEST_ENABLED": "False",
+    "RETENTION_ENABLED": "False",
+    "RETENTION_ARCHIVE_DIR": os.path.join(TEST_DIR, "archive"),
+    "COMMAND_SLOW_LOG_FILE": "",
+    "COMMAND_PROFILE_SAMPLE_RATE": "0"
+})
+
+import nonebot
+import pytest
+
+# 多个模块在导入时注册驱动事件，需要先初始化NoneBot
+nonebot.init()
+
+@pytest.fixture(scope="session")
+def db():
+    from database import init_db
+    init_db()
+    return os.environ["DATABASE_URL"]
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from a2s import (
+    A2SConnection, A2SError, A2SStandInServer, SPLIT_PACKET, _HEADER,
+    query_info, query_players, query_rules, query_server
+)
+
+PLAYERS = [f"Survivor{i}" for i in range(20)]
+RULES = {f"rule_{i}": f"value_{i}" * 4 for i in range(40)}
+
+async def _with_stand_in(stand_in, func):
+    port = await stand_in.start()
+    try:
+        return await func(port)
+    finally:
+        stand_in.close()
+
+def _query_all(**kwargs):
+    async def run(port):
+        return (
+            await query_info("127.0.0.1", port, timeout=2),
+            await query_players("127.0.0.1", port, timeout=2),
+            await query_rules("127.0.0.1", port, timeout=2)
+        )
+    
+    stand_in = A2SStandInServer(info={"name": "测试服", "map": "Russia"}, players=PLAYERS, rules=RULES, **kwargs)
+    return asyncio.run(_with_stand_in(stand_in, run))
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"challenge": None},
+    {"split_size": 128},
+    {"split_size": 128, "compress": True}
+], ids=["single", "no_challenge", "split", "split_bz2"])
+def test_query_info_players_rules(kwargs):
+    info, players, rules = _query_all(**kwargs)
+    assert info["name"] == "测试服"
+    assert info["map"] == "Russia"
+    assert info["players"] == len(PLAYERS)
+    assert info["max_players"] == 24
+    assert info["port"] == 27015
+    assert [player["name"] for player in players] == PLAYERS
+    assert rules == RULES
+
+def test_query_server_uses_one_connection():
+    stand_in = A2SStandInServer(players=PLAYERS, split_size=128, compress=True)
+    
+    async def run(port):
+        return await query_server("127.0.0.1", port, timeout=2)
+    
+    info, players = asyncio.run(_with_stand_in(stand_in, run))
+    assert info["players"] == len(PLAYERS)
+    assert len(players) == len(PLAYERS)
+    # 基础信息和玩家列表各需要一次挑战码
+    assert stand_in.requests == 4
+
+# 返回固定内容的模拟服务器（用于验证格式错误的响应）
+class RawServer(A2SStandInServer):
+    def __init__(self, response):
+        super().__init__(challenge=None)
+        self.response = response
+    
+    def datagram_received(self, data, addr):
+        self.transport.sendto(self.response, addr)
+
+@pytest.mark.parametrize("response", [
+    b"\xff\xff",
+    _HEADER.pack(SPLIT_PACKET) + b"\x01\x00",
+    _HEADER.pack(-1),
+    _HEADER.pack(-1) + b"\x49\x11Name\x00Map"
+], ids=["short_header", "short_split_header", "empty_payload", "truncated_info"])
+def test_malformed_response_raises_a2s_error(response):
+    async def run(port):
+        async with A2SConnection("127.0.0.1", port) as connection:
+            return await asyncio.wait_for(connection.info(), 2)
+    
+    with pytest.raises(A2SError):
+        asyncio.run(_with_stand_in(RawServer(response), run))
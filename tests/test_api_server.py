@@ -0,0 +1,43 @@
+import asyncio
+import httpx
+import database
+from settings import get_config
+from api import APIServer, API_MODE_THREAD
+
+def test_thread_mode_disposes_its_async_engine(db, monkeypatch):
+    monkeypatch.setattr(get_config(), "API_PORT", 0)
+    api_server = object.__new__(APIServer)
+    api_server.__init__()
+    api_server.mode = API_MODE_THREAD
+    before = set(database._async_engines)
+    
+    async def run():
+        await api_server.start()
+        while not api_server.server.started:
+            await asyncio.sleep(0.01)
+        port = api_server.server.servers[0].sockets[0].getsockname()[1]
+        
+        # 查询玩家列表会在API线程的事件循环中创建异步引擎
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"http://127.0.0.1:{port}/api/players")
+        assert response.status_code == 200
+        created = set(database._async_engines) - before
+        
+        await api_server.stop()
+        return created
+    
+    created = asyncio.run(run())
+    assert created
+    assert not created & set(database._async_engines)
+    assert api_server.server_thread is None
+
+def test_engines_of_closed_loops_are_pruned(db):
+    async def engine_loop():
+        database.get_async_engine()
+        return asyncio.get_running_loop()
+    
+    first = asyncio.run(engine_loop())
+    assert first in database._async_engines
+    second = asyncio.run(engine_loop())
+    assert first not in database._async_engines
+    assert second in database._async_engines
@@ -0,0 +1,21 @@
+import datetime
+import sys
+import history
+from settings import get_config
+
+def test_max_status_gap_reads_intervals_from_config(monkeypatch):
+    config = get_config()
+    monkeypatch.setattr(config, "MONITOR_INTERVAL", 60)
+    monkeypatch.setattr(config, "STATUS_HEARTBEAT_INTERVAL", 600)
+    monkeypatch.setattr(config, "MONITOR_SERVERS", [
+        {"key": "pve", "interval": 300},
+        {"key": "pvp"},  # 使用默认间隔
+        {"key": "bad", "interval": "abc"},  # 无效配置忽略
+        {"key": "zero", "interval": 0}
+    ])
+    assert history.max_status_gap() == datetime.timedelta(seconds=2 * (600 + 300))
+
+def test_max_status_gap_does_not_import_monitor(monkeypatch):
+    # 汇总在线程池中运行，不能依赖导入时调用get_driver()的monitor模块
+    monkeypatch.setitem(sys.modules, "monitor", None)
+    assert history.max_status_gap() > datetime.timedelta(0)
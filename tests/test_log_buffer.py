@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import pytest
+import log_buffer
+from log_buffer import CommandLogBuffer, make_log_entry
+
+@pytest.fixture
+def writes(monkeypatch):
+    calls = []
+    
+    def write_rows(rows):
+        calls.append((threading.current_thread(), len(rows)))
+    
+    monkeypatch.setattr(log_buffer, "_write_rows", write_rows)
+    return calls
+
+# 新建缓冲区实例（不使用全局单例）
+def _new_buffer():
+    buffer = object.__new__(CommandLogBuffer)
+    buffer.__init__()
+    return buffer
+
+def _entry(i):
+    return make_log_entry(10000 + i, 123456789, "test", "", True, "ok")
+
+def test_append_without_task_writes_in_executor(writes):
+    buffer = _new_buffer()
+    
+    async def run():
+        for i in range(5):
+            buffer.append(_entry(i))
+        # 事件循环中不同步写入数据库
+        assert all(thread is not threading.current_thread() for thread, _ in writes)
+        while buffer._background_flush is not None:
+            await asyncio.sleep(0.01)
+    
+    asyncio.run(run())
+    assert sum(count for _, count in writes) == 5
+    assert all(thread is not threading.main_thread() for thread, _ in writes)
+    assert buffer.flushed == 5
+    assert not buffer._entries
+
+def test_append_outside_event_loop_writes_directly(writes):
+    buffer = _new_buffer()
+    buffer.append(_entry(0))
+    assert writes == [(threading.current_thread(), 1)]
+
+def test_flush_before_start(writes):
+    buffer = _new_buffer()
+    buffer._entries.extend(_entry(i) for i in range(3))
+    asyncio.run(buffer.flush())
+    assert writes and writes[0][1] == 3
+
+def test_failed_background_flush_requeues(monkeypatch):
+    def write_rows(rows):
+        raise RuntimeError("database is locked")
+    
+    monkeypatch.setattr(log_buffer, "_write_rows", write_rows)
+    buffer = _new_buffer()
+    
+    async def run():
+        buffer.append(_entry(0))
+        while buffer._background_flush is not None:
+            await asyncio.sleep(0.01)
+    
+    asyncio.run(run())
+    assert len(buffer._entries) == 1
+    assert buffer.failed_flushes == 1
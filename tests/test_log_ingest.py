@@ -0,0 +1,57 @@
+import os
+from sqlalchemy import select
+from database import SessionLocal
+from models import QQBotPlayers, PlayerStats
+from log_ingest import FINGERPRINT_BYTES, LogIngestor
+
+STEAM_ID = "76561190000000001"
+
+def _zombie_kill(note):
+    return f"[{note}] {STEAM_ID} killed a zombie\n".encode()
+
+# 新建采集实例（模拟重启，不使用全局单例）
+def _new_ingestor(path):
+    ingestor = object.__new__(LogIngestor)
+    ingestor.__init__()
+    ingestor.path = path
+    return ingestor
+
+def _zombies_killed():
+    with SessionLocal() as db:
+        return db.execute(
+            select(PlayerStats.zombies_killed)
+            .join(QQBotPlayers, PlayerStats.player_id == QQBotPlayers.id)
+            .where(QQBotPlayers.steam_id == STEAM_ID)
+        ).scalar()
+
+def test_truncate_then_restart_does_not_double_count(db, tmp_path):
+    with SessionLocal() as session:
+        session.add(QQBotPlayers(qq_id="7000000001", steam_id=STEAM_ID, nickname="Ingest"))
+        session.commit()
+    
+    # 截断前的文件超过摘要长度（FINGERPRINT_BYTES），摘要不会在每轮读取时重新计算
+    path = str(tmp_path / "server.log")
+    with open(path, "wb") as f:
+        f.write(b"Loading level...\n" * (FINGERPRINT_BYTES // 16))
+        f.write(_zombie_kill("before"))
+    
+    ingestor = _new_ingestor(path)
+    ingestor.poll()
+    assert _zombies_killed() == 1
+    
+    # 原地截断后写入新内容（比截断前短）
+    with open(path, "r+b") as f:
+        f.truncate(0)
+        f.write(_zombie_kill("after"))
+    ingestor.poll()
+    assert ingestor.rotations == 1
+    assert _zombies_killed() == 2
+    
+    # 重启后从记录的位置继续，不重复读取截断后的内容
+    ingestor._close()
+    restarted = _new_ingestor(path)
+    updated, _, _ = restarted.poll()
+    assert updated == []
+    assert restarted._offset == os.path.getsize(path)
+    assert _zombies_killed() == 2
+    restarted._close()
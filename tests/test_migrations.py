@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy import text
+from database import engine, init_db
+from migrations import assert_query_plans, get_migration_status
+
+def test_init_db_applies_migrations(db):
+    # 再次初始化时结构版本一致，不会重复执行迁移
+    init_db()
+    assert all(item["applied_at"] is not None for item in get_migration_status())
+
+def test_hot_queries_use_indexes(db):
+    assert_query_plans()
+
+def test_missing_index_fails_plan_check(db):
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_command_logs_user_id_timestamp"))
+    # 连接池中的SQLite连接会沿用已缓存的EXPLAIN语句，结构变化后重新建立连接
+    engine.dispose()
+    try:
+        with pytest.raises(AssertionError, match="ix_command_logs_user_id_timestamp"):
+            assert_query_plans()
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX ix_command_logs_user_id_timestamp ON command_logs (user_id, timestamp)"
+            ))
+        engine.dispose()
+    assert_query_plans()
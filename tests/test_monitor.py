@@ -0,0 +1,34 @@
+import asyncio
+from a2s import A2SStandInServer
+from cache import response_cache
+from monitor import MonitoredServer, server_monitor
+
+def test_response_cache_invalidated_only_on_status_change(db):
+    stand_in = A2SStandInServer(players=["Survivor0", "Survivor1"])
+    
+    async def run():
+        port = await stand_in.start()
+        server = MonitoredServer("cache-test", "Cache Test", "127.0.0.1", port, port)
+        try:
+            generations = [response_cache.generation]
+            
+            async def check():
+                await server_monitor._check_server_status(server)
+                generations.append(response_cache.generation)
+            
+            await check()  # 首次检查
+            await check()  # 状态未变化
+            stand_in.player_list = ["Survivor2", "Survivor3"]
+            await check()  # 只有玩家名称变化
+            stand_in.info["map"] = "Russia"
+            await check()  # 地图变化
+            stand_in.close()
+            await check()  # 离线
+            return generations
+        finally:
+            stand_in.close()
+            server_monitor.statuses.pop(server.key, None)
+            server_monitor.last_saved.pop(server.key, None)
+    
+    generations = asyncio.run(run())
+    assert [b - a for a, b in zip(generations, generations[1:])] == [1, 0, 0, 1, 1]
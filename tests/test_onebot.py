@@ -0,0 +1,81 @@
+import asyncio
+import time
+import pytest
+from settings import get_config
+from utils import OneBotError, onebot_client
+from onebot_stub import OneBotStubServer
+
+@pytest.fixture
+def fast_retry(monkeypatch):
+    config = get_config()
+    monkeypatch.setattr(config, "RETRY_INTERVAL", 0.05)
+    monkeypatch.setattr(config, "MAX_RETRY_TIMES", 3)
+    return config
+
+# 启动模拟服务后执行func(url)，结束时关闭客户端（连接池绑定在本次的事件循环上）
+def _run(stub, func):
+    async def run():
+        port = await stub.start()
+        try:
+            return await func(f"http://127.0.0.1:{port}/send_group_msg")
+        finally:
+            await onebot_client.close()
+            await stub.close()
+    
+    return asyncio.run(run())
+
+def test_request_retries_with_backoff(fast_retry):
+    stub = OneBotStubServer(fail_times=2)
+    started = time.monotonic()
+    result = _run(stub, lambda url: onebot_client.request(url, method="POST", data={"message": "hi"}))
+    
+    assert result["status"] == "ok"
+    assert len(stub.requests) == 3
+    assert stub.requests[-1]["data"] == {"message": "hi"}
+    # 两次退避：0.05s + 0.1s
+    assert time.monotonic() - started >= 0.15
+    # 重试复用同一个keep-alive连接
+    assert stub.connections == 1
+
+def test_request_gives_up_after_max_retries(fast_retry):
+    stub = OneBotStubServer(fail_times=10)
+    assert _run(stub, lambda url: onebot_client.request(url, method="POST")) is None
+    assert len(stub.requests) == fast_retry.MAX_RETRY_TIMES + 1
+
+def test_request_does_not_retry_client_errors(fast_retry):
+    stub = OneBotStubServer(fail_times=10, fail_status=404)
+    assert _run(stub, lambda url: onebot_client.request(url, method="POST")) is None
+    assert len(stub.requests) == 1
+
+def test_request_stops_before_backoff_exceeds_deadline(fast_retry, monkeypatch):
+    monkeypatch.setattr(fast_retry, "RETRY_INTERVAL", 1.0)
+    stub = OneBotStubServer(fail_times=10)
+    started = time.monotonic()
+    assert _run(stub, lambda url: onebot_client.request(url, method="POST", deadline=0.5)) is None
+    assert len(stub.requests) == 1
+    assert time.monotonic() - started < 0.5
+
+def test_request_times_out_at_deadline(fast_retry):
+    stub = OneBotStubServer(delay=2.0)
+    started = time.monotonic()
+    assert _run(stub, lambda url: onebot_client.request(url, method="POST", deadline=0.3)) is None
+    assert time.monotonic() - started < 1.0
+
+def test_call_returns_data():
+    stub = OneBotStubServer()
+    assert _run(stub, lambda url: onebot_client.call(url, {"message": "hi"})) == {"message_id": 1}
+
+def test_call_raises_on_failed_status():
+    # HTTP 200，但动作执行失败（如被禁言），不应重试
+    stub = OneBotStubServer(fail_times=1, fail_status=200)
+    with pytest.raises(OneBotError) as excinfo:
+        _run(stub, lambda url: onebot_client.call(url, {"message": "hi"}))
+    assert excinfo.value.retcode == 100
+    assert not excinfo.value.transient
+
+def test_call_marks_server_errors_transient():
+    stub = OneBotStubServer(fail_times=1, fail_status=503)
+    with pytest.raises(OneBotError) as excinfo:
+        _run(stub, lambda url: onebot_client.call(url))
+    assert excinfo.value.transient
+    assert len(stub.requests) == 1
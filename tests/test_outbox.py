@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import pytest
+import outbox as outbox_module
+from settings import get_config
+from utils import OneBotError
+from outbox import Outbox, PRIORITY_ALERT
+from monitor import MonitoredServer, render_status_change
+from metrics import OUTBOX_DEPTH, OUTBOX_SEND_LATENCY
+
+@pytest.fixture
+def sent(monkeypatch):
+    config = get_config()
+    monkeypatch.setattr(config, "OUTBOX_MERGE_WINDOW", 0.0)
+    monkeypatch.setattr(config, "OUTBOX_GROUP_INTERVAL", 0.0)
+    monkeypatch.setattr(config, "OUTBOX_RATE", 100.0)
+    monkeypatch.setattr(config, "OUTBOX_BURST", 100)
+    monkeypatch.setattr(config, "OUTBOX_RETRY_BASE", 0.4)
+    
+    messages = []
+    
+    async def send_group_message(group_id, message):
+        messages.append((group_id, message))
+    
+    monkeypatch.setattr(outbox_module, "send_group_message", send_group_message)
+    return messages
+
+# 新建队列实例（不使用全局单例，按当前配置初始化）
+def _new_outbox():
+    box = object.__new__(Outbox)
+    box.__init__()
+    return box
+
+def test_status_flaps_are_summarized_after_coalesce_window(sent):
+    server = MonitoredServer("pve", "PVE服", "127.0.0.1", 27015, 27016)
+    
+    async def run():
+        box = _new_outbox()
+        await box.start()
+        
+        def post(is_online):
+            box.post(
+                "1001",
+                {"is_online": is_online, "max_players": 24, "message": "服务器查询超时"},
+                priority=PRIORITY_ALERT,
+                coalesce_key="status:pve",
+                render=functools.partial(render_status_change, server),
+                coalesce_window=0.5
+            )
+        
+        # 第一条变化立即发出
+        post(False)
+        await asyncio.sleep(0.1)
+        assert len(sent) == 1
+        
+        # 窗口内的后续变化等待窗口结束，合并为一条摘要
+        for is_online in (True, False, True):
+            post(is_online)
+            await asyncio.sleep(0.05)
+        assert len(sent) == 1
+        await asyncio.sleep(0.5)
+        await box.stop()
+    
+    asyncio.run(run())
+    assert len(sent) == 2
+    assert "PVE服 已离线" in sent[0][1]
+    assert "上线 x2，离线 x1" in sent[1][1]
+    assert "当前状态: 🟢 运行正常" in sent[1][1]
+    assert OUTBOX_SEND_LATENCY.collect()[("alert",)][-1] > 0
+
+def test_retry_is_not_merged_before_backoff(sent, monkeypatch):
+    failures = [OneBotError("HTTP 503", transient=True)]
+    
+    async def send_group_message(group_id, message):
+        sent.append((group_id, message))
+        if failures:
+            raise failures.pop()
+    
+    monkeypatch.setattr(outbox_module, "send_group_message", send_group_message)
+    
+    async def run():
+        box = _new_outbox()
+        await box.start()
+        box.post("1001", "first")
+        await asyncio.sleep(0.05)
+        # 第一条在退避中，同群的新消息单独发出，不把第一条提前带出
+        box.post("1001", "second")
+        await asyncio.sleep(1.0)
+        await box.stop()
+        return box
+    
+    box = asyncio.run(run())
+    assert [message for _, message in sent] == ["first", "second", "first"]
+    assert box.retried == 1
+    assert box.merged == 0
+
+def test_outbox_depth_gauge():
+    assert set(OUTBOX_DEPTH.collect()) == {("alert",), ("notice",), ("broadcast",)}
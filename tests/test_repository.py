@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from database import AsyncSessionLocal, SessionLocal, assert_max_queries
+from models import QQBotPlayers, PlayerStats, DailySignIn
+from repository import bind_player, upsert_player
+from cache import player_cache
+from commands import bind_handler, me_handler, sign_handler
+
+# 处理器单次执行的SQL条数上限（SQLite，支持UPDATE ... RETURNING）
+# /me 缓存命中不查询数据库，未命中一次查询取回玩家、统计和签到记录；
+# /sign 缓存未命中时一次查询玩家资料，签到和发放积分各一条带RETURNING的UPDATE；
+# /bind 新玩家为忽略QQ号冲突的INSERT加上统计、签到记录各一条INSERT，
+# 已绑定的玩家为一条被忽略的INSERT、一次查询原SteamID和一条UPDATE
+QUERY_BUDGETS = {
+    "me_cached": 0,
+    "me_uncached": 1,
+    "sign": 3,
+    "bind": 3,
+    "rebind": 3
+}
+
+# 模拟OneBot机器人（只记录发送的消息）
+class StubBot:
+    self_id = "10000"
+    
+    def __init__(self):
+        self.messages = []
+    
+    async def send(self, event, message, **kwargs):
+        self.messages.append(str(message))
+        return {"message_id": len(self.messages)}
+
+# 模拟群消息事件
+class StubEvent:
+    def __init__(self, user_id, group_id=123456789):
+        self.user_id = user_id
+        self.group_id = group_id
+
+def _players(qq_id):
+    with SessionLocal() as db:
+        return db.execute(
+            select(QQBotPlayers.id, QQBotPlayers.steam_id, PlayerStats.id, DailySignIn.id)
+            .outerjoin(PlayerStats, PlayerStats.player_id == QQBotPlayers.id)
+            .outerjoin(DailySignIn, DailySignIn.player_id == QQBotPlayers.id)
+            .where(QQBotPlayers.qq_id == str(qq_id))
+        ).all()
+
+def test_bind_player_creates_then_updates(db):
+    with SessionLocal() as session:
+        player_id, created, old_steam_id = bind_player(session, 6000000001, "76561198000000001")
+    assert created and old_steam_id is None
+    
+    with SessionLocal() as session:
+        assert bind_player(session, 6000000001, "76561198000000002") == (player_id, False, "76561198000000001")
+    
+    rows = _players(6000000001)
+    assert len(rows) == 1
+    assert rows[0][1] == "76561198000000002"
+    assert rows[0][2] is not None and rows[0][3] is not None
+
+def test_upsert_player_keeps_nickname_when_not_given(db):
+    with SessionLocal() as session:
+        player_id, created, _ = upsert_player(session, 6000000002, "76561198000000003", nickname="老玩家", points=10)
+    assert created
+    with SessionLocal() as session:
+        assert upsert_player(session, 6000000002, "76561198000000003", points=20)[:2] == (player_id, False)
+        player = session.get(QQBotPlayers, player_id)
+        assert (player.nickname, player.points) == ("老玩家", 20)
+
+def test_bind_player_rejects_steam_id_of_other_player(db):
+    with SessionLocal() as session:
+        bind_player(session, 6000000003, "76561198000000004")
+    with SessionLocal() as session:
+        with pytest.raises(IntegrityError):
+            bind_player(session, 6000000004, "76561198000000004")
+    assert _players(6000000004) == []
+
+def test_handler_query_budgets(db):
+    bot = StubBot()
+    
+    async def run():
+        player_cache.clear()
+        with assert_max_queries(QUERY_BUDGETS["bind"]):
+            await bind_handler(StubEvent(6000000010), bot, "76561198000000010")
+        with assert_max_queries(QUERY_BUDGETS["rebind"]):
+            await bind_handler(StubEvent(6000000010), bot, "76561198000000011")
+        
+        player_cache.clear()
+        with assert_max_queries(QUERY_BUDGETS["me_uncached"]):
+            await me_handler(StubEvent(6000000010), bot)
+        with assert_max_queries(QUERY_BUDGETS["me_cached"]):
+            await me_handler(StubEvent(6000000010), bot)
+        
+        player_cache.clear()
+        with assert_max_queries(QUERY_BUDGETS["sign"]):
+            await sign_handler(StubEvent(6000000010), bot)
+    
+    asyncio.run(run())
+    assert "账号绑定成功" in bot.messages[0]
+    assert "账号绑定已更新" in bot.messages[1]
+    assert "签到成功" in bot.messages[-1]
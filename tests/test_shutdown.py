@@ -0,0 +1,30 @@
+import asyncio
+import core
+import database
+from nonebot import get_driver
+from settings import get_config
+from sessions import session_tracker
+
+def test_session_tracker_stops_before_engine_dispose(monkeypatch):
+    monkeypatch.setattr(get_config(), "API_ENABLED", False)
+    calls = []
+    
+    async def stop():
+        calls.append("sessions")
+    
+    async def dispose_async_engine():
+        calls.append("dispose")
+    
+    monkeypatch.setattr(session_tracker, "stop", stop)
+    monkeypatch.setattr(database, "dispose_async_engine", dispose_async_engine)
+    
+    # 按NoneBot的顺序（注册的逆序）执行core及之前注册的关闭事件
+    hooks = get_driver()._lifespan._shutdown_funcs
+    core_index = hooks.index(core.on_shutdown)
+    
+    async def run():
+        for hook in reversed(hooks[:core_index + 1]):
+            await hook()
+    
+    asyncio.run(run())
+    assert calls[:2] == ["sessions", "dispose"]
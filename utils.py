@@ -1,7 +1,11 @@
+import asyncio
 import logging
 import datetime
-import requests
+import re
+import time
+from contextlib import contextmanager
 from settings import get_config
+from metrics import ONEBOT_SEND_DURATION, ONEBOT_SEND_FAILURES
 
 # 配置日志
 def setup_logger():
@@ -40,10 +44,164 @@ def setup_logger():
 # 获取日志记录器
 logger = setup_logger()
 
+# 启动耗时统计（从导入本模块开始计时，按阶段记录）
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.ready_at = None
+    
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+    
+    def mark_ready(self):
+        """启动流程全部完成（只记录第一次）"""
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter()
+            phases = "，".join(f"{name} {elapsed * 1000:.0f}ms" for name, elapsed in self.phases)
+            logger.info(f"启动完成，共耗时 {(self.ready_at - self.started) * 1000:.0f}ms（{phases}）")
+    
+    def get_stats(self):
+        return {
+            "total_ms": round((self.ready_at - self.started) * 1000, 1) if self.ready_at else None,
+            "phases": [{"name": name, "ms": round(elapsed * 1000, 1)} for name, elapsed in self.phases]
+        }
+
+# 全局启动耗时统计
+startup_timer = StartupTimer()
+
+# OneBot请求失败（transient表示网络错误、超时、5xx等可重试的临时故障）
+class OneBotError(Exception):
+    def __init__(self, message, transient=False, retcode=None):
+        super().__init__(message)
+        self.transient = transient
+        self.retcode = retcode
+
+# OneBot HTTP客户端（复用keep-alive连接池，异步退避重试；httpx在首次请求时才导入，缩短启动时间）
+class OneBotClient:
+    _instance = None
+    _initialized = False
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(OneBotClient, cls).__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if not self._initialized:
+            self._client = None
+            self._initialized = True
+    
+    def _get_client(self):
+        # 延迟创建，保证连接池绑定在当前事件循环上
+        if self._client is None or self._client.is_closed:
+            import httpx
+            config = get_config()
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config.ONE_BOT_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.ONE_BOT_MAX_CONNECTIONS,
+                    keepalive_expiry=config.ONE_BOT_KEEPALIVE_EXPIRY
+                ),
+                timeout=config.SERVER_TIMEOUT
+            )
+        return self._client
+    
+    async def request(self, url, method="GET", data=None, headers=None, deadline=None):
+        """发送请求，所有重试的总耗时不超过deadline秒，失败返回None"""
+        import httpx
+        config = get_config()
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + (deadline or config.ONE_BOT_REQUEST_DEADLINE)
+        method = method.upper()
+        
+        if method not in ("GET", "POST", "PUT", "DELETE"):
+            logger.error(f"不支持的请求方法: {method}")
+            return None
+        
+        retry_count = 0
+        while True:
+            remaining = expires_at - loop.time()
+            if remaining <= 0:
+                logger.error("请求超过截止时间，放弃重试")
+                return None
+            
+            try:
+                response = await self._get_client().request(
+                    method,
+                    url,
+                    params=data if method == "GET" else None,
+                    json=data if method in ("POST", "PUT") else None,
+                    headers=headers,
+                    timeout=min(config.SERVER_TIMEOUT, remaining)
+                )
+                response.raise_for_status()  # 抛出HTTP错误
+                return response.json()
+            except httpx.HTTPStatusError as e:
+                # 4xx属于请求本身的问题，重试没有意义
+                if e.response.status_code < 500:
+                    logger.error(f"API请求失败: {str(e)}")
+                    return None
+                error = e
+            except (httpx.HTTPError, ValueError) as e:
+                error = e
+            
+            retry_count += 1
+            logger.error(f"API请求失败 (尝试 {retry_count}/{config.MAX_RETRY_TIMES}): {str(error)}")
+            if retry_count > config.MAX_RETRY_TIMES:
+                logger.error("达到最大重试次数，请求失败")
+                return None
+            
+            # 指数退避，不阻塞事件循环；等待后已超过截止时间则不再重试
+            delay = config.RETRY_INTERVAL * (2 ** (retry_count - 1))
+            if loop.time() + delay >= expires_at:
+                logger.error("请求即将超过截止时间，放弃重试")
+                return None
+            logger.info(f"{delay:.1f}秒后重试...")
+            await asyncio.sleep(delay)
+    
+    async def call(self, url, data=None, headers=None, timeout=None):
+        """发送一次POST请求（不重试），失败抛出OneBotError，由调用方决定是否重试"""
+        import httpx
+        config = get_config()
+        try:
+            response = await self._get_client().post(
+                url,
+                json=data,
+                headers=headers,
+                timeout=timeout or config.SERVER_TIMEOUT
+            )
+            response.raise_for_status()
+            result = response.json()
+        except httpx.HTTPStatusError as e:
+            raise OneBotError(f"HTTP {e.response.status_code}", transient=e.response.status_code >= 500)
+        except (httpx.HTTPError, ValueError) as e:
+            raise OneBotError(str(e) or type(e).__name__, transient=True)
+        
+        # OneBot返回status为failed表示动作执行失败（如被禁言、群不存在），重试没有意义
+        if result.get("status") not in ("ok", "async"):
+            raise OneBotError(
+                result.get("wording") or result.get("msg") or f"retcode {result.get('retcode')}",
+                retcode=result.get("retcode")
+            )
+        return result.get("data")
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# 全局OneBot客户端
+onebot_client = OneBotClient()
+
 # 发送API请求
-def send_api_request(url, method="GET", data=None, headers=None):
+async def send_api_request(url, method="GET", data=None, headers=None, deadline=None):
     config = get_config()
-    retry_count = 0
     
     # 如果没有提供headers，使用默认headers
     if headers is None:
@@ -51,33 +209,7 @@ def send_api_request(url, method="GET", data=None, headers=None):
         if config.API_KEY:
             headers["Authorization"] = f"Bearer {config.API_KEY}"
     
-    while retry_count <= config.MAX_RETRY_TIMES:
-        try:
-            if method.upper() == "GET":
-                response = requests.get(url, params=data, headers=headers, timeout=config.SERVER_TIMEOUT)
-            elif method.upper() == "POST":
-                response = requests.post(url, json=data, headers=headers, timeout=config.SERVER_TIMEOUT)
-            elif method.upper() == "PUT":
-                response = requests.put(url, json=data, headers=headers, timeout=config.SERVER_TIMEOUT)
-            elif method.upper() == "DELETE":
-                response = requests.delete(url, headers=headers, timeout=config.SERVER_TIMEOUT)
-            else:
-                logger.error(f"不支持的请求方法: {method}")
-                return None
-            
-            response.raise_for_status()  # 抛出HTTP错误
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            retry_count += 1
-            logger.error(f"API请求失败 (尝试 {retry_count}/{config.MAX_RETRY_TIMES}): {str(e)}")
-            
-            if retry_count <= config.MAX_RETRY_TIMES:
-                logger.info(f"{config.RETRY_INTERVAL}秒后重试...")
-                import time
-                time.sleep(config.RETRY_INTERVAL)
-            else:
-                logger.error("达到最大重试次数，请求失败")
-                return None
+    return await onebot_client.request(url, method=method, data=data, headers=headers, deadline=deadline)
 
 # 格式化时间
 def format_time(dt):
@@ -94,6 +226,13 @@ def is_superuser(user_id):
 def get_current_timestamp():
     return datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
+# SteamID64格式：17位数字，个人账号以7656119开头
+STEAM_ID_PATTERN = re.compile(r"7656119\d{10}")
+
+# 检查SteamID格式
+def is_valid_steam_id(steam_id):
+    return bool(STEAM_ID_PATTERN.fullmatch(str(steam_id)))
+
 # 计算连续签到奖励
 def calculate_sign_in_reward(consecutive_days):
     config = get_config()
@@ -107,8 +246,19 @@ def calculate_sign_in_reward(consecutive_days):
     
     return reward
 
+# 计算签到日期及其边界（返回 签到当地日期, 今日零点UTC时间, 昨日零点UTC时间）
+def get_sign_in_day(now=None):
+    config = get_config()
+    offset = datetime.timedelta(hours=config.SIGN_IN_UTC_OFFSET)
+    now = now or datetime.datetime.utcnow()
+    
+    # 在签到时区中取当天零点，再换算回UTC（数据库中的时间均为UTC）
+    local_day = (now + offset).date()
+    day_start = datetime.datetime.combine(local_day, datetime.time()) - offset
+    return local_day, day_start, day_start - datetime.timedelta(days=1)
+
 # 发送OneBot消息
-def send_onebot_message(message_type, user_id=None, group_id=None, message=None):
+async def send_onebot_message(message_type, user_id=None, group_id=None, message=None, deadline=None):
     config = get_config()
     url = f"{config.ONE_BOT_URL}/send_message"
     
@@ -132,34 +282,44 @@ def send_onebot_message(message_type, user_id=None, group_id=None, message=None)
         headers["Authorization"] = f"Bearer {config.ONE_BOT_ACCESS_TOKEN}"
     
     # 发送请求
-    response = send_api_request(url, method="POST", data=params, headers=headers)
+    started = time.perf_counter()
+    response = await send_api_request(url, method="POST", data=params, headers=headers, deadline=deadline)
+    ONEBOT_SEND_DURATION.observe(time.perf_counter() - started, "send_message")
     
     if response and response.get("status") == "ok":
         logger.info(f"成功发送{message_type}消息到{user_id or group_id}")
         return True
     else:
+        ONEBOT_SEND_FAILURES.inc("send_message")
         logger.error(f"发送消息失败: {response}")
         return False
 
-# 记录命令日志
-def log_command(user_id, group_id, command, arguments, success, result):
-    from database import get_db
-    from models import CommandLogs
-    import datetime
+# 发送一条群消息（不重试），失败抛出OneBotError
+async def send_group_message(group_id, message, timeout=None):
+    config = get_config()
+    headers = {}
+    if config.ONE_BOT_ACCESS_TOKEN:
+        headers["Authorization"] = f"Bearer {config.ONE_BOT_ACCESS_TOKEN}"
     
+    started = time.perf_counter()
     try:
-        db = next(get_db())
-        log_entry = CommandLogs(
-            user_id=str(user_id),
-            group_id=str(group_id) if group_id else None,
-            command=command,
-            arguments=arguments,
-            success=success,
-            result=result[:255] if result else None  # 截断过长的结果
+        return await onebot_client.call(
+            f"{config.ONE_BOT_URL}/send_group_msg",
+            data={"group_id": int(group_id), "message": message},
+            headers=headers,
+            timeout=timeout
         )
-        db.add(log_entry)
-        db.commit()
+    except OneBotError:
+        ONEBOT_SEND_FAILURES.inc("send_group_msg")
+        raise
+    finally:
+        ONEBOT_SEND_DURATION.observe(time.perf_counter() - started, "send_group_msg")
+
+# 记录命令日志（写入缓冲区，由后台任务批量落库）
+def log_command(user_id, group_id, command, arguments, success, result):
+    from log_buffer import command_log_buffer, make_log_entry
+    
+    try:
+        command_log_buffer.append(make_log_entry(user_id, group_id, command, arguments, success, result))
     except Exception as e:
         logger.error(f"记录命令日志失败: {str(e)}")
-    finally:
-        db.close()
\ No newline at end of file